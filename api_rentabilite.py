@@ -0,0 +1,261 @@
+"""Service HTTP local exposant les résultats de rentabilité
+
+La table fusionnée est chargée une fois au démarrage (résultats déjà calculés ou
+pipeline complet sur les fichiers DVF et loyers), avec l'index de recherche et
+le moteur de scénarios. Les réponses JSON des requêtes répétées sont servies par
+un cache LRU borné.
+
+Points d'accès (GET) :
+    /sante                        état du service et du cache
+    /communes/<code_insee>        fiche d'une commune
+    /top?k=20&departement=75,92&tri=rentabilite_nette&min_ventes=3&attractivite=Bonne,Excellente
+    /scenario?taux_credit=0.04&apport=0.2&communes=75056,69123
+    /scenario?duree_credit_ans=25&k=10&critere=cash_flow_mensuel
+
+Usage :
+    python api_rentabilite.py --resultats resultats_rentabilite.csv --port 8000
+    python api_rentabilite.py --dvf ./data/dvf.csv --loyers ./data/loyers.csv --centroides ./data/centroides.csv
+    python api_rentabilite.py --dvf ./data/dvf.zip --loyers ./data/loyers.csv --sql ventes.sqlite --types-local Appartement Maison
+"""
+import argparse
+import functools
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import numpy as np
+
+from app import (
+    IndexRechercheCommunes, MoteurScenarios, PARAMETRES_SCENARIO, charger_analyseur, decoder_codes_insee,
+    encoder_insee, grille_scenarios
+)
+
+TAILLE_CACHE = 4096
+K_MAX = 500
+CRITERES_SCENARIO = ['cash_flow_mensuel', 'rentabilite_nette_nette', 'rentabilite_nette',
+                     'rentabilite_brute', 'delai_recuperation_ans']
+
+
+class RequeteInvalide(ValueError):
+    """Paramètre absent ou mal formé : réponse 400"""
+
+
+class RessourceInconnue(LookupError):
+    """Chemin ou commune inconnus : réponse 404"""
+
+
+def _enregistrements(data):
+    """Lignes d'un DataFrame en dictionnaires JSON (codes INSEE en texte, NaN -> null)"""
+    return json.loads(decoder_codes_insee(data).to_json(orient='records', force_ascii=False))
+
+
+def _liste(valeur):
+    return [v for v in valeur.split(',') if v] if valeur else None
+
+
+def _nombre(parametres, nom, type_=float, defaut=None):
+    if nom not in parametres or parametres[nom] == '':
+        return defaut
+    try:
+        return type_(parametres[nom])
+    except ValueError:
+        raise RequeteInvalide(f"Paramètre {nom} invalide: {parametres[nom]}")
+
+
+class ServiceRentabilite:
+    """Réponses de l'API calculées sur une table fusionnée chargée une fois
+
+    Les index (recherche, codes INSEE, scénarios) sont construits au démarrage
+    et uniquement lus ensuite : les threads du serveur les partagent sans verrou.
+    """
+
+    def __init__(self, analyseur, taille_cache=TAILLE_CACHE):
+        self.analyseur = analyseur
+        self.data = analyseur.data_merged.reset_index(drop=True)
+        self.index_recherche = IndexRechercheCommunes(self.data)
+        self.codes = self.data['insee_code'].to_numpy()
+        self.ordre_codes = np.argsort(self.codes, kind='stable')
+        self.moteur = MoteurScenarios(self.data) if 'surface_moyenne' in self.data.columns else None
+        self.demarrage = time.time()
+        self.repondre = functools.lru_cache(maxsize=taille_cache)(self._repondre)
+
+    def _positions(self, codes):
+        """Positions des communes dans la table (RessourceInconnue si l'une est absente)"""
+        demandes = encoder_insee(codes)
+        if not len(self.codes):
+            raise RessourceInconnue(f"Communes inconnues: {list(codes)}")
+        rangs = np.searchsorted(self.codes, demandes, sorter=self.ordre_codes).clip(max=len(self.codes) - 1)
+        positions = self.ordre_codes[rangs]
+        absents = self.codes[positions] != demandes
+        if absents.any():
+            raise RessourceInconnue(f"Communes inconnues: {list(np.asarray(codes)[absents])}")
+        return positions
+
+    def _repondre(self, chemin, parametres):
+        """(statut HTTP, corps JSON encodé) pour un chemin et des paramètres triés"""
+        try:
+            corps = self._router(chemin, dict(parametres))
+            statut = 200
+        except RequeteInvalide as e:
+            statut, corps = 400, {'erreur': str(e)}
+        except RessourceInconnue as e:
+            statut, corps = 404, {'erreur': str(e)}
+        return statut, json.dumps(corps, ensure_ascii=False).encode('utf-8')
+
+    def _router(self, chemin, parametres):
+        morceaux = [unquote(m) for m in chemin.strip('/').split('/') if m]
+        if morceaux == ['sante']:
+            return self.sante()
+        if len(morceaux) == 2 and morceaux[0] == 'communes':
+            return self.commune(morceaux[1])
+        if morceaux == ['top']:
+            return self.top(parametres)
+        if morceaux == ['scenario']:
+            return self.scenario(parametres)
+        raise RessourceInconnue(f"Chemin inconnu: {chemin}")
+
+    def sante(self):
+        cache = self.repondre.cache_info()
+        return {
+            'communes': len(self.data),
+            'scenarios': self.moteur is not None,
+            'cache': {'entrees': cache.currsize, 'taille_max': cache.maxsize, 'succes': cache.hits, 'echecs': cache.misses},
+            'actif_depuis_s': round(time.time() - self.demarrage, 1)
+        }
+
+    def commune(self, code):
+        return _enregistrements(self.data.iloc[self._positions([code])])[0]
+
+    def top(self, parametres):
+        """Communes filtrées et triées (voir IndexRechercheCommunes.rechercher)"""
+        k = _nombre(parametres, 'k', int, 20)
+        if not 0 < k <= K_MAX:
+            raise RequeteInvalide(f"k doit être compris entre 1 et {K_MAX}")
+        tri = parametres.get('tri', 'rentabilite_brute')
+        try:
+            resultats, total = self.index_recherche.rechercher(
+                departement=_liste(parametres.get('departement')),
+                attractivite=_liste(parametres.get('attractivite')),
+                prix_m2_max=_nombre(parametres, 'prix_m2_max'),
+                budget_max=_nombre(parametres, 'budget_max'),
+                surface_m2=_nombre(parametres, 'surface_m2'),
+                min_ventes=_nombre(parametres, 'min_ventes', int),
+                rentabilite_min=_nombre(parametres, 'rentabilite_min'),
+                tri=tri,
+                croissant=parametres.get('croissant', '0') in ('1', 'true', 'oui'),
+                page=_nombre(parametres, 'page', int, 0),
+                taille_page=k
+            )
+        except (ValueError, KeyError) as e:
+            raise RequeteInvalide(str(e))
+        return {'total': total, 'communes': _enregistrements(resultats)}
+
+    def scenario(self, parametres):
+        """Indicateurs d'un scénario pour une liste de communes ou les k meilleures
+
+        Paramètres du scénario : ceux de PARAMETRES_SCENARIO (valeurs par défaut
+        sinon), surface_m2 pour un bien de surface fixe.
+        """
+        if self.moteur is None:
+            raise RessourceInconnue("Évaluation de scénarios indisponible (surface moyenne absente)")
+        valeurs = {}
+        for nom, defaut in PARAMETRES_SCENARIO.items():
+            if nom in parametres:
+                valeurs[nom] = parametres[nom] if isinstance(defaut, str) else _nombre(parametres, nom, type(defaut))
+        critere = parametres.get('critere', 'cash_flow_mensuel')
+        if critere not in CRITERES_SCENARIO:
+            raise RequeteInvalide(f"Critère inconnu: {critere}")
+
+        surface_m2 = _nombre(parametres, 'surface_m2')
+        moteur = self.moteur if surface_m2 is None else MoteurScenarios(self.data, surface_m2)
+        scenarios = grille_scenarios(**valeurs)
+        try:
+            resultats = moteur.evaluer(scenarios)
+        except ValueError as e:
+            raise RequeteInvalide(str(e))
+
+        codes = _liste(parametres.get('communes'))
+        if codes:
+            positions = self._positions(codes)
+            communes = moteur.communes.iloc[positions].copy()
+            for nom, tableau in resultats.items():
+                communes[nom] = tableau[positions, 0]
+        else:
+            k = _nombre(parametres, 'k', int, 20)
+            if not 0 < k <= K_MAX:
+                raise RequeteInvalide(f"k doit être compris entre 1 et {K_MAX}")
+            communes = moteur.meilleures_communes(resultats, 0, n=k, critere=critere)
+
+        communes = communes.replace([np.inf, -np.inf], np.nan)
+        return {
+            'scenario': json.loads(scenarios.iloc[0].to_json()),
+            'synthese': json.loads(moteur.synthese(scenarios, resultats).iloc[0].to_json()),
+            'communes': _enregistrements(communes)
+        }
+
+
+def creer_serveur(service, hote='127.0.0.1', port=8000, journal=False):
+    """Serveur HTTP multi-thread (connexions persistantes HTTP/1.1) autour du service"""
+
+    class Gestionnaire(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # En-têtes et corps écrits séparément : sans cela, Nagle et l'accusé de
+        # réception différé ajoutent ~40 ms par requête sur connexion persistante
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            parametres = tuple(sorted(parse_qsl(url.query)))
+            chemin = url.path.rstrip('/') or '/'
+            # L'état du service n'est jamais servi depuis le cache
+            repondre = service._repondre if chemin == '/sante' else service.repondre
+            try:
+                statut, corps = repondre(chemin, parametres)
+            except Exception as e:
+                # Hors du cache LRU : une erreur interne n'est jamais resservie
+                print(f"❌ Erreur interne sur {self.path}: {e!r}")
+                statut = 500
+                corps = json.dumps({'erreur': f"Erreur interne: {e}"}, ensure_ascii=False).encode('utf-8')
+            self.send_response(statut)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(corps)))
+            self.end_headers()
+            self.wfile.write(corps)
+
+        def log_message(self, format, *args):
+            if journal:
+                super().log_message(format, *args)
+
+    serveur = ThreadingHTTPServer((hote, port), Gestionnaire)
+    serveur.daemon_threads = True
+    return serveur
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API HTTP locale des résultats de rentabilité")
+    parser.add_argument('--resultats', help="table de résultats (CSV ';' du mode ligne de commande ou Parquet)")
+    parser.add_argument('--dvf', default='./data/dvf.csv')
+    parser.add_argument('--loyers', default='./data/loyers.csv')
+    parser.add_argument('--taille-bloc', type=int, default=None, help="lecture du DVF par blocs")
+    parser.add_argument('--dossier-cache', default='cache')
+    parser.add_argument('--sql', help="base SQLite de travail : agrégation hors mémoire du DVF")
+    parser.add_argument('--types-local', nargs='+', default=['Appartement'], help="types de biens (avec --sql)")
+    parser.add_argument('--centroides', help="référentiel CSV des centroïdes : prix complétés par les communes voisines")
+    parser.add_argument('--hote', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--taille-cache', type=int, default=TAILLE_CACHE, help="réponses gardées en cache LRU")
+    parser.add_argument('--journal', action='store_true', help="journaliser chaque requête")
+    args = parser.parse_args()
+
+    analyseur = charger_analyseur(args.resultats, args.dvf, args.loyers, args.taille_bloc,
+                                  args.dossier_cache, args.sql, args.types_local, args.centroides)
+    service = ServiceRentabilite(analyseur, args.taille_cache)
+    serveur = creer_serveur(service, args.hote, args.port, args.journal)
+    print(f"🚀 API disponible sur http://{args.hote}:{args.port} ({len(service.data)} communes)")
+    try:
+        serveur.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹️ Arrêt du service")
+    finally:
+        serveur.server_close()
@@ -9,26 +9,2333 @@ from plotly.subplots import make_subplots
 import time
 import requests
 import json
+import os
+import hashlib
+import html
+import io
+import functools
+import resource
+import platform
+import itertools
+import sqlite3
+import tempfile
+import threading
+import zipfile
+import collections
+import contextlib
+import copy
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from geopy.geocoders import Nominatim
+from pandas.api.types import union_categoricals
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # scipy optionnel : index spatial par grille NumPy
+    cKDTree = None
 import warnings
 warnings.filterwarnings('ignore')
 
+# Colonnes DVF utilisées par le pipeline et types compacts pour la lecture par blocs
+COLONNES_DVF = {
+    'Valeur fonciere': 'float64',
+    'Surface Carrez du 1er lot': 'float64',
+    'Type local': 'category',
+    'Code departement': 'category',
+    'Code commune': 'category',
+    'Commune': 'category',
+    'Code postal': 'category',
+    'annee': 'Int16',
+    'Date mutation': 'str',
+    'Nombre pieces principales': 'str',
+    # Colonnes des exports officiels bruts, filtrées à la lecture puis retirées
+    'Nature mutation': 'category',
+    'Nombre de lots': 'float64'
+}
+COLONNES_FILTRES_DVF = ['Nature mutation', 'Nombre de lots']
+# Séparateurs possibles : exports officiels '|', exports du notebook ';'
+SEPARATEURS_DVF = ['|', ';', '\t', ',']
+TAILLE_ECHANTILLON_FORMAT = 1 << 16
+TAILLE_BLOC_DVF = 500_000
+# Texte à faible cardinalité stocké en catégories (codes entiers + dictionnaire)
+COLONNES_CATEGORIELLES_DVF = ['Type local', 'Code departement', 'Code commune', 'Commune', 'Code postal']
+
+# Statistiques robustes par commune : exclusion des prix au m² aberrants (score MAD)
+SEUIL_MAD_ABERRANT = 3.5
+PROPORTION_TRONQUEE = 0.1   # part retirée de chaque côté pour la moyenne tronquée
+MIN_VENTES_ABERRANTS = 4    # en dessous, aucune vente n'est écartée
+
+# Communes à faible nombre de ventes : prix complété par celui des communes voisines
+MIN_VENTES_FIABLES = 3
+VOISINS_EMPRUNT = 8
+RAYON_EMPRUNT_KM = 20
+DISTANCE_MIN_KM = 1.0   # plancher des distances pour les poids en 1/distance
+RAYON_TERRE_KM = 6371.0
+
+# Référentiel des centroïdes du mode ligne de commande (prix des communes voisines)
+FICHIER_CENTROIDES = './data/centroides.csv'
+
+# Cache Parquet des données nettoyées (à incrémenter si le nettoyage change)
+DOSSIER_CACHE = 'cache'
+VERSION_NETTOYAGE = 5
+# Artefacts mis en cache et sources dont ils dépendent : la clé ne combine que les
+# empreintes de ces sources, une mise à jour des loyers garde les agrégats DVF
+DEPENDANCES_CACHE = {
+    'dvf': ['dvf'],
+    'loyers': ['loyers'],
+    'prix_moyens': ['dvf'],
+    'cube_prix': ['dvf'],
+    'distribution_ventes': ['dvf']
+}
+
+# Paramètres d'investissement par défaut des scénarios (taux en fraction)
+PARAMETRES_SCENARIO = {
+    'taux_credit': 0.035,       # taux annuel du prêt
+    'duree_credit_ans': 20,
+    'apport': 0.10,             # part du coût total (prix + notaire) financée en apport
+    'frais_notaire': 0.08,      # part du prix d'achat
+    'taxe_fonciere': 0.08,      # part du loyer annuel brut
+    'vacance': 0.05,            # part du loyer annuel non perçue
+    'frais_gestion': 0.07,      # part des loyers encaissés
+    'regime_fiscal': 'micro_foncier',
+    'tmi': 0.30                 # tranche marginale d'imposition
+}
+PRELEVEMENTS_SOCIAUX = 0.172
+ABATTEMENTS_FISCAUX = {'micro_foncier': 0.30, 'micro_bic': 0.50}
+REGIMES_FISCAUX = ['micro_foncier', 'micro_bic', 'reel']
+
+# Rendu de la carte : marqueurs individuels, regroupement (cluster) ou grille agrégée
+SEUIL_CARTE_CLUSTER = 1000
+SEUIL_CARTE_GRILLE = 50_000
+PAS_GRILLE_CARTE = 0.1  # degrés
+# Graphiques : au-delà du seuil, histogrammes et densité précalculés et nuage
+# échantillonné en WebGL (taille de la figure bornée)
+SEUIL_GRAPHIQUES_AGREGES = 5000
+POINTS_NUAGE_MAX = 5000
+NB_CLASSES_HISTOGRAMME = 50
+NB_MAILLES_DENSITE = 80
+SCORE_POINT_ATYPIQUE = 3.0  # écart à la médiane en intervalles interquartiles
+SEUILS_RENTABILITE = [2, 4, 6, 8]
+# Rentabilité nette estimée sans scénario : part de la rentabilité brute
+RATIO_RENTABILITE_NETTE = 0.85
+COULEURS_RENTABILITE = ['darkred', 'red', 'orange', 'lightgreen', 'green']
+CLASSES_ATTRACTIVITE = ['Faible', 'Correcte', 'Bonne', 'Très bonne', 'Excellente']
+RENDEMENT_CIBLE = 6.0  # rendement brut visé par vente (%), seuil de la classe « Très bonne »
+
+# Marqueur construit côté navigateur : [lat, lon, commune, prix, loyer, rentabilité, classe]
+# Popup en nœuds DOM (textContent) : les noms de communes ne sont jamais interprétés en HTML
+CALLBACK_CARTE_CLUSTER = """
+function (row) {
+    var couleurs = %s;
+    var classes = %s;
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: 8, color: 'black', weight: 1, fillColor: couleurs[row[6]], fillOpacity: 0.8
+    });
+    var popup = document.createElement('div');
+    [
+        [row[2], true],
+        ['Prix achat: ' + row[3] + '€/m²', false],
+        ['Loyer: ' + row[4] + '€/m²/mois', false],
+        ['Rentabilité brute: ' + row[5] + '%%', true],
+        ['Attractivité: ' + classes[row[6]], false]
+    ].forEach(function (ligne) {
+        var element = document.createElement(ligne[1] ? 'b' : 'span');
+        element.textContent = ligne[0];
+        popup.appendChild(element);
+        popup.appendChild(document.createElement('br'));
+    });
+    marker.bindPopup(popup);
+    return marker;
+};
+""" % (json.dumps(COULEURS_RENTABILITE), json.dumps(CLASSES_ATTRACTIVITE, ensure_ascii=False))
+
+
+def empreinte_fichier(fichier):
+    """Empreinte d'une source : chemin, taille et date pour un fichier disque, hash du contenu sinon"""
+    if isinstance(fichier, (str, os.PathLike)):
+        stat = os.stat(fichier)
+        return f"{os.path.abspath(fichier)}|{stat.st_size}|{stat.st_mtime_ns}"
+    
+    empreinte = hashlib.blake2b(digest_size=16)
+    position = fichier.tell()
+    fichier.seek(0)
+    bloc = fichier.read(1 << 20)
+    while bloc:
+        empreinte.update(bloc.encode('latin-1') if isinstance(bloc, str) else bloc)
+        bloc = fichier.read(1 << 20)
+    fichier.seek(position)
+    return empreinte.hexdigest()
+
+
+def rss_mo():
+    """Mémoire résidente courante du processus en Mo"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        # Hors Linux : pic depuis le démarrage (Ko sous Linux, octets sous macOS)
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / 2**20 if platform.system() == 'Darwin' else maxrss / 2**10
+
+
+def taille_fichier(poignee):
+    """Taille restante à lire d'un fichier ouvert (None si non déterminable)"""
+    try:
+        position = poignee.tell()
+        taille = poignee.seek(0, os.SEEK_END)
+        poignee.seek(position)
+        return taille - position
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def detecter_format_dvf(echantillon, noms_colonnes=None):
+    """Séparateur et format décimal d'un extrait de fichier DVF (octets du début)
+
+    Le séparateur est le plus fréquent de la première ligne ; la virgule
+    décimale est détectée sur les valeurs foncières des lignes suivantes.
+    noms_colonnes : en-tête d'une tranche de fichier qui n'en contient pas.
+    """
+    lignes = echantillon.decode('latin-1').splitlines()
+    if len(lignes) > 1 and not echantillon.endswith((b'\n', b'\r')):
+        lignes = lignes[:-1]  # dernière ligne tronquée
+    sep = max(SEPARATEURS_DVF, key=lignes[0].count) if lignes else ';'
+    colonnes = noms_colonnes or (lignes[0].split(sep) if lignes else [])
+    
+    decimal = ','
+    if sep == ',':
+        decimal = '.'  # la virgule sépare déjà les champs
+    elif 'Valeur fonciere' in colonnes:
+        i = colonnes.index('Valeur fonciere')
+        valeurs = [champs[i] for champs in (l.split(sep) for l in lignes[0 if noms_colonnes else 1:]) if len(champs) > i]
+        if valeurs and not any(',' in v for v in valeurs):
+            decimal = '.'
+    return {'sep': sep, 'decimal': decimal}
+
+
+@contextlib.contextmanager
+def ouvrir_dvf(fichier, noms_colonnes=None):
+    """Ouvre un fichier DVF texte ou une archive zip officielle, décompressée en flux
+
+    Produit (flux binaire, format {'sep', 'decimal', 'archive'}, avancement) où
+    avancement() donne la part du fichier (compressé) déjà lue, ou vaut None si
+    la taille est inconnue. Seul le plus gros membre d'une archive est lu.
+    """
+    ouvert_ici = isinstance(fichier, (str, os.PathLike))
+    poignee = open(fichier, 'rb') if ouvert_ici else fichier
+    archive = flux = depart = None
+    try:
+        taille = taille_fichier(poignee)
+        depart = poignee.tell() if taille is not None else None
+        est_archive = taille is not None and poignee.read(4) == b'PK\x03\x04'
+        
+        if taille is None:
+            # Flux sans retour arrière (tranche de fichier) : extrait lu sans le consommer
+            echantillon = poignee.peek(TAILLE_ECHANTILLON_FORMAT)
+            flux = poignee
+        elif est_archive:
+            poignee.seek(depart)
+            archive = zipfile.ZipFile(poignee)
+            membre = max((m for m in archive.infolist() if not m.is_dir()), key=lambda m: m.file_size)
+            with archive.open(membre) as extrait:
+                echantillon = extrait.read(TAILLE_ECHANTILLON_FORMAT)
+            flux = archive.open(membre)
+        else:
+            poignee.seek(depart)
+            echantillon = poignee.read(TAILLE_ECHANTILLON_FORMAT)
+            poignee.seek(depart)
+            flux = poignee
+        
+        format_source = detecter_format_dvf(echantillon, noms_colonnes)
+        format_source['archive'] = est_archive
+        avancement = (lambda: min((poignee.tell() - depart) / taille, 1.0)) if taille else None
+        yield flux, format_source, avancement
+    finally:
+        if archive is not None:
+            if flux is not None:
+                flux.close()
+            archive.close()
+        if ouvert_ici:
+            poignee.close()
+        elif depart is not None:
+            poignee.seek(depart)  # fichier fourni par l'appelant rendu à sa position
+
+
+class MesuresPipeline:
+    """Mesures des étapes du pipeline et diffusion d'événements aux écouteurs
+
+    Chaque étape enregistre temps réel, temps CPU, variation de mémoire résidente,
+    lignes en entrée/sortie et lignes exclues par chaque filtre. Les écouteurs
+    reçoivent (evenement, mesure) avec evenement dans 'debut', 'progression', 'fin'.
+
+    Plusieurs threads peuvent mesurer en même temps (travail d'analyse et
+    interface) : chaque thread a sa pile d'étapes en cours, l'historique est
+    partagé sous verrou et borné aux MAX_ETAPES dernières étapes.
+    """
+    
+    MAX_ETAPES = 1000
+    
+    def __init__(self):
+        self.etapes = collections.deque(maxlen=self.MAX_ETAPES)
+        self.ecouteurs = []
+        self.verrou = threading.Lock()
+        self._local = threading.local()
+    
+    @property
+    def pile(self):
+        """Étapes en cours du thread appelant"""
+        if not hasattr(self._local, 'pile'):
+            self._local.pile = []
+        return self._local.pile
+    
+    def ajouter_ecouteur(self, ecouteur):
+        with self.verrou:
+            self.ecouteurs.append(ecouteur)
+    
+    def retirer_ecouteur(self, ecouteur):
+        with self.verrou:
+            if ecouteur in self.ecouteurs:
+                self.ecouteurs.remove(ecouteur)
+    
+    def _notifier(self, evenement, mesure):
+        with self.verrou:
+            ecouteurs = list(self.ecouteurs)
+        for ecouteur in ecouteurs:
+            ecouteur(evenement, mesure)
+    
+    def terminees(self):
+        """Copie des mesures des étapes terminées, dans l'ordre de début"""
+        with self.verrou:
+            return [m for m in self.etapes if 'temps_s' in m]
+    
+    def debut(self, nom, lignes_entree=None):
+        mesure = {
+            'etape': nom,
+            'niveau': len(self.pile),
+            'lignes_entree': lignes_entree,
+            'lignes_sortie': None,
+            'filtres': {},
+            'progression': 0.0,
+            '_debut': (time.perf_counter(), time.process_time(), rss_mo())
+        }
+        with self.verrou:
+            self.etapes.append(mesure)
+        self.pile.append(mesure)
+        self._notifier('debut', mesure)
+        return mesure
+    
+    def fin(self, mesure, lignes_sortie=None, succes=True, erreur=None):
+        debut, debut_cpu, debut_rss = mesure.pop('_debut')
+        mesure.update({
+            'temps_s': round(time.perf_counter() - debut, 4),
+            'cpu_s': round(time.process_time() - debut_cpu, 4),
+            'memoire_delta_mo': round(rss_mo() - debut_rss, 1),
+            'lignes_sortie': lignes_sortie,
+            'progression': 1.0,
+            'succes': succes and erreur is None
+        })
+        if erreur is not None:
+            mesure['erreur'] = erreur
+        self.pile.remove(mesure)
+        self._notifier('fin', mesure)
+    
+    def progression(self, fraction):
+        """Avancement (0 à 1) de l'étape en cours, pour les étapes longues"""
+        if self.pile:
+            mesure = self.pile[-1]
+            mesure['progression'] = fraction
+            self._notifier('progression', mesure)
+    
+    def filtre(self, nom, exclus):
+        """Cumule les lignes exclues par un filtre dans l'étape en cours"""
+        if self.pile:
+            filtres = self.pile[-1]['filtres']
+            filtres[nom] = filtres.get(nom, 0) + int(exclus)
+    
+    def tableau(self):
+        """Une ligne par étape terminée"""
+        lignes = [
+            {
+                'etape': m['etape'], 'niveau': m['niveau'], 'temps_s': m['temps_s'],
+                'cpu_s': m['cpu_s'], 'memoire_delta_mo': m['memoire_delta_mo'],
+                'lignes_entree': m['lignes_entree'], 'lignes_sortie': m['lignes_sortie'],
+                'lignes_exclues': sum(m['filtres'].values()), 'succes': m['succes']
+            }
+            for m in self.terminees()
+        ]
+        return pd.DataFrame(lignes).astype({'lignes_entree': 'Int64', 'lignes_sortie': 'Int64'})
+    
+    def exporter_json(self, chemin=None):
+        contenu = json.dumps(
+            self.terminees(), indent=2, ensure_ascii=False, default=str
+        )
+        if chemin:
+            with open(chemin, 'w', encoding='utf-8') as f:
+                f.write(contenu)
+        return contenu
+
+
+def _nb_lignes(data):
+    return len(data) if isinstance(data, pd.DataFrame) else None
+
+
+def etape_mesuree(nom, entree=None, sortie=None):
+    """Enregistre l'exécution d'une méthode du pipeline dans self.mesures
+
+    entree/sortie : attribut DataFrame compté avant/après l'étape ;
+    sortie='resultat' compte les lignes du DataFrame retourné.
+    """
+    def decorateur(methode):
+        @functools.wraps(methode)
+        def enveloppe(self, *args, **kwargs):
+            mesure = self.mesures.debut(nom, _nb_lignes(getattr(self, entree, None)) if entree else None)
+            try:
+                resultat = methode(self, *args, **kwargs)
+            except Exception as e:
+                self.mesures.fin(mesure, erreur=str(e))
+                raise
+            
+            if sortie == 'resultat':
+                lignes_sortie = _nb_lignes(resultat)
+            else:
+                lignes_sortie = _nb_lignes(getattr(self, sortie, None)) if sortie else None
+            self.mesures.fin(mesure, lignes_sortie, succes=resultat is not False and resultat is not None)
+            return resultat
+        return enveloppe
+    return decorateur
+
+
+def encoder_insee(codes):
+    """Codes INSEE texte -> int32 (-1 si invalide)
+
+    La Corse est encodée dans la plage libre du département 20 : 2A -> 20xxx,
+    2B -> 205xx (numéros de communes corses uniques et inférieurs à 500).
+    Le calcul porte sur les valeurs distinctes uniquement ; des codes déjà
+    entiers sont retournés tels quels.
+    """
+    codes = np.asarray(codes)
+    if np.issubdtype(codes.dtype, np.integer):
+        return codes.astype('int32')
+    indices, uniques = pd.factorize(codes)
+    # Codes relus en nombres décimaux ('1001.0') ramenés à leur partie entière
+    uniques = pd.Series(uniques).astype(str).str.strip().str.upper().str.replace(r'\.0+$', '', regex=True)
+    # Vides et formats autres que 5 chiffres ou 2A/2B suivis de 3 chiffres : invalides
+    valides = (uniques != '') & uniques.str.zfill(5).str.fullmatch(r'\d{5}|2[AB]\d{3}')
+    uniques = uniques.str.zfill(5).where(valides, '')
+    valeurs = pd.to_numeric(uniques.str.replace(r'^2[AB]', '20', regex=True), errors='coerce')
+    valeurs = valeurs + np.where(uniques.str.startswith('2B'), 500, 0)
+    valeurs = valeurs.fillna(-1).to_numpy(dtype='int32')
+    return np.where(indices >= 0, valeurs[indices], -1).astype('int32')
+
+
+def decoder_insee(valeurs):
+    """Entiers issus de encoder_insee -> codes INSEE texte à 5 caractères (None si invalide)"""
+    valeurs = np.asarray(valeurs)
+    indices, uniques = pd.factorize(valeurs)
+    textes = pd.Series(uniques).astype(str).str.zfill(5).astype(object)
+    textes[uniques < 0] = None
+    corse_a = (uniques >= 20000) & (uniques < 20500)
+    corse_b = (uniques >= 20500) & (uniques < 21000)
+    textes[corse_a] = '2A' + pd.Series(uniques[corse_a] - 20000).astype(str).str.zfill(3).to_numpy()
+    textes[corse_b] = '2B' + pd.Series(uniques[corse_b] - 20500).astype(str).str.zfill(3).to_numpy()
+    return textes.to_numpy()[indices]
+
+
+def code_insee_dvf(departements, communes):
+    """Code INSEE entier (format encoder_insee) depuis les colonnes DVF département et commune
+
+    Le département est réduit à ses deux premiers caractères : pour les DOM,
+    le DVF donne 971 et 101 pour la commune 97101. Les conversions texte ne
+    portent que sur les valeurs distinctes de chaque colonne.
+    """
+    dep_indices, dep_uniques = pd.factorize(np.asarray(departements))
+    dep_textes = pd.Series(dep_uniques).astype(str).str.upper().str.zfill(2)
+    dep_valeurs = pd.to_numeric(dep_textes.str[:2].str.replace(r'^2[AB]', '20', regex=True), errors='coerce')
+    dep_valeurs = (dep_valeurs * 1000 + np.where(dep_textes.str.startswith('2B'), 500, 0)).to_numpy()
+    
+    com_indices, com_uniques = pd.factorize(np.asarray(communes))
+    com_valeurs = pd.to_numeric(pd.Series(com_uniques).astype(str), errors='coerce').to_numpy()
+    
+    codes = dep_valeurs.astype('float64')[dep_indices] + com_valeurs.astype('float64')[com_indices]
+    codes[(dep_indices < 0) | (com_indices < 0)] = np.nan
+    return np.nan_to_num(codes, nan=-1).astype('int32')
+
+
+def decoder_codes_insee(data):
+    """Copie pour l'export : codes INSEE entiers remis au format texte à 5 caractères"""
+    data = data.copy()
+    if 'insee_code' in data.columns and np.issubdtype(data['insee_code'].dtype, np.integer):
+        data['insee_code'] = decoder_insee(data['insee_code'].to_numpy())
+    return data
+
+
+def _groupes_denses(cles):
+    """Numéros de groupe denses (ordre croissant des clés) et clés distinctes
+
+    Pour des entiers d'étendue modérée (codes INSEE, années), une table de
+    correspondance indexée remplace le hachage de pd.factorize.
+    """
+    cles = np.asarray(cles)
+    if np.issubdtype(cles.dtype, np.integer) and len(cles):
+        minimum = int(cles.min())
+        etendue = int(cles.max()) - minimum + 1
+        if etendue <= 1 << 24:
+            decalees = (cles - minimum).astype('int64')
+            presentes = np.bincount(decalees, minlength=etendue) > 0
+            correspondance = np.cumsum(presentes) - 1
+            return correspondance[decalees], np.flatnonzero(presentes) + minimum
+    groupes, uniques = pd.factorize(cles, sort=True)
+    return groupes, np.asarray(uniques)
+
+
+def _tri_par_groupe(groupes, valeurs):
+    """Ordre des lignes par (groupe, valeur) pour des numéros de groupe denses et des valeurs positives
+
+    Un seul tri sur une clé int64 : numéro de groupe dans les bits de poids fort,
+    puis la représentation binaire du flottant (croissante pour des valeurs
+    positives) tronquée de ses bits de mantisse les plus faibles. Deux valeurs
+    d'écart relatif inférieur à 2^-36 environ peuvent ressortir dans le désordre,
+    ce qui reste sans effet sur les statistiques. Bien moins cher qu'un lexsort.
+    """
+    bits_groupe = max(int(groupes.max(initial=0)).bit_length(), 1)
+    cle = groupes.astype('int64') << (63 - bits_groupe)
+    cle |= np.asarray(valeurs, dtype='float64').view('int64') >> bits_groupe
+    return np.argsort(cle)
+
+
+def _ecarts_kiemes(x, debuts, n, mediane, k):
+    """k-ième plus petit écart |x - médiane| de chaque segment trié (k à partir de 1)
+
+    Dans un segment trié, les écarts à gauche de la médiane décroissent et ceux
+    de droite croissent : ce sont deux suites triées, dont le k-ième élément
+    commun se trouve par recherche dichotomique, pour tous les segments à la fois
+    (O(log n) passes sur les segments, sans trier les écarts).
+    """
+    gauche = n // 2
+    droite = n - gauche
+    
+    def ecart_gauche(i):  # i-ième écart croissant à gauche
+        return mediane - x[np.clip(debuts + gauche - 1 - i, 0, len(x) - 1)]
+    
+    def ecart_droite(j):
+        return x[np.clip(debuts + gauche + j, 0, len(x) - 1)] - mediane
+    
+    bas = np.maximum(0, k - droite)
+    haut = np.minimum(k, gauche)
+    actifs = bas < haut
+    while actifs.any():
+        i = (bas + haut) // 2
+        avancer = actifs & (ecart_gauche(i) < ecart_droite(k - i - 1))
+        bas = np.where(avancer, i + 1, bas)
+        haut = np.where(actifs & ~avancer, i, haut)
+        actifs = bas < haut
+    
+    i, j = bas, k - bas
+    return np.maximum(
+        np.where(i > 0, ecart_gauche(i - 1), -np.inf),
+        np.where(j > 0, ecart_droite(j - 1), -np.inf)
+    )
+
+
+def _rangs_dans_segments(x, debuts, n, seuils, inclus=False):
+    """Nombre de valeurs de chaque segment trié inférieures au seuil du segment
+
+    Recherche dichotomique menée sur tous les segments à la fois ; avec
+    inclus=True, les valeurs égales au seuil sont comptées.
+    """
+    bas, haut = np.zeros_like(n), n.copy()
+    actifs = bas < haut
+    while actifs.any():
+        milieu = (bas + haut) // 2
+        valeur = x[np.clip(debuts + milieu, 0, len(x) - 1)]
+        avancer = actifs & ((valeur <= seuils) if inclus else (valeur < seuils))
+        bas = np.where(avancer, milieu + 1, bas)
+        haut = np.where(actifs & ~avancer, milieu, haut)
+        actifs = bas < haut
+    return bas
+
+
+def statistiques_robustes(cles, valeurs, proportion_tronquee=PROPORTION_TRONQUEE,
+                          seuil_mad=SEUIL_MAD_ABERRANT, min_ventes=MIN_VENTES_ABERRANTS):
+    """Statistiques robustes par groupe, sur segments contigus après un tri unique
+
+    Les lignes sont triées par (clé, valeur) : médiane, quartiles, bornes IQR
+    et moyenne tronquée se lisent alors par position dans chaque segment, sans
+    boucle sur les groupes, de même que le MAD (médiane des écarts absolus à
+    la médiane, voir _ecarts_kiemes). Une valeur est aberrante si son écart
+    dépasse seuil_mad × 1,4826 × MAD dans un groupe d'au moins min_ventes lignes.
+
+    Retourne (stats par groupe trié par clé, numéro de groupe par ligne,
+    masque des aberrants par ligne), les deux derniers dans l'ordre d'origine.
+    """
+    groupes, uniques = _groupes_denses(cles)
+    valeurs = np.asarray(valeurs, dtype='float64')
+    ordre = _tri_par_groupe(groupes, valeurs)
+    x = valeurs[ordre]
+    
+    n = np.bincount(groupes, minlength=len(uniques))
+    debuts = np.r_[0, np.cumsum(n)[:-1]].astype(int) if len(n) else np.array([], dtype=int)
+    
+    def quantile(donnees, q):
+        # Interpolation linéaire, comme pandas
+        position = (n - 1) * q
+        bas = np.floor(position).astype(int)
+        haut = np.ceil(position).astype(int)
+        return donnees[debuts + bas] + (donnees[debuts + haut] - donnees[debuts + bas]) * (position - bas)
+    
+    mediane = quantile(x, 0.5)
+    q1, q3 = quantile(x, 0.25), quantile(x, 0.75)
+    
+    mad = (
+        _ecarts_kiemes(x, debuts, n, mediane, (n - 1) // 2 + 1) +
+        _ecarts_kiemes(x, debuts, n, mediane, n // 2 + 1)
+    ) / 2
+    
+    # Moyenne tronquée par différence de sommes cumulées
+    k = np.floor(n * proportion_tronquee).astype(int)
+    cumul = np.r_[0, np.cumsum(x)]
+    moyenne_tronquee = (cumul[debuts + n - k] - cumul[debuts + k]) / (n - 2 * k)
+    
+    # Segment trié : les aberrants forment un préfixe et un suffixe du segment
+    echelle = seuil_mad * 1.4826 * mad
+    controle = (n >= min_ventes) & (echelle > 0)
+    nb_bas = np.where(controle, _rangs_dans_segments(x, debuts, n, mediane - echelle), 0)
+    nb_haut = np.where(controle, n - _rangs_dans_segments(x, debuts, n, mediane + echelle, inclus=True), 0)
+    
+    marques = np.zeros(len(x) + 1, dtype='int8')
+    for positions, signe in [(debuts, 1), (debuts + nb_bas, -1), (debuts + n - nb_haut, 1), (debuts + n, -1)]:
+        np.add.at(marques, positions, signe)
+    aberrant_trie = np.cumsum(marques[:-1]) > 0
+    
+    stats = pd.DataFrame({
+        'cle': uniques,
+        'nb': n,
+        'mediane': mediane,
+        'q1': q1,
+        'q3': q3,
+        'borne_basse': q1 - 1.5 * (q3 - q1),
+        'borne_haute': q3 + 1.5 * (q3 - q1),
+        'mad': mad,
+        'moyenne_tronquee': moyenne_tronquee,
+        'nb_aberrants': nb_bas + nb_haut,
+        # Première ligne du groupe dans l'ordre d'origine (équivalent de groupby 'first')
+        'premiere_ligne': np.minimum.reduceat(ordre, debuts) if len(x) else np.array([], dtype=int)
+    })
+    
+    aberrant = np.empty(len(x), dtype=bool)
+    aberrant[ordre] = aberrant_trie
+    return stats, groupes, aberrant
+
+
+# Colonnes du DVF nettoyé nécessaires à agreger_prix_communes
+COLONNES_AGREGATION = [
+    'insee_code', 'Commune', 'prix_m2', 'Valeur fonciere', 'Surface Carrez du 1er lot',
+    'Code postal', 'Code departement', 'annee'
+]
+
+
+def agreger_prix_communes(dvf):
+    """Prix par commune depuis le DVF nettoyé, ventes aberrantes de chaque commune écartées
+
+    Retourne (prix moyens au format de calculer_prix_moyens_par_commune,
+    masque des ventes aberrantes dans l'ordre de dvf). Médiane, quartiles et MAD
+    portent sur toutes les ventes ; moyennes et nb_ventes sur les ventes retenues.
+    """
+    stats, groupes, aberrant = statistiques_robustes(
+        encoder_insee(dvf['insee_code']), dvf['prix_m2'].to_numpy(dtype='float64')
+    )
+    retenu = ~aberrant
+    nb_groupes = len(stats)
+    nb = np.bincount(groupes, weights=retenu, minlength=nb_groupes).astype('int64')
+    
+    def moyenne(col):
+        poids = np.where(retenu, dvf[col].to_numpy(dtype='float64'), 0)
+        return np.bincount(groupes, weights=poids, minlength=nb_groupes) / nb
+    
+    premieres = stats['premiere_ligne'].to_numpy()
+    prix_moyens = pd.DataFrame({
+        'insee_code': stats['cle'].to_numpy(dtype='int32'),
+        'Commune': dvf['Commune'].iloc[premieres].to_numpy(),
+        'prix_m2_moyen': moyenne('prix_m2'),
+        'prix_m2_median': stats['mediane'],
+        'nb_ventes': nb,
+        'valeur_moyenne': moyenne('Valeur fonciere'),
+        'surface_moyenne': moyenne('Surface Carrez du 1er lot'),
+        'code_postal': dvf['Code postal'].iloc[premieres].to_numpy(),
+        'departement': dvf['Code departement'].iloc[premieres].to_numpy()
+    })
+    # Dernière année de ventes : année de référence pour la jointure des loyers
+    if 'annee' in dvf.columns:
+        # Présence (commune, année) par un bincount, puis dernière année présente
+        annees_ventes = dvf['annee'].to_numpy(dtype='float64', na_value=np.nan)
+        connue = ~np.isnan(annees_ventes)
+        codes_annee = np.full(len(annees_ventes), -1)
+        codes_annee[connue], annees = _groupes_denses(annees_ventes[connue].astype('int64'))
+        presence = np.bincount(
+            groupes[connue] * len(annees) + codes_annee[connue], minlength=nb_groupes * len(annees)
+        ).reshape(nb_groupes, len(annees)) > 0
+        derniere = len(annees) - 1 - np.argmax(presence[:, ::-1], axis=1)
+        prix_moyens['annee_ventes'] = pd.array(
+            np.where(presence.any(axis=1), np.asarray(annees)[derniere.clip(max=len(annees) - 1)], np.nan), dtype='Int16'
+        )
+    prix_moyens = prix_moyens.assign(
+        prix_m2_moyenne_tronquee=stats['moyenne_tronquee'],
+        prix_m2_q1=stats['q1'],
+        prix_m2_q3=stats['q3'],
+        prix_m2_mad=stats['mad'],
+        nb_aberrants=stats['nb_aberrants']
+    )
+    return typer_prix_communes(prix_moyens).round(2), aberrant
+
+
+def typer_prix_communes(prix_moyens):
+    """Types de agreger_prix_communes, rétablis aussi après une relecture Parquet
+
+    Parquet ne garde pas les catégories numériques (codes postaux) : sans cela
+    une analyse reprise du cache n'aurait pas les types d'une analyse complète.
+    """
+    prix_moyens['insee_code'] = prix_moyens['insee_code'].astype('int32')
+    if 'annee_ventes' in prix_moyens.columns:
+        prix_moyens['annee_ventes'] = prix_moyens['annee_ventes'].astype('Int16')
+    for col in ['Commune', 'code_postal', 'departement']:
+        if not isinstance(prix_moyens[col].dtype, pd.CategoricalDtype):
+            prix_moyens[col] = pd.Categorical(prix_moyens[col])
+    return prix_moyens
+
+
+class StockAgregatsCommunes:
+    """Statistiques suffisantes par commune, persistées et enrichies lot par lot
+
+    Chaque lot DVF nettoyé est réduit à un histogramme logarithmique des prix au m²
+    par commune : pour chaque seau de largeur relative constante, nombre de ventes,
+    sommes des prix au m², valeurs et surfaces, prix minimal et maximal. Les seaux
+    du lot sont fusionnés par addition dans des tableaux triés par clé
+    (commune, seau), sans regrouper l'historique.
+
+    prix_moyens recalcule à la lecture les statistiques de agreger_prix_communes
+    sur tout l'historique : quantiles, MAD et moyenne tronquée lus dans
+    l'histogramme (erreur relative bornée par `precision`, exacts pour un seau
+    d'une seule valeur), puis ventes aberrantes écartées seau par seau des
+    moyennes et de nb_ventes. Seul un seau à cheval sur une borne d'exclusion
+    peut être mal classé.
+    """
+    
+    VERSION = 2
+    SOMMES = ['prix_m2', 'Valeur fonciere', 'Surface Carrez du 1er lot']
+    COLONNES_SKETCH = ['somme_prix_m2', 'somme_valeur', 'somme_surface']
+    DECALAGE_SEAU = 1 << 31  # numéros de seau (négatifs sous 1 €/m²) en entiers positifs
+    
+    def __init__(self, dossier=None, precision=0.005):
+        self.dossier = dossier
+        self.precision = precision
+        self.log_gamma = np.log((1 + precision) / (1 - precision))
+        self.lots = []
+        
+        # Une ligne par commune, triée par code INSEE (valeurs du premier lot prioritaires)
+        self.communes = pd.DataFrame({
+            'insee_code': np.array([], dtype='int32'), 'Commune': [], 'code_postal': [], 'departement': [],
+            'annee_ventes': np.array([], dtype='float64')
+        })
+        # Une ligne par seau non vide, triée par clé (code INSEE << 32 | seau)
+        self.cles = np.array([], dtype='int64')
+        self.nb = np.array([], dtype='int64')
+        self.sommes = np.zeros((0, len(self.SOMMES)))
+        self.minimum = np.array([], dtype='float64')
+        self.maximum = np.array([], dtype='float64')
+        
+        if dossier and os.path.exists(os.path.join(dossier, 'communes.parquet')):
+            self.charger()
+    
+    def est_vide(self):
+        return not len(self.cles)
+    
+    def ajouter_lot(self, dvf, identifiant=None):
+        """Intègre un lot DVF nettoyé (colonnes de COLONNES_AGREGATION requises, annee facultative)"""
+        if identifiant is not None and identifiant in self.lots:
+            print(f"Lot déjà intégré: {identifiant}")
+            return False
+        
+        codes = encoder_insee(dvf['insee_code'])
+        prix = dvf['prix_m2'].to_numpy(dtype='float64')
+        garder = (codes >= 0) & (prix > 0)
+        if not garder.any():
+            print("Lot vide: aucune vente intégrée")
+            return False
+        if not garder.all():
+            dvf, codes, prix = dvf[garder], codes[garder], prix[garder]
+        
+        # Seaux du lot : un tri, puis réductions par segment de clé
+        seaux = np.ceil(np.log(prix) / self.log_gamma).astype('int64')
+        cles = (codes.astype('int64') << 32) | (seaux + self.DECALAGE_SEAU)
+        ordre = np.argsort(cles, kind='stable')
+        cles = cles[ordre]
+        debuts = np.flatnonzero(np.r_[True, cles[1:] != cles[:-1]])
+        self._fusionner(
+            cles[debuts],
+            np.diff(np.r_[debuts, len(cles)]),
+            np.column_stack([np.add.reduceat(dvf[col].to_numpy(dtype='float64')[ordre], debuts) for col in self.SOMMES]),
+            np.minimum.reduceat(prix[ordre], debuts),
+            np.maximum.reduceat(prix[ordre], debuts)
+        )
+        self._ajouter_communes(dvf, codes)
+        
+        if identifiant is not None:
+            self.lots.append(identifiant)
+        print(f"Lot intégré: {len(dvf)} ventes, {len(self.communes)} communes en stock")
+        return True
+    
+    def _fusionner(self, cles, nb, sommes, minimum, maximum):
+        """Ajoute les seaux d'un lot (clés triées et distinctes) aux tableaux du stock"""
+        position = np.searchsorted(self.cles, cles)
+        present = position < len(self.cles)
+        present[present] = self.cles[position[present]] == cles[present]
+        
+        existants = position[present]
+        self.nb[existants] += nb[present]
+        self.sommes[existants] += sommes[present]
+        self.minimum[existants] = np.minimum(self.minimum[existants], minimum[present])
+        self.maximum[existants] = np.maximum(self.maximum[existants], maximum[present])
+        
+        nouveaux = ~present
+        insertion = position[nouveaux]
+        self.cles = np.insert(self.cles, insertion, cles[nouveaux])
+        self.nb = np.insert(self.nb, insertion, nb[nouveaux])
+        self.sommes = np.insert(self.sommes, insertion, sommes[nouveaux], axis=0)
+        self.minimum = np.insert(self.minimum, insertion, minimum[nouveaux])
+        self.maximum = np.insert(self.maximum, insertion, maximum[nouveaux])
+    
+    def _ajouter_communes(self, dvf, codes):
+        """Libellés des nouvelles communes (première vente du lot) et dernière année de ventes"""
+        groupes, uniques = _groupes_denses(codes)
+        premieres = np.full(len(uniques), len(codes))
+        np.minimum.at(premieres, groupes, np.arange(len(codes)))
+        annees = np.full(len(uniques), np.nan)
+        if 'annee' in dvf.columns:
+            np.fmax.at(annees, groupes, dvf['annee'].to_numpy(dtype='float64', na_value=np.nan))
+        
+        existantes = self.communes['insee_code'].to_numpy()
+        position = np.searchsorted(existantes, uniques)
+        presente = position < len(existantes)
+        presente[presente] = existantes[position[presente]] == uniques[presente]
+        if presente.any():
+            colonne = self.communes.columns.get_loc('annee_ventes')
+            self.communes.iloc[position[presente], colonne] = np.fmax(
+                self.communes['annee_ventes'].to_numpy()[position[presente]], annees[presente]
+            )
+        
+        nouvelles = ~presente
+        if nouvelles.any():
+            lignes = premieres[nouvelles]
+            self.communes = pd.concat([self.communes, pd.DataFrame({
+                'insee_code': uniques[nouvelles].astype('int32'),
+                'Commune': dvf['Commune'].to_numpy()[lignes],
+                'code_postal': dvf['Code postal'].to_numpy()[lignes],
+                'departement': dvf['Code departement'].to_numpy()[lignes],
+                'annee_ventes': annees[nouvelles]
+            })], ignore_index=True).sort_values('insee_code', ignore_index=True)
+    
+    def prix_moyens(self, proportion_tronquee=PROPORTION_TRONQUEE,
+                    seuil_mad=SEUIL_MAD_ABERRANT, min_ventes=MIN_VENTES_ABERRANTS):
+        """Prix par commune sur tout l'historique, au format de agreger_prix_communes"""
+        if self.est_vide():
+            return None
+        groupes = np.searchsorted(self.communes['insee_code'].to_numpy(), (self.cles >> 32).astype('int32'))
+        seaux = (self.cles & 0xFFFFFFFF) - self.DECALAGE_SEAU
+        
+        # Valeur d'un seau : milieu relatif, ramené dans [minimum, maximum] des ventes du seau
+        gamma = np.exp(self.log_gamma)
+        valeur = np.clip(2 * np.exp(seaux * self.log_gamma) / (gamma + 1), self.minimum, self.maximum)
+        
+        nb = self.nb
+        cumul = np.cumsum(nb)
+        n = np.bincount(groupes, weights=nb).astype('int64')
+        base = np.cumsum(n) - n   # ventes des communes précédentes
+        
+        def au_rang(valeurs, cumul, rang):
+            # Valeur de la vente de rang donné (0 = plus petite) de chaque commune
+            return valeurs[np.searchsorted(cumul, base + rang, side='right')]
+        
+        def quantile(valeurs, cumul, q):
+            # Interpolation linéaire, comme pandas
+            position = (n - 1) * q
+            bas, haut = np.floor(position).astype('int64'), np.ceil(position).astype('int64')
+            v_bas, v_haut = au_rang(valeurs, cumul, bas), au_rang(valeurs, cumul, haut)
+            return v_bas + (v_haut - v_bas) * (position - bas)
+        
+        mediane = quantile(valeur, cumul, 0.5)
+        q1, q3 = quantile(valeur, cumul, 0.25), quantile(valeur, cumul, 0.75)
+        
+        # MAD : médiane des écarts à la médiane, seaux retriés par écart dans chaque commune
+        ecarts = np.abs(valeur - mediane[groupes])
+        ordre = _tri_par_groupe(groupes, ecarts)
+        ecarts_tries, cumul_ecarts = ecarts[ordre], np.cumsum(nb[ordre])
+        mad = (au_rang(ecarts_tries, cumul_ecarts, (n - 1) // 2) + au_rang(ecarts_tries, cumul_ecarts, n // 2)) / 2
+        
+        # Moyenne tronquée : somme des r plus petits prix par sommes cumulées des seaux
+        avant = np.r_[0, cumul]
+        prix_avant = np.r_[0, np.cumsum(self.sommes[:, 0])]
+        moyenne_seau = np.r_[self.sommes[:, 0] / nb, 0]
+        
+        def somme_plus_petits(rang):
+            seau = np.searchsorted(cumul, base + rang, side='right')
+            return prix_avant[seau] + (base + rang - avant[seau]) * moyenne_seau[seau]
+        
+        k = np.floor(n * proportion_tronquee).astype('int64')
+        moyenne_tronquee = (somme_plus_petits(n - k) - somme_plus_petits(k)) / (n - 2 * k)
+        
+        # Ventes aberrantes écartées seau par seau, comme dans statistiques_robustes
+        echelle = seuil_mad * 1.4826 * mad
+        controle = (n >= min_ventes) & (echelle > 0)
+        aberrant = controle[groupes] & (
+            (valeur < (mediane - echelle)[groupes]) | (valeur > (mediane + echelle)[groupes])
+        )
+        retenus = np.where(aberrant, 0, nb)
+        nb_ventes = np.bincount(groupes, weights=retenus, minlength=len(n)).astype('int64')
+        
+        def moyenne(colonne):
+            sommes = np.where(aberrant, 0, self.sommes[:, colonne])
+            return np.bincount(groupes, weights=sommes, minlength=len(n)) / nb_ventes
+        
+        communes = self.communes
+        prix_moyens = pd.DataFrame({
+            'insee_code': communes['insee_code'].to_numpy(dtype='int32'),
+            'Commune': communes['Commune'].to_numpy(),
+            'prix_m2_moyen': moyenne(0),
+            'prix_m2_median': mediane,
+            'nb_ventes': nb_ventes,
+            'valeur_moyenne': moyenne(1),
+            'surface_moyenne': moyenne(2),
+            'code_postal': communes['code_postal'].to_numpy(),
+            'departement': communes['departement'].to_numpy(),
+            'annee_ventes': pd.array(communes['annee_ventes'].to_numpy(), dtype='Int16'),
+            'prix_m2_moyenne_tronquee': moyenne_tronquee,
+            'prix_m2_q1': q1,
+            'prix_m2_q3': q3,
+            'prix_m2_mad': mad,
+            'nb_aberrants': n - nb_ventes
+        })
+        for col in ['Commune', 'code_postal', 'departement']:
+            prix_moyens[col] = pd.Categorical(prix_moyens[col])
+        return prix_moyens.round(2)
+    
+    def sauvegarder(self):
+        if not self.dossier or self.est_vide():
+            return False
+        os.makedirs(self.dossier, exist_ok=True)
+        communes = self.communes.copy()
+        # Colonnes texte aux types mélangés (ex. départements 1 et '2A') normalisées pour Parquet
+        for col in communes.select_dtypes(include=['object', 'string']).columns:
+            communes[col] = communes[col].where(communes[col].isna(), communes[col].astype(str))
+        communes.to_parquet(os.path.join(self.dossier, 'communes.parquet'), index=False)
+        pd.DataFrame({
+            'cle': self.cles, 'nb': self.nb,
+            **{col: self.sommes[:, i] for i, col in enumerate(self.COLONNES_SKETCH)},
+            'prix_min': self.minimum, 'prix_max': self.maximum
+        }).to_parquet(os.path.join(self.dossier, 'sketch.parquet'), index=False)
+        with open(os.path.join(self.dossier, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'precision': self.precision, 'lots': self.lots}, f)
+        return True
+    
+    def charger(self):
+        with open(os.path.join(self.dossier, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != self.VERSION:
+            print(f"⚠️ Stock d'agrégats d'un format antérieur ignoré ({self.dossier})")
+            return False
+        self.precision = meta['precision']
+        self.log_gamma = np.log((1 + self.precision) / (1 - self.precision))
+        self.lots = meta['lots']
+        self.communes = pd.read_parquet(os.path.join(self.dossier, 'communes.parquet'))
+        sketch = pd.read_parquet(os.path.join(self.dossier, 'sketch.parquet'))
+        self.cles = sketch['cle'].to_numpy(dtype='int64')
+        self.nb = sketch['nb'].to_numpy(dtype='int64')
+        self.sommes = sketch[self.COLONNES_SKETCH].to_numpy(dtype='float64')
+        self.minimum = sketch['prix_min'].to_numpy(dtype='float64')
+        self.maximum = sketch['prix_max'].to_numpy(dtype='float64')
+        print(f"Stock d'agrégats chargé: {len(self.communes)} communes, {len(self.lots)} lots")
+        return True
+
+
+# Colonnes DVF importées dans la base SQL (nom de colonne SQL, type SQLite)
+COLONNES_SQL_DVF = {
+    'Type local': ('type_local', 'TEXT'),
+    'Nature mutation': ('nature_mutation', 'TEXT'),
+    'Nombre de lots': ('nombre_lots', 'REAL'),
+    'Nombre pieces principales': ('pieces', 'REAL'),
+    'Valeur fonciere': ('valeur', 'REAL'),
+    'Surface Carrez du 1er lot': ('surface', 'REAL'),
+    'Code departement': ('code_departement', 'TEXT'),
+    'Code commune': ('code_commune', 'TEXT'),
+    'Commune': ('commune', 'TEXT'),
+    'Code postal': ('code_postal', 'TEXT'),
+    'annee': ('annee', 'INTEGER')
+}
+# Filtre dont la colonne manque à l'export : valeur qui le laisse passer
+VALEURS_NEUTRES_SQL = {'Nature mutation': 'Vente', 'Nombre de lots': 1.0, 'Nombre pieces principales': 0.0}
+# Filtres de test.ipynb (ventes seules, lot unique, au plus 2 pièces) : appliqués par
+# défaut aux seuls appartements, désactivés dès que d'autres types de biens sont analysés
+FILTRES_NOTEBOOK = {'vente_seule': True, 'lot_unique': True, 'pieces_max': 2}
+SANS_FILTRES_NOTEBOOK = {'vente_seule': False, 'lot_unique': False, 'pieces_max': None}
+CACHE_SQLITE_KO = 65536  # cache de pages borné : tris et tables temporaires sur disque
+TAILLE_LOT_SQL = 20_000
+
+
+class BaseVentesSQL:
+    """Pipeline par commune exécuté dans une base SQLite sur disque
+
+    Le DVF est importé bloc par bloc, puis les filtres de _preparer_appartements,
+    les statistiques robustes de agreger_prix_communes (fonctions de fenêtrage),
+    la jointure de IndexLoyersCommunes et les indicateurs de calculer_rentabilite
+    s'exécutent dans la base. Seule la table par commune revient en DataFrame :
+    la mémoire dépend de la taille des blocs et du cache SQLite, pas du fichier.
+    """
+    
+    def __init__(self, chemin='ventes_dvf.sqlite'):
+        self.chemin = chemin
+        self._connexion = None
+    
+    def connexion(self):
+        if self._connexion is None:
+            self._connexion = sqlite3.connect(self.chemin, check_same_thread=False)
+            for pragma in ('temp_store = FILE', f'cache_size = -{CACHE_SQLITE_KO}',
+                           'journal_mode = OFF', 'synchronous = OFF'):
+                self._connexion.execute(f"PRAGMA {pragma}")
+        return self._connexion
+    
+    def fermer(self):
+        if self._connexion is not None:
+            self._connexion.close()
+            self._connexion = None
+    
+    def importer_dvf(self, fichier_dvf, taille_bloc=TAILLE_BLOC_DVF, progression=None):
+        """Importe les colonnes utiles du DVF (export du notebook, export brut ou zip)
+
+        Remplace les ventes déjà importées ; retourne le nombre de lignes lues.
+        """
+        connexion = self.connexion()
+        connexion.execute("DROP TABLE IF EXISTS dvf")
+        connexion.execute(
+            f"CREATE TABLE dvf ({', '.join(f'{nom} {type_sql}' for nom, type_sql in COLONNES_SQL_DVF.values())})"
+        )
+        insertion = f"INSERT INTO dvf VALUES ({', '.join('?' * len(COLONNES_SQL_DVF))})"
+        types = {col: 'float64' if type_sql == 'REAL' else 'str' for col, (_, type_sql) in COLONNES_SQL_DVF.items()}
+        types.update({'Nombre pieces principales': 'str', 'annee': 'float64', 'Date mutation': 'str'})
+        
+        nb_lignes = 0
+        with ouvrir_dvf(fichier_dvf) as (flux, format_source, avancement):
+            lecteur = pd.read_csv(
+                flux, sep=format_source['sep'], decimal=format_source['decimal'], encoding='latin-1',
+                usecols=lambda col: col in types, dtype=types, chunksize=taille_bloc
+            )
+            for bloc in lecteur:
+                # Typage seulement : les filtres s'appliquent dans la base
+                if 'Nombre pieces principales' in bloc.columns:
+                    bloc['Nombre pieces principales'] = pd.to_numeric(
+                        bloc['Nombre pieces principales'].str.replace(',', '.'), errors='coerce'
+                    )
+                if 'annee' not in bloc.columns and 'Date mutation' in bloc.columns:
+                    bloc['annee'] = pd.to_numeric(bloc['Date mutation'].str[6:10], errors='coerce')
+                for col, valeur in VALEURS_NEUTRES_SQL.items():
+                    if col not in bloc.columns:
+                        bloc[col] = valeur
+                # Insertion par lots : seul un lot à la fois est converti en objets Python ;
+                # valeurs manquantes (NaN) enregistrées comme NULL par SQLite
+                bloc = bloc.reindex(columns=list(COLONNES_SQL_DVF))
+                for debut in range(0, len(bloc), TAILLE_LOT_SQL):
+                    lignes = bloc.iloc[debut:debut + TAILLE_LOT_SQL].astype(object)
+                    connexion.executemany(insertion, lignes.itertuples(index=False, name=None))
+                nb_lignes += len(bloc)
+                if progression and avancement:
+                    progression(avancement())
+        connexion.commit()
+        print(f"Base SQL: {nb_lignes} lignes DVF importées ({self.chemin})")
+        return nb_lignes
+    
+    def importer_loyers(self, data_loyers):
+        """Importe les loyers nettoyés (nettoyer_donnees_loyers), codes INSEE entiers"""
+        loyers = pd.DataFrame({
+            'insee_code': encoder_insee(data_loyers['insee_code']).astype('int64'),
+            'annee': (data_loyers['annee'].to_numpy(dtype='float64', na_value=0).astype('int64')
+                      if 'annee' in data_loyers.columns else 0),
+            'loypredm2': data_loyers['loypredm2'].to_numpy(dtype='float64'),
+            'LIBGEO': data_loyers['LIBGEO'].astype(str).to_numpy(),
+            'DEP': data_loyers['DEP'].astype(str).to_numpy()
+        })
+        connexion = self.connexion()
+        loyers[loyers['insee_code'] >= 0].to_sql('loyers', connexion, if_exists='replace', index=False)
+        connexion.commit()
+        return len(loyers)
+    
+    @staticmethod
+    def _quantile(q):
+        """Quantile à interpolation linéaire sur les rangs r = 0..n-1 d'une commune"""
+        position = f"((n - 1) * {q})"
+        bas = f"CAST({position} AS INTEGER)"
+        valeur_bas = f"MAX(CASE WHEN r = {bas} THEN prix_m2 END)"
+        valeur_haut = f"MAX(CASE WHEN r = {bas} + ({position} > {bas}) THEN prix_m2 END)"
+        return f"{valeur_bas} + ({valeur_haut} - {valeur_bas}) * ({position} - {bas})"
+    
+    @staticmethod
+    def filtres_ventes(types_local, filtres=None):
+        """Filtres de _creer_ventes : FILTRES_NOTEBOOK pour les seuls appartements, aucun sinon
+
+        filtres : valeurs imposées (clés de FILTRES_NOTEBOOK), prioritaires sur ce défaut.
+        """
+        filtres = filtres or {}
+        inconnus = set(filtres) - set(FILTRES_NOTEBOOK)
+        if inconnus:
+            raise ValueError(f"Filtres de ventes inconnus: {sorted(inconnus)}")
+        defaut = FILTRES_NOTEBOOK if tuple(types_local) == ('Appartement',) else SANS_FILTRES_NOTEBOOK
+        return {**defaut, **filtres}
+    
+    def _creer_ventes(self, types_local, filtres=None):
+        """Table temporaire des ventes valides avec prix au m² et code INSEE entier"""
+        filtres = self.filtres_ventes(types_local, filtres)
+        conditions = [f"type_local IN ({', '.join('?' * len(types_local))})"]
+        parametres = list(types_local)
+        if filtres['vente_seule']:
+            conditions.append("nature_mutation LIKE '%vente%'")
+        if filtres['lot_unique']:
+            conditions.append("nombre_lots = 1")
+        if filtres['pieces_max'] is not None:
+            conditions.append("pieces <= ?")
+            parametres.append(filtres['pieces_max'])
+        conditions.append("valeur > 0 AND surface > 0")
+        connexion = self.connexion()
+        # Code INSEE comme code_insee_dvf : département sur 2 caractères, Corse 2A/2B
+        departement = (
+            "substr(CASE WHEN length(trim(code_departement)) < 2 THEN '0' ELSE '' END"
+            " || upper(trim(code_departement)), 1, 2)"
+        )
+        connexion.execute("DROP TABLE IF EXISTS temp.ventes")
+        connexion.execute(f"""
+            CREATE TEMP TABLE ventes AS
+            SELECT rowid AS ligne,
+                   CASE {departement} WHEN '2A' THEN 20000 WHEN '2B' THEN 20500
+                        ELSE CAST({departement} AS INTEGER) * 1000 END
+                   + CAST(CAST(code_commune AS REAL) AS INTEGER) AS insee_code,
+                   annee, valeur, surface, valeur / surface AS prix_m2
+            FROM dvf
+            WHERE {' AND '.join(conditions)}
+        """, parametres)
+        connexion.execute("CREATE INDEX temp.ventes_commune ON ventes (insee_code, prix_m2)")
+        return connexion.execute("SELECT COUNT(*) FROM temp.ventes").fetchone()[0]
+    
+    def _agreger(self, types_local, seuil_mad, proportion_tronquee, filtres=None):
+        """Table temporaire prix : une ligne par commune, colonnes de agreger_prix_communes"""
+        nb_ventes = self._creer_ventes(types_local, filtres)
+        connexion = self.connexion()
+        tronquees = f"CAST(n * {proportion_tronquee} AS INTEGER)"
+        
+        # Rangs des prix : quartiles, médiane, moyenne tronquée
+        connexion.execute("DROP TABLE IF EXISTS temp.rangs")
+        connexion.execute(f"""
+            CREATE TEMP TABLE rangs AS
+            SELECT insee_code, n, MIN(ligne) AS premiere_ligne, MAX(annee) AS annee_ventes,
+                   {self._quantile(0.5)} AS mediane,
+                   {self._quantile(0.25)} AS q1,
+                   {self._quantile(0.75)} AS q3,
+                   AVG(CASE WHEN r >= {tronquees} AND r < n - {tronquees} THEN prix_m2 END) AS moyenne_tronquee
+            FROM (
+                SELECT insee_code, ligne, annee, prix_m2,
+                       ROW_NUMBER() OVER (PARTITION BY insee_code ORDER BY prix_m2) - 1 AS r,
+                       COUNT(*) OVER (PARTITION BY insee_code) AS n
+                FROM temp.ventes
+            )
+            GROUP BY insee_code
+        """)
+        connexion.execute("CREATE UNIQUE INDEX temp.rangs_commune ON rangs (insee_code)")
+        # Rangs des écarts absolus à la médiane : MAD, puis échelle d'exclusion
+        connexion.execute("DROP TABLE IF EXISTS temp.seuils")
+        connexion.execute(f"""
+            CREATE TEMP TABLE seuils AS
+            SELECT g.*, e.mad, {seuil_mad} * 1.4826 * e.mad AS echelle
+            FROM temp.rangs g JOIN (
+                SELECT insee_code,
+                       (MAX(CASE WHEN r = (n - 1) / 2 THEN ecart END) + MAX(CASE WHEN r = n / 2 THEN ecart END)) / 2 AS mad
+                FROM (
+                    SELECT v.insee_code, g.n, abs(v.prix_m2 - g.mediane) AS ecart,
+                           ROW_NUMBER() OVER (PARTITION BY v.insee_code ORDER BY abs(v.prix_m2 - g.mediane)) - 1 AS r
+                    FROM temp.ventes v JOIN temp.rangs g USING (insee_code)
+                )
+                GROUP BY insee_code
+            ) e USING (insee_code)
+        """)
+        connexion.execute("CREATE UNIQUE INDEX temp.seuils_commune ON seuils (insee_code)")
+        # Moyennes sur les ventes retenues, texte lu sur la première vente (rowid du DVF)
+        connexion.execute("DROP TABLE IF EXISTS temp.prix")
+        connexion.execute(f"""
+            CREATE TEMP TABLE prix AS
+            SELECT s.insee_code, p.commune AS Commune,
+                   round(m.somme_prix / m.nb, 2) AS prix_m2_moyen, round(s.mediane, 2) AS prix_m2_median,
+                   m.nb AS nb_ventes,
+                   round(m.somme_valeur / m.nb, 2) AS valeur_moyenne, round(m.somme_surface / m.nb, 2) AS surface_moyenne,
+                   p.code_postal, p.code_departement AS departement, s.annee_ventes,
+                   round(s.moyenne_tronquee, 2) AS prix_m2_moyenne_tronquee,
+                   round(s.q1, 2) AS prix_m2_q1, round(s.q3, 2) AS prix_m2_q3, round(s.mad, 2) AS prix_m2_mad,
+                   s.n - m.nb AS nb_aberrants
+            FROM temp.seuils s
+            JOIN (
+                SELECT insee_code, SUM(retenu) AS nb,
+                       SUM(CASE WHEN retenu THEN prix_m2 END) AS somme_prix,
+                       SUM(CASE WHEN retenu THEN valeur END) AS somme_valeur,
+                       SUM(CASE WHEN retenu THEN surface END) AS somme_surface
+                FROM (
+                    SELECT v.insee_code, v.prix_m2, v.valeur, v.surface,
+                           NOT (s.n >= {MIN_VENTES_ABERRANTS} AND s.echelle > 0
+                                AND (v.prix_m2 < s.mediane - s.echelle OR v.prix_m2 > s.mediane + s.echelle)) AS retenu
+                    FROM temp.ventes v JOIN temp.seuils s USING (insee_code)
+                )
+                GROUP BY insee_code
+            ) m USING (insee_code)
+            JOIN dvf p ON p.rowid = s.premiere_ligne
+        """)
+        return nb_ventes
+    
+    @staticmethod
+    def _typer(data):
+        """Types du pipeline pandas : codes entiers, années Int16, texte en catégories"""
+        data['insee_code'] = data['insee_code'].astype('int32')
+        for col in ['nb_ventes', 'nb_aberrants']:
+            data[col] = data[col].astype('int64')
+        for col in ['annee_ventes', 'annee_loyer']:
+            if col in data.columns:
+                data[col] = pd.array(data[col].where(data[col] > 0), dtype='Int16')
+        for col in ['Commune', 'code_postal', 'departement', 'LIBGEO', 'DEP']:
+            if col in data.columns:
+                data[col] = pd.Categorical(data[col])
+        if 'attractivite' in data.columns:
+            data['attractivite'] = pd.Categorical(data['attractivite'], categories=CLASSES_ATTRACTIVITE, ordered=True)
+        return data
+    
+    def prix_communes(self, types_local=('Appartement',), seuil_mad=SEUIL_MAD_ABERRANT,
+                      proportion_tronquee=PROPORTION_TRONQUEE, filtres=None):
+        """Prix par commune au format de agreger_prix_communes (filtres : voir filtres_ventes)"""
+        self._agreger(types_local, seuil_mad, proportion_tronquee, filtres)
+        return self._typer(pd.read_sql_query("SELECT * FROM temp.prix ORDER BY insee_code", self.connexion()))
+    
+    def resultats(self, types_local=('Appartement',), seuils=SEUILS_RENTABILITE,
+                  seuil_mad=SEUIL_MAD_ABERRANT, proportion_tronquee=PROPORTION_TRONQUEE, filtres=None,
+                  ratio_nette=RATIO_RENTABILITE_NETTE):
+        """Table fusionnée avec rentabilités, au format de fusionner_donnees + calculer_rentabilite
+
+        Loyer de l'année des ventes, sinon de la dernière année antérieure, sinon
+        de la première disponible (comme IndexLoyersCommunes.rechercher).
+        filtres : voir filtres_ventes ; ratio_nette : rentabilité nette / brute.
+        """
+        seuils = valider_seuils(seuils)
+        nb_ventes = self._agreger(types_local, seuil_mad, proportion_tronquee, filtres)
+        connexion = self.connexion()
+        # Une ligne par (commune, année) : loyer moyen, libellés de la première ligne
+        connexion.execute("DROP TABLE IF EXISTS temp.annees_loyers")
+        connexion.execute("""
+            CREATE TEMP TABLE annees_loyers AS
+            SELECT insee_code, annee, AVG(loypredm2) AS loypredm2, MIN(rowid) AS premiere
+            FROM loyers GROUP BY insee_code, annee
+        """)
+        connexion.execute("CREATE UNIQUE INDEX temp.annees_loyers_commune ON annees_loyers (insee_code, annee)")
+        classes = ' '.join(
+            f"WHEN rentabilite_brute >= {seuil} THEN '{classe}'"
+            for seuil, classe in zip(reversed(seuils), CLASSES_ATTRACTIVITE[:0:-1])
+        )
+        data = pd.read_sql_query(f"""
+            WITH choix AS (
+                SELECT p.*, l.LIBGEO, l.DEP, a.loypredm2, a.annee AS annee_loyer,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY p.insee_code
+                           ORDER BY a.annee <= COALESCE(p.annee_ventes, 9999) DESC,
+                                    CASE WHEN a.annee <= COALESCE(p.annee_ventes, 9999) THEN -a.annee ELSE a.annee END
+                       ) AS rang_loyer
+                FROM temp.prix p
+                JOIN temp.annees_loyers a USING (insee_code)
+                JOIN loyers l ON l.rowid = a.premiere
+            ),
+            rentabilites AS (
+                SELECT *, loypredm2 * 12 / prix_m2_moyen * 100 AS rentabilite_brute
+                FROM choix WHERE rang_loyer = 1
+            )
+            SELECT *, rentabilite_brute * {float(ratio_nette)} AS rentabilite_nette,
+                   prix_m2_moyen / loypredm2 AS ratio_prix_loyer,
+                   CASE {classes} ELSE '{CLASSES_ATTRACTIVITE[0]}' END AS attractivite
+            FROM rentabilites
+            ORDER BY insee_code
+        """, connexion).drop(columns='rang_loyer')
+        print(f"Base SQL: {nb_ventes} ventes valides, {len(data)} communes avec loyer")
+        return self._typer(data)
+
+
+def geocodeur_nominatim(geolocator, timeout=10):
+    """Backend de géocodage Nominatim : requête texte -> (latitude, longitude) ou None"""
+    def geocoder(requete):
+        location = geolocator.geocode(requete, timeout=timeout)
+        return (location.latitude, location.longitude) if location else None
+    return geocoder
+
+
+class LimiteurDebit:
+    """Espace les appels d'au moins 1/requetes_par_seconde, tous threads confondus"""
+    
+    def __init__(self, requetes_par_seconde):
+        self.intervalle = 1.0 / requetes_par_seconde if requetes_par_seconde else 0.0
+        self.prochain = time.monotonic()
+        self.verrou = threading.Lock()
+    
+    def attendre(self):
+        with self.verrou:
+            maintenant = time.monotonic()
+            attente = self.prochain - maintenant
+            self.prochain = max(maintenant, self.prochain) + self.intervalle
+        if attente > 0:
+            time.sleep(attente)
+
+
+class GeocodeurCommunes:
+    """Coordonnées des communes par code INSEE, avec cache SQLite local
+
+    Seules les communes absentes du cache sont envoyées au backend, en parallèle
+    et sous la limite de débit configurée. Les échecs sont aussi mémorisés
+    (coordonnées nulles) pour ne pas être redemandés à chaque exécution.
+    Le backend est un simple callable `requete -> (lat, lon) | None`.
+    La connexion SQLite est partagée par les sessions et threads qui utilisent
+    le géocodeur : chaque accès se fait sous self.verrou.
+    """
+    
+    def __init__(self, backend, chemin_cache='geocodage.sqlite', requetes_par_seconde=1.0, nb_workers=4):
+        self.backend = backend
+        self.chemin_cache = chemin_cache
+        self.limiteur = LimiteurDebit(requetes_par_seconde)
+        self.nb_workers = nb_workers
+        self._connexion = None
+        self.verrou = threading.RLock()
+    
+    def connexion(self):
+        with self.verrou:
+            if self._connexion is None:
+                self._connexion = sqlite3.connect(self.chemin_cache, check_same_thread=False)
+                self._connexion.execute(
+                    "CREATE TABLE IF NOT EXISTS geocodage ("
+                    "insee_code TEXT PRIMARY KEY, latitude REAL, longitude REAL)"
+                )
+            return self._connexion
+    
+    def lire_cache(self):
+        """Coordonnées en cache, codes INSEE entiers (stockés en texte dans SQLite)"""
+        with self.verrou:
+            cache = pd.read_sql_query(
+                "SELECT insee_code, latitude, longitude FROM geocodage", self.connexion()
+            )
+        cache['insee_code'] = encoder_insee(cache['insee_code'])
+        return cache
+    
+    def _resoudre(self, requete):
+        self.limiteur.attendre()
+        return self.backend(requete)
+    
+    def coordonnees(self, communes, reessayer_echecs=False):
+        """Retourne insee_code, latitude, longitude pour les communes (insee_code, Commune)"""
+        communes = communes[['insee_code', 'Commune']].drop_duplicates('insee_code')
+        communes = communes.assign(insee_code=encoder_insee(communes['insee_code']))
+        resultat = communes.merge(self.lire_cache(), on='insee_code', how='left', indicator=True)
+        
+        manquants = resultat[resultat['_merge'] == 'left_only']
+        if reessayer_echecs:
+            manquants = resultat[resultat['latitude'].isna()]
+        
+        if not manquants.empty:
+            print(f"Géocodage: {len(manquants)} communes hors cache sur {len(communes)}")
+            resultats = []
+            with ThreadPoolExecutor(max_workers=self.nb_workers) as pool:
+                futures = {
+                    pool.submit(self._resoudre, f"{commune}, France"): (insee, commune)
+                    for insee, commune in zip(manquants['insee_code'], manquants['Commune'])
+                }
+                for future in as_completed(futures):
+                    insee, commune = futures[future]
+                    try:
+                        coords = future.result()
+                    except Exception as e:
+                        # Erreur transitoire : pas de mise en cache, nouvel essai au prochain appel
+                        print(f"Erreur géocodage {commune}: {e}")
+                        continue
+                    lat, lon = coords if coords else (None, None)
+                    resultats.append((decoder_insee([insee])[0], lat, lon))
+                    print(f"Géocodage: {commune} - {'OK' if coords else 'Échec'}")
+            
+            with self.verrou:
+                connexion = self.connexion()
+                connexion.executemany("INSERT OR REPLACE INTO geocodage VALUES (?, ?, ?)", resultats)
+                connexion.commit()
+            resultat = communes.merge(self.lire_cache(), on='insee_code', how='left')
+        
+        return resultat[['insee_code', 'latitude', 'longitude']].dropna(subset=['latitude'])
+
+
+class IndexCentroidesCommunes:
+    """Index hors ligne code INSEE -> centroïde de la commune
+
+    Codes entiers triés et coordonnées float32 en tableaux NumPy : une recherche
+    vectorisée (searchsorted) remplace le géocodage réseau.
+    """
+    
+    def __init__(self, codes, latitudes, longitudes):
+        codes = encoder_insee(codes)
+        ordre = np.argsort(codes, kind='stable')
+        self.codes = codes[ordre]
+        self.latitudes = np.asarray(latitudes, dtype='float32')[ordre]
+        self.longitudes = np.asarray(longitudes, dtype='float32')[ordre]
+    
+    @classmethod
+    def depuis_fichier(cls, fichier, col_insee='code_insee', col_latitude='latitude',
+                       col_longitude='longitude', sep=','):
+        """Charge un référentiel CSV ou Parquet (une ligne par commune)"""
+        colonnes = [col_insee, col_latitude, col_longitude]
+        if str(fichier).endswith('.parquet'):
+            ref = pd.read_parquet(fichier, columns=colonnes)
+        else:
+            ref = pd.read_csv(fichier, sep=sep, usecols=colonnes, dtype={col_insee: str})
+        ref = ref.dropna().drop_duplicates(col_insee)
+        print(f"Référentiel des centroïdes chargé: {len(ref)} communes")
+        return cls(ref[col_insee], ref[col_latitude], ref[col_longitude])
+    
+    def rechercher(self, insee_codes):
+        """Latitudes et longitudes des codes demandés (NaN si commune inconnue)"""
+        codes = encoder_insee(insee_codes)
+        positions = np.searchsorted(self.codes, codes).clip(max=len(self.codes) - 1)
+        trouves = self.codes[positions] == codes
+        latitudes = np.where(trouves, self.latitudes[positions], np.nan)
+        longitudes = np.where(trouves, self.longitudes[positions], np.nan)
+        return latitudes, longitudes
+
+
+class IndexSpatialCommunes:
+    """Index spatial des centroïdes pour les requêtes de voisinage en lot
+
+    Les centroïdes sont convertis en coordonnées cartésiennes sur la sphère
+    terrestre, où la distance euclidienne (corde) croît avec la distance à vol
+    d'oiseau. Avec scipy, un cKDTree répond aux requêtes ; sinon les communes sont
+    rangées par mailles carrées de la taille du rayon et chaque requête n'examine
+    que les 9 mailles qui l'entourent. Les communes sans coordonnées sont ignorées.
+    """
+    
+    def __init__(self, latitudes, longitudes):
+        latitudes = np.asarray(latitudes, dtype='float64')
+        longitudes = np.asarray(longitudes, dtype='float64')
+        valide = ~(np.isnan(latitudes) | np.isnan(longitudes))
+        # Positions des communes indexées dans la table d'origine
+        self.positions = np.flatnonzero(valide)
+        self.latitudes = latitudes[valide]
+        self.longitudes = longitudes[valide]
+        self.xyz = self._cartesiennes(self.latitudes, self.longitudes)
+        self.arbre = cKDTree(self.xyz) if cKDTree is not None and len(self.xyz) else None
+        self.grilles = {}
+    
+    def __len__(self):
+        return len(self.positions)
+    
+    @staticmethod
+    def _cartesiennes(latitudes, longitudes):
+        lat, lon = np.radians(latitudes), np.radians(longitudes)
+        return RAYON_TERRE_KM * np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+    
+    @staticmethod
+    def _corde(distances_km):
+        return 2 * RAYON_TERRE_KM * np.sin(np.minimum(distances_km / (2 * RAYON_TERRE_KM), np.pi / 2))
+    
+    @staticmethod
+    def _distance(cordes):
+        return 2 * RAYON_TERRE_KM * np.arcsin(np.minimum(cordes / (2 * RAYON_TERRE_KM), 1))
+    
+    def _mailles(self, latitudes, longitudes, maille_km, cos_reference):
+        # Projection plate : l'écart en x sous-estime la distance réelle tant que
+        # cos_reference est inférieur au cosinus des latitudes concernées
+        y = np.floor(RAYON_TERRE_KM * np.radians(latitudes) / maille_km).astype('int64')
+        x = np.floor(RAYON_TERRE_KM * np.radians(longitudes) * cos_reference / maille_km).astype('int64')
+        return x, y
+    
+    def _grille(self, maille_km):
+        """Communes triées par maille : clés des mailles occupées, bornes et ordre"""
+        if maille_km not in self.grilles:
+            latitude_max = min(np.abs(self.latitudes).max() + np.degrees(maille_km / RAYON_TERRE_KM), 89.9)
+            cos_reference = np.cos(np.radians(latitude_max))
+            x, y = self._mailles(self.latitudes, self.longitudes, maille_km, cos_reference)
+            cles = y * (1 << 32) + x
+            ordre = np.argsort(cles, kind='stable')
+            cles_mailles, debuts, nb = np.unique(cles[ordre], return_index=True, return_counts=True)
+            self.grilles[maille_km] = (cles_mailles, debuts, nb, ordre, cos_reference)
+        return self.grilles[maille_km]
+    
+    def _candidats_grille(self, latitudes, longitudes, rayon_km):
+        """Couples (requête, commune) des 9 mailles entourant chaque point (aucun si sans coordonnées)"""
+        cles_mailles, debuts, nb, ordre, cos_reference = self._grille(float(rayon_km))
+        points = np.flatnonzero(~(np.isnan(latitudes) | np.isnan(longitudes)))
+        x, y = self._mailles(latitudes[points], longitudes[points], rayon_km, cos_reference)
+        decalages = np.array([-1, 0, 1])
+        cles = (
+            (y[:, None, None] + decalages[None, :, None]) * (1 << 32)
+            + (x[:, None, None] + decalages[None, None, :])
+        ).reshape(len(x), -1)
+        
+        positions = np.searchsorted(cles_mailles, cles).clip(max=len(cles_mailles) - 1)
+        nb_candidats = np.where(cles_mailles[positions] == cles, nb[positions], 0).ravel()
+        total = int(nb_candidats.sum())
+        requetes = points[np.repeat(np.arange(cles.size) // cles.shape[1], nb_candidats)]
+        rangs = np.arange(total) - np.repeat(np.cumsum(nb_candidats) - nb_candidats, nb_candidats)
+        indices = ordre[np.repeat(debuts[positions].ravel(), nb_candidats) + rangs]
+        return requetes, indices
+    
+    def voisins(self, latitudes, longitudes, rayon_km, k=None, exclure=None):
+        """Communes à moins de rayon_km de chaque point (les k plus proches si k est donné)
+
+        Toutes les requêtes sont traitées en un lot. Retourne (requetes, positions,
+        distances_km) au format long : indice du point demandé, position de la
+        commune dans la table d'origine et distance à vol d'oiseau, triés par
+        requête puis par distance croissante. exclure : position à écarter pour
+        chaque point (la commune elle-même).
+        """
+        latitudes = np.atleast_1d(np.asarray(latitudes, dtype='float64'))
+        longitudes = np.atleast_1d(np.asarray(longitudes, dtype='float64'))
+        if not len(self) or not len(latitudes):
+            return np.array([], dtype=np.intp), np.array([], dtype=np.intp), np.array([])
+        xyz = self._cartesiennes(latitudes, longitudes)
+        corde_max = self._corde(rayon_km)
+        
+        if self.arbre is None:
+            requetes, indices = self._candidats_grille(latitudes, longitudes, rayon_km)
+        elif k is None:
+            listes = self.arbre.query_ball_point(xyz, corde_max)
+            nb = np.fromiter(map(len, listes), dtype=np.intp, count=len(listes))
+            requetes = np.repeat(np.arange(len(xyz)), nb)
+            indices = np.fromiter(itertools.chain.from_iterable(listes), dtype=np.intp, count=int(nb.sum()))
+        else:
+            nb_demandes = min(k + (exclure is not None), len(self))
+            _, indices = self.arbre.query(xyz, k=nb_demandes, distance_upper_bound=corde_max)
+            indices = indices.reshape(len(xyz), -1)
+            requetes, colonnes = np.nonzero(indices < len(self))
+            indices = indices[requetes, colonnes]
+        
+        cordes = np.linalg.norm(self.xyz[indices] - xyz[requetes], axis=1)
+        garder = cordes <= corde_max
+        if exclure is not None:
+            garder &= self.positions[indices] != np.asarray(exclure)[requetes]
+        requetes, indices, cordes = requetes[garder], indices[garder], cordes[garder]
+        
+        ordre = _tri_par_groupe(requetes, cordes)
+        requetes, indices, cordes = requetes[ordre], indices[ordre], cordes[ordre]
+        if k is not None:
+            rangs = np.arange(len(requetes)) - np.searchsorted(requetes, requetes)
+            garder = rangs < k
+            requetes, indices, cordes = requetes[garder], indices[garder], cordes[garder]
+        return requetes, self.positions[indices], self._distance(cordes)
+
+
+class IndexLoyersCommunes:
+    """Loyers dédoublonnés par (commune, année), indexés par une clé entière
+
+    clé = code INSEE entier (encoder_insee) × 10 000 + année, en tableau trié :
+    l'export des loyers concatène plusieurs années, chaque couple (commune, année)
+    n'y garde qu'une ligne (loyer moyen) et la jointure est un searchsorted.
+    """
+    
+    def __init__(self, data_loyers):
+        codes = encoder_insee(data_loyers['insee_code']).astype('int64')
+        if 'annee' in data_loyers.columns:
+            annees = data_loyers['annee'].to_numpy(dtype='float64', na_value=0).astype('int64')
+        else:
+            annees = np.zeros(len(data_loyers), dtype='int64')
+        valide = codes >= 0
+        
+        self.cles, premieres, inverse = np.unique(
+            codes[valide] * 10_000 + annees[valide], return_index=True, return_inverse=True
+        )
+        loyers = data_loyers['loypredm2'].to_numpy(dtype='float64')[valide]
+        self.loyers = np.bincount(inverse, weights=loyers) / np.bincount(inverse)
+        self.libelles = data_loyers['LIBGEO'].to_numpy()[valide][premieres]
+        self.departements = data_loyers['DEP'].to_numpy()[valide][premieres]
+    
+    def __len__(self):
+        return len(self.cles)
+    
+    def rechercher(self, insee_codes, annees=None):
+        """Position du loyer de chaque commune pour l'année demandée (-1 si commune absente)
+
+        Sans loyer pour cette année : dernière année antérieure connue, sinon la
+        première disponible. Sans année : la plus récente.
+        """
+        codes = encoder_insee(insee_codes).astype('int64')
+        if annees is None:
+            annees = np.full(len(codes), 9_999)
+        else:
+            annees = pd.Series(annees).to_numpy(dtype='float64', na_value=9_999).astype('int64')
+        if not len(self.cles):
+            return np.full(len(codes), -1)
+        
+        derniere = np.searchsorted(self.cles, codes * 10_000 + annees, side='right') - 1
+        premiere = np.searchsorted(self.cles, codes * 10_000).clip(max=len(self.cles) - 1)
+        anterieure = (derniere >= 0) & (self.cles[derniere.clip(min=0)] // 10_000 == codes)
+        connue = self.cles[premiere] // 10_000 == codes
+        positions = np.where(anterieure, derniere, premiere)
+        return np.where((anterieure | connue) & (codes >= 0), positions, -1)
+
+
+class CubePrixCommunes:
+    """Agrégats de prix au m² par commune × année × trimestre × nombre de pièces
+
+    Construit en un seul tri des transactions : nombre de ventes, somme et
+    médiane exacte du prix au m² par cellule, en tableaux denses NumPy. Les
+    tendances (prix par période, croissance annuelle, médianes glissantes,
+    évolution des loyers) sont ensuite des réductions de ces tableaux, sans
+    relire les transactions. Trimestre 0 et pièces 0 : valeur inconnue.
+    """
+    PIECES = ['inconnu', '1', '2', '3', '4', '5+']
+    TRIMESTRES = 5
+    
+    def __init__(self, communes, annees, nb, somme, mediane, loyers=None):
+        self.communes = communes      # codes INSEE entiers triés
+        self.annees = annees
+        self.nb = nb                  # (communes, années, trimestres, pièces) int32
+        self.somme = somme            # float64
+        self.mediane = mediane        # float32, NaN si cellule vide
+        self.loyers = loyers          # (communes, années) loyer moyen €/m², NaN si absent
+    
+    @classmethod
+    def construire(cls, dvf, loyers=None):
+        """Cube depuis le DVF nettoyé (prix_m2, insee_code, annee, trimestre, nb_pieces)"""
+        codes, communes = pd.factorize(encoder_insee(dvf['insee_code']), sort=True)
+        annee = dvf['annee'].to_numpy(dtype='float64', na_value=np.nan)
+        valide = (codes >= 0) & ~np.isnan(annee)
+        if 'prix_m2_aberrant' in dvf.columns:
+            valide &= ~dvf['prix_m2_aberrant'].to_numpy(dtype=bool)
+        annees = np.unique(annee[valide]).astype('int64')
+        
+        nb_pieces, nb_annees = len(cls.PIECES), len(annees)
+        forme = (len(communes), nb_annees, cls.TRIMESTRES, nb_pieces)
+        cellule = np.ravel_multi_index((
+            codes[valide],
+            np.searchsorted(annees, annee[valide]),
+            dvf['trimestre'].to_numpy()[valide],
+            dvf['nb_pieces'].to_numpy()[valide]
+        ), forme)
+        prix = dvf['prix_m2'].to_numpy(dtype='float64')[valide]
+        
+        # Un tri par (cellule, prix) : effectifs, sommes et médianes par segment contigu
+        ordre = np.lexsort((prix, cellule))
+        cellule, prix = cellule[ordre], prix[ordre]
+        debuts = np.flatnonzero(np.r_[True, cellule[1:] != cellule[:-1]]) if len(cellule) else np.array([], dtype=int)
+        effectifs = np.diff(np.r_[debuts, len(cellule)])
+        
+        nb = np.zeros(np.prod(forme), dtype='int32')
+        somme = np.zeros(np.prod(forme), dtype='float64')
+        mediane = np.full(np.prod(forme), np.nan, dtype='float32')
+        if len(debuts):
+            cellules = cellule[debuts]
+            nb[cellules] = effectifs
+            somme[cellules] = np.add.reduceat(prix, debuts)
+            mediane[cellules] = (prix[debuts + (effectifs - 1) // 2] + prix[debuts + effectifs // 2]) / 2
+        
+        cube = cls(np.asarray(communes, dtype='int32'), annees, nb.reshape(forme), somme.reshape(forme), mediane.reshape(forme))
+        if loyers is not None:
+            cube.ajouter_loyers(loyers)
+        return cube
+    
+    def sauvegarder(self, chemin):
+        """Enregistre les agrégats DVF du cube (les loyers sont rattachés à chaque analyse)"""
+        np.savez_compressed(
+            chemin, communes=self.communes, annees=self.annees, nb=self.nb, somme=self.somme, mediane=self.mediane
+        )
+    
+    @classmethod
+    def charger(cls, chemin):
+        with np.load(chemin) as cube:
+            return cls(cube['communes'], cube['annees'], cube['nb'], cube['somme'], cube['mediane'])
+    
+    def ajouter_loyers(self, loyers):
+        """Loyer moyen par commune et année du cube (loyers nettoyés avec annee)"""
+        self.loyers = np.full((len(self.communes), len(self.annees)), np.nan, dtype='float32')
+        if 'annee' not in loyers.columns:
+            return
+        moyens = loyers.groupby(['insee_code', 'annee'], observed=True)['loypredm2'].mean().reset_index()
+        ligne = self.position(moyens['insee_code'])
+        colonne = np.searchsorted(self.annees, moyens['annee'].to_numpy())
+        garder = (ligne >= 0) & (colonne < len(self.annees))
+        garder[garder] &= self.annees[colonne[garder]] == moyens['annee'].to_numpy()[garder]
+        self.loyers[ligne[garder], colonne[garder]] = moyens['loypredm2'].to_numpy()[garder]
+    
+    def position(self, insee_codes):
+        """Ligne de chaque code INSEE dans le cube (-1 si absent)"""
+        codes = encoder_insee(insee_codes)
+        if not len(self.communes):
+            return np.full(len(codes), -1)
+        position = np.searchsorted(self.communes, codes).clip(max=len(self.communes) - 1)
+        return np.where(self.communes[position] == codes, position, -1)
+    
+    def _selection(self, pieces):
+        """Tableaux nb/somme/médiane restreints aux classes de pièces demandées"""
+        if pieces is None:
+            return self.nb, self.somme, self.mediane
+        index = [self.PIECES.index(str(p)) for p in np.atleast_1d(pieces)]
+        return self.nb[..., index], self.somme[..., index], self.mediane[..., index]
+    
+    def periodes(self, granularite='annee'):
+        """Libellés des colonnes : années, ou « 2023-T1 » par trimestre"""
+        if granularite == 'annee':
+            return list(self.annees)
+        return [f"{annee}-T{t}" for annee in self.annees for t in range(1, self.TRIMESTRES)]
+    
+    def prix_moyen(self, granularite='annee', pieces=None):
+        """Prix moyen au m² par commune et période (communes × périodes)"""
+        nb, somme, _ = self._selection(pieces)
+        nb, somme = nb.sum(axis=-1), somme.sum(axis=-1)
+        if granularite == 'annee':
+            nb, somme = nb.sum(axis=-1), somme.sum(axis=-1)
+        else:
+            nb = nb[:, :, 1:].reshape(len(self.communes), -1)
+            somme = somme[:, :, 1:].reshape(len(self.communes), -1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return pd.DataFrame(somme / nb, index=self.communes, columns=self.periodes(granularite))
+    
+    def croissance_annuelle(self, pieces=None):
+        """Évolution du prix moyen d'une année sur l'autre (%)"""
+        prix = self.prix_moyen('annee', pieces)
+        return (prix.pct_change(axis=1, fill_method=None) * 100).iloc[:, 1:]
+    
+    def mediane_trimestrielle(self, pieces=None, communes=None):
+        """Médiane du prix au m² par commune et trimestre
+
+        Sur plusieurs classes de pièces : médiane des médianes de cellule pondérée
+        par le nombre de ventes (exacte pour une seule classe).
+        communes : codes INSEE à extraire (toutes par défaut).
+        """
+        nb, _, mediane = self._selection(pieces)
+        lignes = slice(None) if communes is None else self.position(communes)
+        if communes is not None and (lignes < 0).any():
+            raise KeyError(f"Communes absentes du cube: {list(np.asarray(communes)[lignes < 0])}")
+        nb, mediane = nb[lignes, :, 1:], mediane[lignes, :, 1:]
+        ordre = np.argsort(mediane, axis=-1)  # NaN (cellules vides, poids nul) en fin
+        valeurs = np.take_along_axis(mediane, ordre, axis=-1)
+        cumul = np.cumsum(np.take_along_axis(nb, ordre, axis=-1), axis=-1)
+        total = cumul[..., -1:]
+        rang = np.argmax(cumul * 2 >= total, axis=-1)[..., None]
+        resultat = np.take_along_axis(valeurs, rang, axis=-1)[..., 0]
+        resultat[total[..., 0] == 0] = np.nan
+        return pd.DataFrame(
+            resultat.reshape(len(resultat), -1), index=self.communes[lignes], columns=self.periodes('trimestre')
+        )
+    
+    def mediane_glissante(self, fenetre=4, pieces=None, communes=None):
+        """Médiane glissante sur `fenetre` trimestres des médianes trimestrielles"""
+        trimestrielle = self.mediane_trimestrielle(pieces, communes)
+        valeurs = trimestrielle.to_numpy()
+        resultat = np.full_like(valeurs, np.nan)
+        if valeurs.shape[1] >= fenetre:
+            fenetres = np.lib.stride_tricks.sliding_window_view(valeurs, fenetre, axis=1)
+            with warnings.catch_warnings():
+                # Fenêtres sans aucune vente : NaN attendu
+                warnings.simplefilter('ignore', RuntimeWarning)
+                resultat[:, fenetre - 1:] = np.nanmedian(fenetres, axis=-1)
+        return pd.DataFrame(resultat, index=trimestrielle.index, columns=trimestrielle.columns)
+    
+    @staticmethod
+    def _taux_annuel(valeurs, annees):
+        """Taux de croissance annuel moyen entre la première et la dernière année renseignées (%)"""
+        renseigne = ~np.isnan(valeurs) & (valeurs > 0)
+        premiere = np.argmax(renseigne, axis=1)
+        derniere = valeurs.shape[1] - 1 - np.argmax(renseigne[:, ::-1], axis=1)
+        lignes = np.arange(len(valeurs))
+        duree = (annees[derniere] - annees[premiere]).astype('float64')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            taux = (valeurs[lignes, derniere] / valeurs[lignes, premiere]) ** (1 / duree) - 1
+        taux[(duree <= 0) | ~renseigne.any(axis=1)] = np.nan
+        return taux * 100
+    
+    def tendances(self, pieces=None):
+        """Croissance annuelle moyenne des prix et des loyers par commune (%)"""
+        tendances = pd.DataFrame({
+            'insee_code': self.communes,
+            'croissance_prix_annuelle': self._taux_annuel(self.prix_moyen('annee', pieces).to_numpy(), self.annees)
+        })
+        if self.loyers is not None:
+            tendances['croissance_loyer_annuelle'] = self._taux_annuel(self.loyers.astype('float64'), self.annees)
+        return tendances
+
+
+class DistributionRendementsVentes:
+    """Prix au m² de chaque vente, triés par segment commune × nombre de pièces
+
+    Construit en un seul tri des transactions retenues (hors prix aberrants).
+    Le loyer étant constant dans une commune, le rendement brut de chaque vente
+    (loyer × 12 / prix au m²) se calcule pour n'importe quels loyers en une
+    division vectorisée, et son ordre dans un segment est l'inverse de celui
+    des prix : les percentiles se lisent par position, sans nouveau tri.
+    Le segment « toutes » regroupe toutes les ventes de la commune.
+    """
+    PIECES = ['toutes'] + CubePrixCommunes.PIECES
+    
+    def __init__(self, communes, pieces, debuts, n, prix):
+        self.communes = communes      # code INSEE entier de chaque segment
+        self.pieces = pieces          # indice dans PIECES de chaque segment (int8)
+        self.debuts = debuts          # position du premier prix de chaque segment
+        self.n = n                    # nombre de ventes de chaque segment (int32)
+        self.prix = prix              # prix au m² triés par segment (float32)
+    
+    @classmethod
+    def construire(cls, dvf):
+        """Segments depuis le DVF nettoyé (prix_m2, insee_code, nb_pieces)"""
+        prix = dvf['prix_m2'].to_numpy(dtype='float64', na_value=np.nan)
+        codes = encoder_insee(dvf['insee_code'])
+        valide = (codes >= 0) & np.isfinite(prix) & (prix > 0)
+        if 'prix_m2_aberrant' in dvf.columns:
+            valide &= ~dvf['prix_m2_aberrant'].to_numpy(dtype=bool)
+        groupes_communes, communes = _groupes_denses(codes[valide])
+        pieces = dvf['nb_pieces'].to_numpy()[valide].astype('int64') + 1
+        prix = prix[valide]
+        
+        # Chaque vente compte dans le segment « toutes » et dans celui de son nombre de pièces
+        nb_pieces = len(cls.PIECES)
+        groupes, segments = _groupes_denses(np.concatenate([
+            groupes_communes * nb_pieces, groupes_communes * nb_pieces + pieces
+        ]))
+        prix = np.concatenate([prix, prix])
+        prix = prix[_tri_par_groupe(groupes, prix)].astype('float32')
+        n = np.bincount(groupes, minlength=len(segments)).astype('int32')
+        return cls(
+            np.asarray(communes, dtype='int32')[segments // nb_pieces], (segments % nb_pieces).astype('int8'),
+            np.cumsum(n, dtype='int64') - n, n, prix
+        )
+    
+    def sauvegarder(self, chemin):
+        np.savez_compressed(chemin, communes=self.communes, pieces=self.pieces, n=self.n, prix=self.prix)
+    
+    @classmethod
+    def charger(cls, chemin):
+        with np.load(chemin) as distribution:
+            n = distribution['n']
+            return cls(distribution['communes'], distribution['pieces'],
+                       np.cumsum(n, dtype='int64') - n, n, distribution['prix'])
+    
+    def rendements(self, insee_codes, loyers, cible=6.0, quantiles=(0.1, 0.5, 0.9)):
+        """Percentiles du rendement brut des ventes et part au-dessus de la cible, par segment
+
+        insee_codes, loyers : loyer au m² (€/mois) de chaque commune ; les
+        segments des communes sans loyer sont écartés. cible : rendement brut (%).
+        """
+        codes = encoder_insee(insee_codes)
+        ordre = np.argsort(codes, kind='stable')
+        codes, loyers = codes[ordre], np.asarray(loyers, dtype='float64')[ordre]
+        loyer = np.full(len(self.n), np.nan)
+        if len(codes):
+            position = np.searchsorted(codes, self.communes).clip(max=len(codes) - 1)
+            trouve = codes[position] == self.communes
+            loyer[trouve] = loyers[position[trouve]]
+        garder = np.isfinite(loyer) & (loyer > 0)
+        
+        n = self.n[garder]
+        debuts = np.cumsum(n, dtype='int64') - n
+        prix = self.prix
+        if not garder.all():
+            prix = prix[np.repeat(self.debuts[garder] - debuts, n) + np.arange(n.sum())]
+        
+        # Rendement brut de chaque vente, en une opération : décroissant dans son segment
+        rendement = np.repeat(loyer[garder] * 12 * 100, n) / prix
+        
+        resultat = pd.DataFrame({
+            'insee_code': self.communes[garder],
+            'pieces': pd.Categorical.from_codes(self.pieces[garder], categories=self.PIECES),
+            'nb_ventes': n
+        })
+        for q in quantiles:
+            # Rang r des rendements croissants = position n - 1 - r des prix croissants
+            rang = (n - 1) * q
+            bas, haut = np.floor(rang).astype('int64'), np.ceil(rang).astype('int64')
+            r_bas, r_haut = rendement[debuts + n - 1 - bas], rendement[debuts + n - 1 - haut]
+            resultat[f"rendement_p{round(q * 100)}"] = (r_bas + (r_haut - r_bas) * (rang - bas)).astype('float32')
+        au_dessus = np.add.reduceat(rendement >= cible, debuts, dtype='int64') if len(n) else np.zeros(0, 'int64')
+        resultat['part_au_dessus_cible'] = (au_dessus / n).astype('float32')
+        return resultat
+
+
+class IndexRechercheCommunes:
+    """Index de recherche des communes par département, budget, taille et attractivité
+
+    Construit une fois sur data_merged : pour chaque clé de tri, l'ordre des
+    communes (global et par département, les départements formant des blocs
+    contigus) et un masque par classe d'attractivité. Une requête lit le bloc
+    du département dans l'ordre de tri, applique les filtres numériques sur ce
+    seul bloc puis découpe la page demandée.
+    """
+    CLES_TRI = ['rentabilite_brute', 'rentabilite_nette', 'rentabilite_ajustee',
+                'prix_m2_moyen', 'loypredm2', 'nb_ventes', 'valeur_moyenne']
+    
+    def __init__(self, data_merged):
+        self.data = data_merged.reset_index(drop=True)
+        codes_dep, self.departements = pd.factorize(
+            self.data['departement'].astype(str).str.zfill(2), sort=True
+        )
+        self.departements = list(self.departements)
+        # Bornes de chaque département dans les ordres triés par (département, clé)
+        self.bornes = np.r_[0, np.cumsum(np.bincount(codes_dep, minlength=len(self.departements)))]
+        
+        self.colonnes = {
+            col: self.data[col].to_numpy(dtype='float64', na_value=np.nan)
+            for col in ['prix_m2_moyen', 'valeur_moyenne', 'nb_ventes', 'rentabilite_brute']
+        }
+        self.ordres, self.ordres_departement = {}, {}
+        for cle in self.CLES_TRI:
+            if cle not in self.data.columns:
+                continue
+            valeurs = self.data[cle].to_numpy(dtype='float64', na_value=np.nan)
+            self.colonnes[cle] = valeurs
+            # Tri stable, NaN en fin : l'ordre décroissant se lit à l'envers
+            self.ordres[cle] = np.argsort(valeurs, kind='stable')
+            self.ordres_departement[cle] = np.lexsort((valeurs, codes_dep))
+        
+        # Prix complétés par les communes voisines : assez fiables pour min_ventes
+        self.prix_emprunte = (
+            self.data['prix_emprunte'].to_numpy(dtype=bool) if 'prix_emprunte' in self.data
+            else np.zeros(len(self.data), dtype=bool)
+        )
+        
+        attractivite = self.data['attractivite'].astype(str).to_numpy() if 'attractivite' in self.data else None
+        self.masques_attractivite = {
+            classe: attractivite == classe for classe in CLASSES_ATTRACTIVITE
+        } if attractivite is not None else {}
+    
+    def _candidats(self, tri, departement):
+        """Positions des communes du ou des départements, dans l'ordre croissant de la clé"""
+        if departement is None:
+            return self.ordres[tri]
+        departements = [str(d).zfill(2) for d in np.atleast_1d(departement)]
+        blocs = [
+            self.ordres_departement[tri][self.bornes[i]:self.bornes[i + 1]]
+            for i in (self.departements.index(d) for d in departements if d in self.departements)
+        ]
+        if len(blocs) <= 1:
+            return blocs[0] if blocs else np.array([], dtype=np.intp)
+        # Plusieurs départements : fusion des blocs, ex aequo dans l'ordre du tri global
+        positions = np.concatenate(blocs)
+        return positions[np.lexsort((positions, self.colonnes[tri][positions]))]
+    
+    def rechercher(self, departement=None, prix_m2_max=None, budget_max=None, surface_m2=None,
+                   min_ventes=None, attractivite=None, rentabilite_min=None,
+                   tri='rentabilite_brute', croissant=False, page=0, taille_page=20):
+        """Page de communes filtrées et triées, et nombre total de résultats
+
+        budget_max porte sur le prix d'un bien de surface_m2 m², ou à défaut sur la
+        valeur moyenne des ventes de la commune. attractivite : classe ou liste de classes.
+        min_ventes ne s'applique pas aux communes dont le prix a été complété par les voisines.
+        taille_page=0 ne renvoie que le nombre de résultats (page vide).
+        """
+        if tri not in self.ordres:
+            raise ValueError(f"Clé de tri inconnue ou absente: {tri}")
+        if page < 0 or taille_page < 0:
+            raise ValueError(f"Page et taille de page positives attendues: page={page}, taille_page={taille_page}")
+        
+        candidats = self._candidats(tri, departement)
+        if not croissant:
+            candidats = candidats[::-1]
+        
+        masque = ~np.isnan(self.colonnes[tri][candidats])
+        if prix_m2_max is not None:
+            masque &= self.colonnes['prix_m2_moyen'][candidats] <= prix_m2_max
+        if budget_max is not None:
+            if surface_m2:
+                masque &= self.colonnes['prix_m2_moyen'][candidats] * surface_m2 <= budget_max
+            else:
+                masque &= self.colonnes['valeur_moyenne'][candidats] <= budget_max
+        if min_ventes is not None:
+            masque &= (self.colonnes['nb_ventes'][candidats] >= min_ventes) | self.prix_emprunte[candidats]
+        if rentabilite_min is not None:
+            masque &= self.colonnes['rentabilite_brute'][candidats] > rentabilite_min
+        if attractivite is not None:
+            classes = np.atleast_1d(attractivite)
+            masque &= np.logical_or.reduce([self.masques_attractivite[c] for c in classes])[candidats]
+        
+        resultats = candidats[masque]
+        page_positions = resultats[page * taille_page:(page + 1) * taille_page]
+        return self.data.iloc[page_positions], len(resultats)
+
+
+def valider_seuils(seuils):
+    """Vérifie les bornes des classes d'attractivité : une de moins que de classes, croissantes"""
+    seuils = list(seuils)
+    if len(seuils) != len(CLASSES_ATTRACTIVITE) - 1:
+        raise ValueError(f"{len(CLASSES_ATTRACTIVITE) - 1} seuils attendus pour les classes "
+                         f"{CLASSES_ATTRACTIVITE}, {len(seuils)} reçus")
+    if any(bas >= haut for bas, haut in zip(seuils, seuils[1:])):
+        raise ValueError(f"Seuils d'attractivité non strictement croissants: {seuils}")
+    return seuils
+
+
+def grille_scenarios(**valeurs):
+    """Produit cartésien de valeurs de paramètres, complété par PARAMETRES_SCENARIO
+
+    Exemple : grille_scenarios(taux_credit=[0.03, 0.04], apport=[0, 0.2]) -> 4 scénarios
+    """
+    inconnus = set(valeurs) - set(PARAMETRES_SCENARIO)
+    if inconnus:
+        raise ValueError(f"Paramètres de scénario inconnus: {sorted(inconnus)}")
+    
+    noms = list(valeurs)
+    combinaisons = list(itertools.product(*[np.atleast_1d(valeurs[nom]) for nom in noms]))
+    scenarios = pd.DataFrame(combinaisons, columns=noms)
+    for nom, defaut in PARAMETRES_SCENARIO.items():
+        if nom not in scenarios.columns:
+            scenarios[nom] = defaut
+    return scenarios[list(PARAMETRES_SCENARIO)]
+
+
+class MoteurScenarios:
+    """Rentabilités d'investissement pour toutes les communes × tous les scénarios
+
+    Les grandeurs se décomposent en facteurs par commune (prix et loyer du bien)
+    et par scénario (crédit, frais, vacance, fiscalité) : les tableaux
+    communes × scénarios sont obtenus par produits extérieurs NumPy en float32,
+    sans boucle Python. Seul l'impôt au réel demande un calcul élément par élément.
+    """
+    # Nombre de cellules communes × scénarios traitées à la fois
+    CELLULES_PAR_BLOC = 1 << 18
+    
+    def __init__(self, data_merged, surface_m2=None):
+        """surface_m2 : surface du bien simulé (par défaut la surface moyenne vendue dans la commune)"""
+        self.communes = data_merged[['insee_code', 'Commune']].reset_index(drop=True)
+        if surface_m2 is None:
+            surface = data_merged['surface_moyenne'].to_numpy(dtype='float64')
+        else:
+            surface = np.full(len(data_merged), float(surface_m2))
+        
+        # Prix d'achat et loyer annuel brut du bien, par commune
+        self.prix = (data_merged['prix_m2_moyen'].to_numpy(dtype='float64') * surface).astype('float32')
+        self.loyer_annuel = (data_merged['loypredm2'].to_numpy(dtype='float64') * 12 * surface).astype('float32')
+    
+    @staticmethod
+    def _facteurs(scenarios):
+        """Facteurs par scénario, appliqués au prix ou au loyer annuel brut"""
+        sc = {nom: scenarios[nom].to_numpy() for nom in PARAMETRES_SCENARIO}
+        cout_par_prix = 1 + sc['frais_notaire']
+        emprunt_par_prix = cout_par_prix * (1 - sc['apport'])
+        
+        duree = sc['duree_credit_ans'].astype('float64')
+        if ((duree <= 0) & (emprunt_par_prix > 0)).any():
+            raise ValueError("Durée de crédit nulle ou négative pour un scénario avec emprunt")
+        # Sans emprunt (apport total), la durée est sans effet
+        duree = np.where(duree > 0, duree, 1)
+        taux_mensuel = sc['taux_credit'].astype('float64') / 12
+        nb_mois = duree * 12
+        
+        # Mensualité par euro emprunté (prêt à taux nul : remboursement linéaire)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            annuite = np.where(
+                taux_mensuel > 0,
+                taux_mensuel / (1 - (1 + taux_mensuel) ** -nb_mois),
+                1 / nb_mois
+            )
+        
+        regimes = sc['regime_fiscal']
+        inconnus = set(regimes) - set(REGIMES_FISCAUX)
+        if inconnus:
+            raise ValueError(f"Régimes fiscaux inconnus: {sorted(inconnus)}")
+        abattement = np.array([ABATTEMENTS_FISCAUX.get(r, 0.0) for r in regimes])
+        
+        return {
+            'cout_par_prix': cout_par_prix,
+            # Revenu net de charges (avant impôt et crédit) par euro de loyer brut
+            'revenu_par_loyer': (1 - sc['vacance']) * (1 - sc['frais_gestion']) - sc['taxe_fonciere'],
+            'mensualite_par_prix': emprunt_par_prix * annuite,
+            # Intérêts annuels moyens sur la durée du prêt
+            'interets_par_prix': emprunt_par_prix * (annuite * nb_mois - 1) / duree,
+            'apport_par_prix': cout_par_prix * sc['apport'],
+            'taux_impot': sc['tmi'] + PRELEVEMENTS_SOCIAUX,
+            'base_micro_par_loyer': (1 - sc['vacance']) * (1 - abattement),
+            'reel': regimes == 'reel'
+        }
+    
+    def evaluer(self, scenarios=None):
+        """Calcule les indicateurs (communes × scénarios) pour un DataFrame de scénarios
+
+        Retourne un dict de tableaux float32 : rentabilite_brute, rentabilite_nette
+        (après charges), rentabilite_nette_nette (après impôt), cash_flow_mensuel
+        (après impôt et crédit) et delai_recuperation_ans (coût total / revenu net
+        après impôt, inf si le revenu est négatif).
+        """
+        scenarios = grille_scenarios() if scenarios is None else scenarios
+        f = {nom: np.asarray(v, dtype='float32') for nom, v in self._facteurs(scenarios).items()}
+        f['reel'] = f['reel'].astype(bool)
+        nb_communes, nb_scenarios = len(self.prix), len(scenarios)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rendement = (self.loyer_annuel / self.prix)[:, None]
+        resultats = {
+            'rentabilite_brute': np.broadcast_to(rendement * 100, (nb_communes, nb_scenarios)),
+            'rentabilite_nette': rendement * (f['revenu_par_loyer'] / f['cout_par_prix'] * 100)
+        }
+        for nom in ('rentabilite_nette_nette', 'cash_flow_mensuel', 'delai_recuperation_ans'):
+            resultats[nom] = np.empty((nb_communes, nb_scenarios), dtype='float32')
+        
+        # Par blocs de communes : les tableaux intermédiaires restent en cache processeur
+        taille_bloc = max(1, self.CELLULES_PAR_BLOC // max(nb_scenarios, 1))
+        for debut in range(0, nb_communes, taille_bloc):
+            tranche = slice(debut, debut + taille_bloc)
+            self._evaluer_bloc(
+                self.prix[tranche, None], self.loyer_annuel[tranche, None], f,
+                {nom: resultats[nom][tranche] for nom in
+                 ('rentabilite_nette_nette', 'cash_flow_mensuel', 'delai_recuperation_ans')}
+            )
+        return resultats
+    
+    @staticmethod
+    def _evaluer_bloc(prix, loyer, f, sorties):
+        """Remplit les indicateurs après impôt d'un bloc de communes"""
+        # Impôt : proportionnel au loyer en micro, sur revenu net moins intérêts au réel
+        impot = loyer * (f['base_micro_par_loyer'] * f['taux_impot'])
+        reel = f['reel']
+        if reel.any():
+            base_reel = loyer * f['revenu_par_loyer'][reel] - prix * f['interets_par_prix'][reel]
+            np.maximum(base_reel, 0, out=base_reel)
+            impot[:, reel] = base_reel * f['taux_impot'][reel]
+        
+        # Revenu net après impôt (réutilise le tableau de l'impôt)
+        revenu_net = np.subtract(loyer * f['revenu_par_loyer'], impot, out=impot)
+        
+        cash_flow = sorties['cash_flow_mensuel']
+        np.multiply(prix, -f['mensualite_par_prix'], out=cash_flow)
+        cash_flow += revenu_net * np.float32(1 / 12)
+        
+        cout_total = prix * f['cout_par_prix']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            nette_nette = np.divide(revenu_net, cout_total, out=sorties['rentabilite_nette_nette'])
+            nette_nette *= 100
+            delai = np.divide(cout_total, revenu_net, out=sorties['delai_recuperation_ans'])
+        np.copyto(delai, np.inf, where=~(revenu_net > 0))
+    
+    def synthese(self, scenarios, resultats):
+        """Une ligne par scénario : médianes et part des communes en cash-flow positif"""
+        synthese = scenarios.reset_index(drop=True).copy()
+        synthese['rentabilite_nette_nette_mediane'] = np.nanmedian(resultats['rentabilite_nette_nette'], axis=0)
+        synthese['cash_flow_mensuel_median'] = np.nanmedian(resultats['cash_flow_mensuel'], axis=0)
+        synthese['part_cash_flow_positif'] = (resultats['cash_flow_mensuel'] > 0).mean(axis=0)
+        return synthese
+    
+    def meilleures_communes(self, resultats, index_scenario, n=20, critere='cash_flow_mensuel'):
+        """Top n des communes pour un scénario selon un indicateur"""
+        valeurs = resultats[critere][:, index_scenario]
+        if critere == 'delai_recuperation_ans':
+            ordre = np.argsort(valeurs)[:n]
+        else:
+            ordre = np.argsort(-np.nan_to_num(valeurs, nan=-np.inf))[:n]
+        top = self.communes.iloc[ordre].copy()
+        for nom, tableau in resultats.items():
+            top[nom] = tableau[ordre, index_scenario]
+        return top.reset_index(drop=True)
+
+
+INDICATEURS_SCENARIO = ['rentabilite_nette_nette', 'cash_flow_mensuel', 'delai_recuperation_ans']
+# Colonnes lues par rapport_texte et rapport_html
+COLONNES_RAPPORT = ['insee_code', 'Commune', 'departement', 'prix_m2_moyen', 'loypredm2', 'nb_ventes',
+                    'rentabilite_brute', 'rentabilite_nette', 'attractivite']
+TITRE_RAPPORT = "RAPPORT D'ANALYSE DE RENTABILITÉ IMMOBILIÈRE"
+
+
+def _meilleures_lignes(data, colonne, n):
+    """n lignes de plus forte valeur (NaN en dernier), sans tri complet ni itération pandas"""
+    valeurs = data[colonne].to_numpy(dtype='float64', na_value=np.nan)
+    valeurs = np.nan_to_num(valeurs, nan=-np.inf)
+    if len(valeurs) > n:
+        candidats = np.argpartition(-valeurs, n)[:n]
+    else:
+        candidats = np.arange(len(valeurs))
+    return data.iloc[candidats[np.lexsort((candidats, -valeurs[candidats]))]]
+
+
+def rapport_texte(data, titre=TITRE_RAPPORT, loyer_moyen=None, scenario=None, n_top=5):
+    """Rapport de synthèse texte d'une table fusionnée (France entière ou un département)
+
+    loyer_moyen : loyer de référence affiché (par défaut celui des communes du rapport).
+    scenario : paramètres d'investissement dont les indicateurs (INDICATEURS_SCENARIO)
+    sont des colonnes de data.
+    """
+    if loyer_moyen is None:
+        loyer_moyen = data['loypredm2'].mean()
+    soulignement = '=' * len(titre)
+    rapport = f"""
+    {titre}
+    {soulignement}
+
+    📊 STATISTIQUES GÉNÉRALES
+    - Nombre de communes analysées: {len(data)}
+    - Prix moyen d'achat: {data['prix_m2_moyen'].mean():.0f}€/m²
+    - Loyer moyen: {loyer_moyen:.2f}€/m²/mois
+    - Rentabilité brute moyenne: {data['rentabilite_brute'].mean():.2f}%
+
+    🏆 MEILLEURES OPPORTUNITÉS (Top {n_top})
+    """
+    
+    top = _meilleures_lignes(data, 'rentabilite_brute', n_top)
+    departements = top['departement'].astype(str).str.zfill(2)
+    for i, (commune, dept, prix, loyer, rentabilite, attractivite) in enumerate(zip(
+        top['Commune'], departements, top['prix_m2_moyen'], top['loypredm2'],
+        top['rentabilite_brute'], top['attractivite']
+    ), 1):
+        rapport += f"""
+    {i}. {commune} ({dept})
+    💰 Prix: {prix:.0f}€/m² | Loyer: {loyer:.1f}€/m²
+    📈 Rentabilité: {rentabilite:.2f}% | Attractivité: {attractivite}
+    """
+    
+    if scenario is not None:
+        parametres = ' | '.join(f"{nom}: {valeur}" for nom, valeur in scenario.items())
+        cash_flow = data['cash_flow_mensuel'].to_numpy(dtype='float64')
+        rapport += f"""
+    💶 SCÉNARIO D'INVESTISSEMENT
+    {parametres}
+    - Rentabilité nette après impôt médiane: {np.nanmedian(data['rentabilite_nette_nette']):.2f}%
+    - Cash-flow mensuel médian: {np.nanmedian(cash_flow):.0f}€
+    - Communes en cash-flow positif: {(cash_flow > 0).mean():.0%}
+    """
+    
+    rapport += f"""
+    📊 RÉPARTITION PAR ATTRACTIVITÉ
+    {data['attractivite'].value_counts().to_string()}
+
+    ⚠️ NOTES IMPORTANTES
+    - Ces calculs sont basés sur des données moyennes
+    - La rentabilité réelle dépend de nombreux facteurs (charges, vacance, travaux...)
+    - Il est recommandé de faire une étude détaillée avant tout investissement
+    - Les données de loyer sont des estimations prédictives
+    """
+    return rapport
+
+
+def _tableau_html(data, decimales=2):
+    """Tableau HTML d'un petit DataFrame : texte échappé, flottants arrondis, manquants vides
+
+    decimales=None : flottants au format court (paramètres de scénario).
+    """
+    format_flottant = 'g' if decimales is None else f'.{decimales}f'
+    colonnes = []
+    for col in data.columns:
+        if pd.api.types.is_float_dtype(data[col]):
+            valeurs = data[col].to_numpy(dtype='float64', na_value=np.nan)
+            colonnes.append(['' if np.isnan(v) else format(v, format_flottant) for v in valeurs])
+        else:
+            colonnes.append(['' if pd.isna(v) else html.escape(str(v)) for v in data[col]])
+    entetes = ''.join(f"<th>{html.escape(str(col))}</th>" for col in data.columns)
+    lignes = ''.join('<tr>' + ''.join(f"<td>{v}</td>" for v in ligne) + '</tr>' for ligne in zip(*colonnes))
+    return f"<table><thead><tr>{entetes}</tr></thead><tbody>{lignes}</tbody></table>"
+
+
+def rapport_html(data, titre=TITRE_RAPPORT, loyer_moyen=None, scenario=None, n_top=20):
+    """Rapport de synthèse HTML autonome : mêmes indicateurs que rapport_texte, top en tableau"""
+    if loyer_moyen is None:
+        loyer_moyen = data['loypredm2'].mean()
+    colonnes = COLONNES_RAPPORT + [col for col in INDICATEURS_SCENARIO if col in data.columns]
+    top = decoder_codes_insee(_meilleures_lignes(data, 'rentabilite_brute', n_top)[colonnes])
+    
+    statistiques = [
+        ('Communes analysées', f"{len(data)}"),
+        ("Prix moyen d'achat", f"{data['prix_m2_moyen'].mean():.0f} €/m²"),
+        ('Loyer moyen', f"{loyer_moyen:.2f} €/m²/mois"),
+        ('Rentabilité brute moyenne', f"{data['rentabilite_brute'].mean():.2f} %")
+    ]
+    if scenario is not None:
+        cash_flow = data['cash_flow_mensuel'].to_numpy(dtype='float64')
+        statistiques += [
+            ('Rentabilité nette après impôt médiane', f"{np.nanmedian(data['rentabilite_nette_nette']):.2f} %"),
+            ('Cash-flow mensuel médian', f"{np.nanmedian(cash_flow):.0f} €"),
+            ('Communes en cash-flow positif', f"{(cash_flow > 0).mean():.0%}")
+        ]
+    lignes_stats = ''.join(f"<li>{nom}: <b>{valeur}</b></li>" for nom, valeur in statistiques)
+    bloc_scenario = '' if scenario is None else (
+        "<h2>Scénario d'investissement</h2>" + _tableau_html(pd.DataFrame([scenario]), decimales=None)
+    )
+    return f"""<!DOCTYPE html>
+<html lang="fr"><head><meta charset="utf-8"><title>{html.escape(titre)}</title>
+<style>body{{font-family:sans-serif;margin:2em}}table{{border-collapse:collapse}}td,th{{padding:4px 8px;border-bottom:1px solid #ddd;text-align:right}}</style>
+</head><body>
+<h1>{html.escape(titre)}</h1>
+<h2>Statistiques générales</h2><ul>{lignes_stats}</ul>
+{bloc_scenario}
+<h2>Meilleures opportunités (top {n_top})</h2>
+{_tableau_html(top)}
+<h2>Répartition par attractivité</h2>
+{_tableau_html(data['attractivite'].value_counts().rename('communes').reset_index())}
+<p><i>Estimations sur données moyennes et loyers prédits : une étude détaillée reste nécessaire avant tout investissement.</i></p>
+</body></html>
+"""
+
+
 class AnalyseurRentabiliteImmobiliere:
-    def __init__(self):
+    def __init__(self, dossier_agregats=None, geocodeur=None, fichier_centroides=None, dossier_cache=None):
+        # Mesures par étape (temps, mémoire, lignes, filtres) et écouteurs d'événements
+        self.mesures = MesuresPipeline()
+        
         self.data_dvf = None
         self.data_loyers = None
         self.data_merged = None
+        
+        # Cache des tables nettoyées et agrégats DVF (voir DEPENDANCES_CACHE) :
+        # empreintes des sources lues, chemins en attente d'écriture par artefact
+        self.dossier_cache = dossier_cache
+        self.empreintes = {}
+        self.cles_cache = {}
         self.geolocator = Nominatim(user_agent="rentabilite_immobiliere")
+        self.geocodeur = geocodeur or GeocodeurCommunes(geocodeur_nominatim(self.geolocator))
+        
+        # Référentiel local des centroïdes, chargé au premier usage
+        self.fichier_centroides = fichier_centroides
+        self.index_centroides = None
+        
+        # Agrégats par commune de l'analyse en cours (agreger_ventes_communes),
+        # repris du cache quand le DVF chargé n'a pas changé
+        self.prix_moyens = None
+        self.agregats_repris = False
+        
+        # Agrégats par commune d'une ingestion parallèle (lus sur demande uniquement)
+        self.prix_moyens_parallele = None
+        
+        # Bornes des classes d'attractivité de data_merged (légende de la carte)
+        self.seuils_rentabilite = list(SEUILS_RENTABILITE)
+        
+        # Cube temporel des prix (commune × année × trimestre × pièces)
+        self.cube_prix = None
+        
+        # Prix triés par commune × pièces et rendements des ventes qui en découlent
+        self.distribution_ventes = None
+        self.rendements_ventes = None
+        
+        # Index de recherche sur data_merged (reconstruit après chaque modification)
+        self.index_recherche = None
+        
+        # Loyers dédoublonnés par (commune, année), construits à la fusion
+        self.index_loyers = None
+        
+        # Index spatial des communes de data_merged (construit au premier usage)
+        self.index_spatial = None
         
-    def charger_donnees(self, fichier_dvf, fichier_loyers):
-        """Charge et nettoie les données DVF et loyers"""
+        # Stock persistant d'agrégats par commune (mises à jour incrémentales)
+        self.stock_agregats = StockAgregatsCommunes(dossier_agregats) if dossier_agregats else None
+        
+    @etape_mesuree('charger_donnees', sortie='data_dvf')
+    def charger_donnees(self, fichier_dvf, fichier_loyers, taille_bloc=None):
+        """Charge et nettoie les données DVF et loyers
+
+        Avec taille_bloc, le DVF est lu par blocs et filtré à la volée
+        (voir charger_dvf_par_blocs). Si le DVF n'a pas changé depuis une analyse
+        en cache, il n'est pas relu : ses agrégats par commune et le cube des
+        prix sont repris et seules les étapes dépendant des loyers s'exécutent.
+        """
+        self.empreintes = {}
+        # Agrégats d'un DVF chargé précédemment : jamais réutilisés pour ce fichier
+        self.prix_moyens = self.cube_prix = self.distribution_ventes = None
+        self.agregats_repris = False
         try:
             # Chargement DVF
-            self.data_dvf = pd.read_csv(fichier_dvf, sep=';', encoding='latin-1')
-            print(f"DVF chargé: {len(self.data_dvf)} lignes")
+            self.agregats_repris = self._reprendre_agregats_dvf(fichier_dvf, taille_bloc)
+            if self.agregats_repris:
+                self.data_dvf = None
+                print(f"DVF inchangé: agrégats de {len(self.prix_moyens)} communes repris du cache")
+            else:
+                self.data_dvf = self._lire_source('dvf', fichier_dvf, taille_bloc)
+                print(f"DVF chargé: {len(self.data_dvf)} lignes")
             
             # Chargement loyers
-            self.data_loyers = pd.read_csv(fichier_loyers, sep=';', encoding='latin-1')
+            self.data_loyers = self._lire_source('loyers', fichier_loyers)
             print(f"Loyers chargé: {len(self.data_loyers)} lignes")
             
             return True
@@ -36,10 +2343,213 @@ class AnalyseurRentabiliteImmobiliere:
             print(f"Erreur lors du chargement: {e}")
             return False
     
+    def charger_resultats(self, fichier):
+        """Recharge une table de résultats déjà calculée dans data_merged
+
+        CSV ';' écrit par le mode ligne de commande (codes INSEE en texte) ou Parquet.
+        """
+        if str(fichier).endswith('.parquet'):
+            data = pd.read_parquet(fichier)
+        else:
+            data = pd.read_csv(fichier, sep=';', dtype={col: str for col in ('insee_code', 'departement', 'code_postal', 'DEP')})
+        data['insee_code'] = encoder_insee(data['insee_code'])
+        if 'attractivite' in data.columns:
+            data['attractivite'] = pd.Categorical(data['attractivite'], categories=CLASSES_ATTRACTIVITE, ordered=True)
+        
+        self.data_merged = data
+        self.index_recherche = None
+        self.index_spatial = None
+        print(f"Résultats chargés: {len(data)} communes")
+        return True
+    
+    def _enregistrer_empreinte(self, nom, fichier, taille_bloc=None):
+        """Empreinte d'une source et des paramètres de lecture qui changent sa version nettoyée"""
+        if nom not in self.empreintes:
+            parametres = {'par_blocs': bool(taille_bloc) and nom == 'dvf'}
+            self.empreintes[nom] = [empreinte_fichier(fichier), parametres]
+        return self.empreintes[nom]
+    
+    def _chemin_cache(self, nom, extension='parquet'):
+        """Chemin d'un artefact en cache, clé dérivée des empreintes de ses sources (DEPENDANCES_CACHE)"""
+        sources = DEPENDANCES_CACHE[nom]
+        if not self.dossier_cache or any(source not in self.empreintes for source in sources):
+            return None
+        cle = hashlib.sha1(
+            json.dumps([nom, VERSION_NETTOYAGE, [self.empreintes[source] for source in sources]]).encode()
+        ).hexdigest()[:16]
+        return os.path.join(self.dossier_cache, f"{nom}_{cle}.{extension}")
+    
+    def _reprendre_agregats_dvf(self, fichier_dvf, taille_bloc=None):
+        """Reprend prix par commune, cube des prix et distribution des ventes du cache si le DVF n'a pas changé
+
+        Il faut les trois : sinon le DVF est relu et leurs chemins restent en
+        attente d'écriture pour cette analyse.
+        """
+        if not self.dossier_cache:
+            return False
+        self._enregistrer_empreinte('dvf', fichier_dvf, taille_bloc)
+        chemins = {
+            'prix_moyens': self._chemin_cache('prix_moyens'),
+            'cube_prix': self._chemin_cache('cube_prix', 'npz'),
+            'distribution_ventes': self._chemin_cache('distribution_ventes', 'npz')
+        }
+        if not all(os.path.exists(chemin) for chemin in chemins.values()):
+            self.cles_cache.update(chemins)
+            return False
+        
+        self.prix_moyens = typer_prix_communes(pd.read_parquet(chemins['prix_moyens']))
+        self.cube_prix = CubePrixCommunes.charger(chemins['cube_prix'])
+        self.distribution_ventes = DistributionRendementsVentes.charger(chemins['distribution_ventes'])
+        for nom in chemins:
+            self.cles_cache.pop(nom, None)
+        return True
+    
+    def _lire_source(self, nom, fichier, taille_bloc=None):
+        """Lit une source brute, ou directement sa version nettoyée si elle est en cache"""
+        if self.dossier_cache:
+            self._enregistrer_empreinte(nom, fichier, taille_bloc)
+            chemin = self._chemin_cache(nom)
+            
+            if os.path.exists(chemin):
+                print(f"{nom}: données nettoyées lues depuis le cache ({chemin})")
+                self.cles_cache.pop(nom, None)
+                return pd.read_parquet(chemin, memory_map=True)
+            self.cles_cache[nom] = chemin
+        
+        if nom == 'dvf':
+            # Exports officiels bruts (archive zip ou séparateur '|') : toujours lus en flux
+            with ouvrir_dvf(fichier) as (_, format_source, _):
+                brut = format_source['archive'] or format_source['sep'] != ';'
+            if taille_bloc or brut:
+                return self.charger_dvf_par_blocs(fichier, taille_bloc or TAILLE_BLOC_DVF)
+        return pd.read_csv(fichier, sep=';', encoding='latin-1')
+    
+    def _ecrire_cache(self, nom, data):
+        """Écrit une table nettoyée ou un agrégat dans le cache si sa source vient d'être lue"""
+        chemin = self.cles_cache.pop(nom, None)
+        if chemin is None:
+            return False
+        
+        try:
+            os.makedirs(self.dossier_cache, exist_ok=True)
+            if isinstance(data, (CubePrixCommunes, DistributionRendementsVentes)):
+                data.sauvegarder(chemin)
+                print(f"{nom}: agrégats mis en cache ({chemin})")
+                return True
+            data = data.copy()
+            # Colonnes texte aux types mélangés (ex. départements 1 et '2A') normalisées pour Parquet
+            for col in data.select_dtypes(include=['object', 'string']).columns:
+                data[col] = data[col].where(data[col].isna(), data[col].astype(str))
+            data.to_parquet(chemin, index=False)
+            print(f"{nom}: données nettoyées mises en cache ({chemin})")
+            return True
+        except Exception as e:
+            print(f"Cache non écrit pour {nom}: {e}")
+            return False
+    
+    def charger_dvf_par_blocs(self, fichier_dvf, taille_bloc=TAILLE_BLOC_DVF, noms_colonnes=None):
+        """Lit le DVF par blocs en ne gardant que les colonnes et appartements utiles
+
+        La mémoire crête dépend de la taille des blocs et non de celle du fichier :
+        chaque bloc est typé, filtré puis réduit avant d'être conservé.
+        Accepte aussi les exports officiels bruts ('|', éventuellement en archive
+        zip décompressée en flux) : séparateur et décimale sont détectés.
+        noms_colonnes sert à lire une tranche de fichier sans ligne d'en-tête.
+        """
+        blocs = []
+        nb_lignes = 0
+        entete = {'header': None, 'names': noms_colonnes} if noms_colonnes else {}
+        
+        with ouvrir_dvf(fichier_dvf, noms_colonnes) as (flux, format_source, avancement):
+            lecteur = pd.read_csv(
+                flux, sep=format_source['sep'], decimal=format_source['decimal'], encoding='latin-1',
+                usecols=lambda col: col in COLONNES_DVF,
+                dtype=COLONNES_DVF,
+                chunksize=taille_bloc,
+                **entete
+            )
+            for bloc in lecteur:
+                nb_lignes += len(bloc)
+                blocs.append(self._preparer_appartements(bloc))
+                if avancement:
+                    self.mesures.progression(avancement())
+        
+        # Catégories unifiées entre blocs pour que la concaténation les conserve
+        for col in COLONNES_CATEGORIELLES_DVF:
+            categories = union_categoricals([bloc[col] for bloc in blocs]).categories
+            for bloc in blocs:
+                bloc[col] = bloc[col].cat.set_categories(categories)
+        data_dvf = pd.concat(blocs, ignore_index=True)
+        print(f"DVF lu par blocs: {nb_lignes} lignes, {len(data_dvf)} appartements valides")
+        return data_dvf
+    
+    def _preparer_appartements(self, dvf):
+        """Filtre les appartements valides et calcule prix au m² et code INSEE
+
+        Les filtres de test.ipynb (vente, lot unique, au plus 2 pièces) s'appliquent
+        quand les colonnes sont présentes, c'est-à-dire sur les exports bruts.
+        """
+        if 'Nombre pieces principales' in dvf.columns:
+            pieces = pd.to_numeric(
+                dvf['Nombre pieces principales'].astype(str).str.replace(',', '.'), errors='coerce'
+            )
+        filtres = {'Type local = Appartement': dvf['Type local'] == 'Appartement'}
+        if 'Nature mutation' in dvf.columns:
+            filtres['Nature mutation = vente'] = dvf['Nature mutation'].str.contains('vente', case=False, na=False)
+        if 'Nombre de lots' in dvf.columns:
+            filtres['Nombre de lots = 1'] = pd.to_numeric(dvf['Nombre de lots'], errors='coerce') == 1
+        if 'Nombre pieces principales' in dvf.columns:
+            filtres['Nombre pieces principales <= 2'] = pieces <= 2
+        filtres['Valeur fonciere > 0'] = dvf['Valeur fonciere'] > 0
+        filtres['Surface Carrez > 0'] = dvf['Surface Carrez du 1er lot'] > 0
+        dvf = self._filtrer(dvf, filtres).drop(columns=COLONNES_FILTRES_DVF, errors='ignore')
+        # Les aberrants sont écartés commune par commune à l'agrégation (statistiques_robustes)
+        
+        # Calculer le prix au m²
+        dvf['prix_m2'] = dvf['Valeur fonciere'] / dvf['Surface Carrez du 1er lot']
+        
+        # Code INSEE entier et texte répétitif en catégories
+        dvf['insee_code'] = code_insee_dvf(dvf['Code departement'], dvf['Code commune'])
+        for col in COLONNES_CATEGORIELLES_DVF:
+            dvf[col] = dvf[col].astype('category')
+        
+        # Période et nombre de pièces pour le cube temporel (0 = inconnu)
+        if 'Date mutation' in dvf.columns:
+            date = dvf['Date mutation'].astype(str)
+            mois = pd.to_numeric(date.str[3:5], errors='coerce')
+            dvf['trimestre'] = ((mois - 1) // 3 + 1).fillna(0).astype('int8')
+            if 'annee' not in dvf.columns:
+                dvf['annee'] = pd.to_numeric(date.str[6:10], errors='coerce').astype('Int16')
+        else:
+            dvf['trimestre'] = np.int8(0)
+        if 'Nombre pieces principales' in dvf.columns:
+            pieces = pieces.loc[dvf.index]
+            dvf['nb_pieces'] = pieces.clip(0, len(CubePrixCommunes.PIECES) - 1).fillna(0).astype('int8')
+        else:
+            dvf['nb_pieces'] = np.int8(0)
+        return dvf
+    
+    def _filtrer(self, data, filtres):
+        """Applique des filtres successifs en comptant les lignes exclues par chacun"""
+        masque = np.ones(len(data), dtype=bool)
+        for nom, condition in filtres.items():
+            condition = condition.to_numpy(dtype=bool, na_value=False)
+            self.mesures.filtre(nom, (masque & ~condition).sum())
+            masque &= condition
+        return data[masque].copy()
+    
+    @etape_mesuree('nettoyer_donnees_dvf', entree='data_dvf', sortie='data_dvf')
     def nettoyer_donnees_dvf(self):
         """Nettoie et prépare les données DVF"""
         if self.data_dvf is None:
-            return False
+            # DVF inchangé : agrégats repris du cache, rien à nettoyer
+            return self.agregats_repris
+        
+        # Données déjà filtrées (chargement par blocs ou cache)
+        if 'prix_m2' in self.data_dvf.columns:
+            self._ecrire_cache('dvf', self.data_dvf)
+            print(f"DVF déjà nettoyé: {len(self.data_dvf)} appartements valides")
+            return True
             
         # Supprimer la première colonne vide
         self.data_dvf = self.data_dvf.drop(self.data_dvf.columns[0], axis=1)
@@ -52,30 +2562,23 @@ class AnalyseurRentabiliteImmobiliere:
         self.data_dvf['Surface Carrez du 1er lot'] = self.data_dvf['Surface Carrez du 1er lot'].astype(str).str.replace(',', '.')
         self.data_dvf['Surface Carrez du 1er lot'] = pd.to_numeric(self.data_dvf['Surface Carrez du 1er lot'], errors='coerce')
         
-        # Filtrer les données valides
-        self.data_dvf = self.data_dvf[
-            (self.data_dvf['Type local'] == 'Appartement') &
-            (self.data_dvf['Valeur fonciere'] > 0) &
-            (self.data_dvf['Surface Carrez du 1er lot'] > 0) &
-            (self.data_dvf['Valeur fonciere'] < 2000000)  # Filtre aberrants
-        ].copy()
-        
-        # Calculer le prix au m²
-        self.data_dvf['prix_m2'] = self.data_dvf['Valeur fonciere'] / self.data_dvf['Surface Carrez du 1er lot']
-        
-        # Créer code INSEE à 5 chiffres
-        self.data_dvf['insee_code'] = (
-            self.data_dvf['Code departement'].astype(str).str.zfill(2) + 
-            self.data_dvf['Code commune'].astype(str).str.zfill(3)
-        )
+        # Filtrer les données valides, prix au m² et code INSEE
+        self.data_dvf = self._preparer_appartements(self.data_dvf)
+        self._ecrire_cache('dvf', self.data_dvf)
         
         print(f"DVF nettoyé: {len(self.data_dvf)} appartements valides")
         return True
     
+    @etape_mesuree('nettoyer_donnees_loyers', entree='data_loyers', sortie='data_loyers')
     def nettoyer_donnees_loyers(self):
         """Nettoie et prépare les données de loyers"""
         if self.data_loyers is None:
             return False
+        
+        # Données déjà nettoyées (cache)
+        if 'insee_code' in self.data_loyers.columns:
+            print(f"Loyers déjà nettoyé: {len(self.data_loyers)} observations valides")
+            return True
             
         # Supprimer la première colonne vide
         self.data_loyers = self.data_loyers.drop(self.data_loyers.columns[0], axis=1)
@@ -84,128 +2587,405 @@ class AnalyseurRentabiliteImmobiliere:
         self.data_loyers['loypredm2'] = self.data_loyers['loypredm2'].astype(str).str.replace(',', '.')
         self.data_loyers['loypredm2'] = pd.to_numeric(self.data_loyers['loypredm2'], errors='coerce')
         
-        # Créer code INSEE à 5 chiffres
-        self.data_loyers['insee_code'] = self.data_loyers['INSEE_C'].astype(str).str.zfill(5)
+        # Code INSEE entier, libellés et départements en catégories
+        self.data_loyers['insee_code'] = encoder_insee(self.data_loyers['INSEE_C'])
+        for col in ['LIBGEO', 'DEP']:
+            self.data_loyers[col] = self.data_loyers[col].astype(str).astype('category')
         
         # Filtrer les loyers valides
-        self.data_loyers = self.data_loyers[
-            (self.data_loyers['loypredm2'] > 0) &
-            (self.data_loyers['loypredm2'] < 50)  # Filtre aberrants
-        ].copy()
+        self.data_loyers = self._filtrer(self.data_loyers, {
+            'loypredm2 > 0': self.data_loyers['loypredm2'] > 0,
+            'loypredm2 < 50': self.data_loyers['loypredm2'] < 50  # Filtre aberrants
+        })
+        self._ecrire_cache('loyers', self.data_loyers)
         
         print(f"Loyers nettoyé: {len(self.data_loyers)} observations valides")
         return True
     
-    def calculer_prix_moyens_par_commune(self):
-        """Calcule les prix moyens de vente par commune"""
+    def integrer_lot_dvf(self, identifiant=None):
+        """Ajoute le DVF nettoyé courant au stock d'agrégats et le sauvegarde"""
+        if self.data_dvf is None or 'prix_m2' not in self.data_dvf.columns:
+            return False
+        if self.stock_agregats is None:
+            self.stock_agregats = StockAgregatsCommunes()
+        
+        if self.stock_agregats.ajouter_lot(self.data_dvf, identifiant):
+            self.stock_agregats.sauvegarder()
+        return True
+    
+    @etape_mesuree('calculer_prix_moyens_par_commune', entree='data_dvf', sortie='resultat')
+    def calculer_prix_moyens_par_commune(self, depuis_stock=False, depuis_parallele=False):
+        """Calcule les prix moyens de vente par commune
+
+        depuis_stock : lecture du stock d'agrégats (lots intégrés par
+        integrer_lot_dvf) au lieu du DVF chargé.
+        depuis_parallele : résultat de ingerer_dvf_parallele au lieu du DVF chargé.
+        """
+        if depuis_parallele:
+            if self.prix_moyens_parallele is None:
+                print("Aucune ingestion parallèle: lancer ingerer_dvf_parallele")
+            return self.prix_moyens_parallele
+        if depuis_stock:
+            if self.stock_agregats is None or self.stock_agregats.est_vide():
+                print("Stock d'agrégats vide: aucun lot intégré")
+                return None
+            return self.stock_agregats.prix_moyens()
+        
+        # DVF inchangé : agrégats repris du cache par charger_donnees
+        if self.agregats_repris:
+            return self.prix_moyens
+        
         if self.data_dvf is None:
             return None
-            
-        prix_moyens = self.data_dvf.groupby(['insee_code', 'Commune']).agg({
-            'prix_m2': ['mean', 'median', 'count'],
-            'Valeur fonciere': 'mean',
-            'Surface Carrez du 1er lot': 'mean',
-            'Code postal': 'first',
-            'Code departement': 'first'
-        }).round(2)
-        
-        # Aplatir les colonnes multi-index
-        prix_moyens.columns = ['prix_m2_moyen', 'prix_m2_median', 'nb_ventes', 
-                              'valeur_moyenne', 'surface_moyenne', 'code_postal', 'departement']
-        prix_moyens = prix_moyens.reset_index()
+        
+        # Statistiques robustes par commune ; ventes écartées marquées dans le DVF
+        prix_moyens, aberrant = agreger_prix_communes(self.data_dvf)
+        self.data_dvf['prix_m2_aberrant'] = aberrant
+        self.mesures.filtre('prix_m2 aberrant (MAD par commune)', int(aberrant.sum()))
         
         return prix_moyens
     
+    @etape_mesuree('agreger_ventes_communes', entree='data_dvf', sortie='prix_moyens')
+    def agreger_ventes_communes(self, depuis_stock=False, depuis_parallele=False):
+        """Agrège les ventes par commune avant la fusion, résultat consultable dans prix_moyens
+
+        depuis_stock, depuis_parallele : voir calculer_prix_moyens_par_commune.
+        """
+        self.prix_moyens = self.calculer_prix_moyens_par_commune(depuis_stock, depuis_parallele)
+        if self.prix_moyens is None:
+            return False
+        if not (depuis_stock or depuis_parallele):
+            # Agrégats du seul DVF de cette analyse (le stock cumule plusieurs lots)
+            self._ecrire_cache('prix_moyens', self.prix_moyens)
+        return True
+    
+    @etape_mesuree('ingerer_dvf_parallele', sortie='prix_moyens_parallele')
+    def ingerer_dvf_parallele(self, fichiers, nb_processus=None, taille_bloc=TAILLE_BLOC_DVF):
+        """Calcule les prix moyens par commune de plusieurs fichiers DVF en parallèle
+
+        Voir ingerer_dvf_en_parallele ; le résultat est gardé dans
+        prix_moyens_parallele et n'est utilisé qu'avec
+        agreger_ventes_communes(depuis_parallele=True).
+        """
+        try:
+            self.prix_moyens_parallele = ingerer_dvf_en_parallele(fichiers, nb_processus, taille_bloc)
+            return True
+        except Exception as e:
+            print(f"Erreur lors de l'ingestion parallèle: {e}")
+            return False
+    
+    @etape_mesuree('fusionner_donnees', entree='data_loyers', sortie='data_merged')
     def fusionner_donnees(self):
-        """Fusionne les données de vente et de location"""
-        prix_moyens = self.calculer_prix_moyens_par_commune()
+        """Fusionne les données de vente et de location
+
+        Prix par commune de agreger_ventes_communes s'il a été exécuté pour le
+        DVF chargé, sinon calculés sur ce DVF.
+        """
+        prix_moyens = self.prix_moyens if self.prix_moyens is not None else self.calculer_prix_moyens_par_commune()
         
         if prix_moyens is None or self.data_loyers is None:
             return False
         
-        # Fusion sur le code INSEE
-        self.data_merged = pd.merge(
-            prix_moyens, 
-            self.data_loyers[['insee_code', 'LIBGEO', 'DEP', 'loypredm2']],
-            on='insee_code',
-            how='inner'
-        )
+        # Loyers réduits à une ligne par (commune, année) ; jointure sur l'année
+        # des prix quand elle est connue, sinon sur le loyer le plus récent
+        self.index_loyers = IndexLoyersCommunes(self.data_loyers)
+        annees = next((prix_moyens[col] for col in ('annee', 'annee_ventes') if col in prix_moyens.columns), None)
+        positions = self.index_loyers.rechercher(prix_moyens['insee_code'], annees)
+        
+        trouve = positions >= 0
+        positions = positions[trouve]
+        self.data_merged = prix_moyens[trouve].reset_index(drop=True)
+        self.data_merged['LIBGEO'] = pd.Categorical(self.index_loyers.libelles[positions])
+        self.data_merged['DEP'] = pd.Categorical(self.index_loyers.departements[positions])
+        self.data_merged['loypredm2'] = self.index_loyers.loyers[positions]
+        annee_loyer = self.index_loyers.cles[positions] % 10_000
+        self.data_merged['annee_loyer'] = pd.array(np.where(annee_loyer > 0, annee_loyer, None), dtype='Int16')
         
         print(f"Données fusionnées: {len(self.data_merged)} communes")
+        self.index_recherche = None
+        self.index_spatial = None
+        return True
+    
+    @etape_mesuree('emprunter_prix_voisins', entree='data_merged', sortie='data_merged')
+    def emprunter_prix_voisins(self, min_ventes=MIN_VENTES_FIABLES, k=VOISINS_EMPRUNT, rayon_km=RAYON_EMPRUNT_KM):
+        """Complète le prix au m² des communes à faible nombre de ventes par celui de leurs voisines
+
+        Pour une commune de n < min_ventes ventes, le prix retenu pèse n / min_ventes
+        pour ses propres ventes et le reste pour le prix moyen des k communes fiables
+        les plus proches dans un rayon de rayon_km, pondéré par l'inverse de la
+        distance. Le prix d'origine est conservé dans prix_m2_commune. Toutes les
+        communes sont traitées en une requête spatiale ; à appeler avant calculer_rentabilite.
+        """
+        if self.data_merged is None:
+            return False
+        if 'latitude' not in self.data_merged.columns and not self.attacher_centroides():
+            return False
+        
+        data = self.data_merged
+        if 'prix_m2_commune' not in data.columns:
+            data['prix_m2_commune'] = data['prix_m2_moyen']
+        prix = data['prix_m2_commune'].to_numpy(dtype='float64', na_value=np.nan)
+        nb_ventes = data['nb_ventes'].to_numpy(dtype='float64', na_value=0)
+        latitudes = data['latitude'].to_numpy(dtype='float64', na_value=np.nan)
+        longitudes = data['longitude'].to_numpy(dtype='float64', na_value=np.nan)
+        
+        fiables = (nb_ventes >= min_ventes) & ~np.isnan(prix)
+        index = IndexSpatialCommunes(np.where(fiables, latitudes, np.nan), longitudes)
+        faibles = np.flatnonzero(~fiables)
+        requetes, positions, distances = index.voisins(latitudes[faibles], longitudes[faibles], rayon_km, k)
+        
+        poids = 1 / np.maximum(distances, DISTANCE_MIN_KM)
+        somme_poids = np.bincount(requetes, weights=poids, minlength=len(faibles))
+        somme_prix = np.bincount(requetes, weights=poids * prix[positions], minlength=len(faibles))
+        prix_voisins = np.full(len(data), np.nan)
+        prix_voisins[faibles] = np.where(somme_poids > 0, somme_prix / np.where(somme_poids > 0, somme_poids, 1), np.nan)
+        nb_voisins = np.zeros(len(data), dtype='int16')
+        nb_voisins[faibles] = np.bincount(requetes, minlength=len(faibles))
+        
+        emprunte = ~np.isnan(prix_voisins)
+        part_commune = np.clip(nb_ventes / min_ventes, 0, 1)
+        prix_commune = np.where(part_commune > 0, part_commune * np.nan_to_num(prix), 0)
+        data['prix_m2_voisins'] = prix_voisins.round(2)
+        data['nb_voisins'] = nb_voisins
+        data['prix_emprunte'] = emprunte
+        data['prix_m2_moyen'] = np.where(
+            emprunte, prix_commune + (1 - part_commune) * prix_voisins, prix
+        ).round(2)
+        
+        print(f"Prix complétés par les voisines: {int(emprunte.sum())} communes "
+              f"sur {len(faibles)} à moins de {min_ventes} ventes")
+        self.index_recherche = None
+        return True
+    
+    @etape_mesuree('calculer_rentabilite', entree='data_merged', sortie='data_merged')
+    def calculer_rentabilite(self, scenario=None, seuils=SEUILS_RENTABILITE):
+        """Calcule les indices de rentabilité
+
+        scenario : paramètres d'investissement (voir PARAMETRES_SCENARIO) pour
+        calculer la rentabilité nette réelle ; sans scénario, 85 % de la brute.
+        seuils : bornes croissantes des classes d'attractivité (rentabilité brute %).
+        """
+        if self.data_merged is None:
+            return False
+        seuils = valider_seuils(seuils)
+        self.seuils_rentabilite = seuils
+        
+        # Rentabilité brute annuelle (%)
+        self.data_merged['rentabilite_brute'] = (
+            (self.data_merged['loypredm2'] * 12) / self.data_merged['prix_m2_moyen']
+        ) * 100
+        
+        if scenario is None:
+            # Rentabilité nette estimée (85% de la brute)
+            self.data_merged['rentabilite_nette'] = self.data_merged['rentabilite_brute'] * RATIO_RENTABILITE_NETTE
+        else:
+            # Rentabilité nette de charges selon le scénario
+            resultats = self.evaluer_scenarios(grille_scenarios(**scenario))
+            self.data_merged['rentabilite_nette'] = resultats['rentabilite_nette'][:, 0]
+        
+        # Ratio prix/loyer
+        self.data_merged['ratio_prix_loyer'] = self.data_merged['prix_m2_moyen'] / self.data_merged['loypredm2']
+        
+        # Classification de l'attractivité
+        conditions = [self.data_merged['rentabilite_brute'] >= seuil for seuil in reversed(seuils)]
+        choices = CLASSES_ATTRACTIVITE[:0:-1]
+        self.data_merged['attractivite'] = pd.Categorical(
+            np.select(conditions, choices, CLASSES_ATTRACTIVITE[0]), categories=CLASSES_ATTRACTIVITE, ordered=True
+        )
+        
+        self.index_recherche = None
+        return True
+    
+    @etape_mesuree('traitement_sql', sortie='data_merged')
+    def traitement_sql(self, fichier_dvf, fichier_loyers, chemin_base='ventes_dvf.sqlite',
+                       types_local=('Appartement',), taille_bloc=TAILLE_BLOC_DVF, seuils=SEUILS_RENTABILITE,
+                       filtres=None, ratio_nette=RATIO_RENTABILITE_NETTE):
+        """Pipeline complet hors mémoire dans une base SQLite (voir BaseVentesSQL)
+
+        Remplace chargement, nettoyage, fusion et calcul des rentabilités : le DVF
+        n'est jamais chargé en entier (data_dvf reste vide, pas de cube temporel).
+        types_local : types de biens retenus, par exemple ('Appartement', 'Maison') ;
+        les filtres du notebook ne s'appliquent alors que sur demande (voir
+        BaseVentesSQL.filtres_ventes).
+        """
+        base = BaseVentesSQL(chemin_base)
+        try:
+            base.importer_dvf(fichier_dvf, taille_bloc, self.mesures.progression)
+            self.data_loyers = self._lire_source('loyers', fichier_loyers)
+            self.nettoyer_donnees_loyers()
+            base.importer_loyers(self.data_loyers)
+            self.data_merged = base.resultats(types_local, seuils, filtres=filtres, ratio_nette=ratio_nette)
+            self.seuils_rentabilite = list(seuils)
+        except Exception as e:
+            print(f"Erreur lors du traitement SQL: {e}")
+            return False
+        finally:
+            base.fermer()
+        
+        self.data_dvf = None
+        self.prix_moyens = None
+        self.index_recherche = None
+        self.index_spatial = None
+        print(f"Données fusionnées (SQL): {len(self.data_merged)} communes")
+        return True
+    
+    @etape_mesuree('construire_cube_prix', entree='data_dvf')
+    def construire_cube_prix(self):
+        """Précalcule le cube temporel des prix et loyers (voir CubePrixCommunes)"""
+        if self.data_dvf is None or 'trimestre' not in self.data_dvf.columns:
+            return False
+        
+        self.cube_prix = CubePrixCommunes.construire(self.data_dvf, self.data_loyers)
+        self._ecrire_cache('cube_prix', self.cube_prix)
+        print(f"Cube des prix: {len(self.cube_prix.communes)} communes × {len(self.cube_prix.annees)} années")
+        return True
+    
+    @etape_mesuree('calculer_tendances', entree='data_merged', sortie='data_merged')
+    def calculer_tendances(self, pieces=None):
+        """Ajoute les tendances de prix et loyers et la rentabilité ajustée de la tendance
+
+        rentabilite_ajustee = rentabilité brute + croissance annuelle moyenne du prix (%).
+        """
+        if self.data_merged is None:
+            return False
+        if self.cube_prix is None and not self.construire_cube_prix():
+            # Enrichissement facultatif : l'analyse reste valide sans tendances
+            print("Tendances indisponibles: transactions DVF datées absentes")
+            return True
+        
+        if self.cube_prix.loyers is None and self.data_loyers is not None:
+            # Cube repris du cache : loyers de cette analyse rattachés
+            self.cube_prix.ajouter_loyers(self.data_loyers)
+        
+        tendances = self.cube_prix.tendances(pieces)
+        position = self.cube_prix.position(self.data_merged['insee_code'])
+        for col in tendances.columns.drop('insee_code'):
+            valeurs = tendances[col].to_numpy()[position]
+            self.data_merged[col] = np.where(position >= 0, valeurs, np.nan)
+        self.data_merged['rentabilite_ajustee'] = (
+            self.data_merged['rentabilite_brute'] + self.data_merged['croissance_prix_annuelle']
+        )
+        self.index_recherche = None
+        return True
+    
+    @etape_mesuree('calculer_rendements_ventes', entree='data_merged', sortie='rendements_ventes')
+    def calculer_rendements_ventes(self, cible=RENDEMENT_CIBLE):
+        """Distribution du rendement brut des ventes par commune × nombre de pièces
+
+        Rendement de chaque transaction retenue face au loyer (loypredm2) de sa
+        commune : percentiles p10/p50/p90 et part des ventes au rendement au
+        moins égal à cible (%), dans rendements_ventes (voir DistributionRendementsVentes).
+        """
+        if self.data_merged is None:
+            return False
+        if self.distribution_ventes is None:
+            if self.data_dvf is None or 'prix_m2' not in self.data_dvf.columns:
+                # Enrichissement facultatif, comme les tendances
+                print("Rendements par vente indisponibles: transactions DVF absentes")
+                return True
+            self.distribution_ventes = DistributionRendementsVentes.construire(self.data_dvf)
+            self._ecrire_cache('distribution_ventes', self.distribution_ventes)
+        
+        self.rendements_ventes = self.distribution_ventes.rendements(
+            self.data_merged['insee_code'], self.data_merged['loypredm2'], cible
+        )
+        print(f"Rendements des ventes: {int(self.distribution_ventes.n.sum()) // 2} ventes, "
+              f"{len(self.rendements_ventes)} segments commune × pièces")
         return True
     
-    def calculer_rentabilite(self):
-        """Calcule les indices de rentabilité"""
+    @etape_mesuree('evaluer_scenarios', entree='data_merged')
+    def evaluer_scenarios(self, scenarios=None, surface_m2=None):
+        """Indicateurs communes × scénarios (voir MoteurScenarios.evaluer)
+
+        scenarios : DataFrame de paramètres, typiquement issu de grille_scenarios.
+        Les lignes des tableaux suivent l'ordre de data_merged.
+        """
+        if self.data_merged is None:
+            return None
+        return MoteurScenarios(self.data_merged, surface_m2).evaluer(scenarios)
+    
+    @etape_mesuree('obtenir_coordonnees_communes', entree='data_merged', sortie='data_merged')
+    def obtenir_coordonnees_communes(self, echantillon=100, hors_ligne=None):
+        """Obtient les coordonnées GPS d'un échantillon de communes (toutes si echantillon=None)
+
+        En mode hors ligne (par défaut dès qu'un fichier de centroïdes est fourni),
+        toutes les communes reçoivent leurs coordonnées par jointure vectorisée
+        et l'échantillon est ignoré.
+        """
         if self.data_merged is None:
             return False
         
-        # Rentabilité brute annuelle (%)
-        self.data_merged['rentabilite_brute'] = (
-            (self.data_merged['loypredm2'] * 12) / self.data_merged['prix_m2_moyen']
-        ) * 100
+        if hors_ligne is None:
+            hors_ligne = self.fichier_centroides is not None or self.index_centroides is not None
+        if hors_ligne:
+            return self.attacher_centroides()
         
-        # Rentabilité nette estimée (85% de la brute)
-        self.data_merged['rentabilite_nette'] = self.data_merged['rentabilite_brute'] * 0.85
+        # Échantillon des communes les plus rentables, le cache évite les requêtes répétées
+        if echantillon is None:
+            sample_data = self.data_merged
+        else:
+            sample_data = self.data_merged.nlargest(echantillon, 'rentabilite_brute')
         
-        # Ratio prix/loyer
-        self.data_merged['ratio_prix_loyer'] = self.data_merged['prix_m2_moyen'] / self.data_merged['loypredm2']
+        self.geocodeur.coordonnees(sample_data)
         
-        # Classification de l'attractivité
-        conditions = [
-            self.data_merged['rentabilite_brute'] >= 8,
-            self.data_merged['rentabilite_brute'] >= 6,
-            self.data_merged['rentabilite_brute'] >= 4,
-            self.data_merged['rentabilite_brute'] >= 2
-        ]
-        choices = ['Excellente', 'Très bonne', 'Bonne', 'Correcte']
-        self.data_merged['attractivite'] = np.select(conditions, choices, 'Faible')
+        # Fusionner toutes les coordonnées connues avec les données principales
+        coords_df = self.geocodeur.lire_cache().dropna(subset=['latitude'])
+        if not coords_df.empty:
+            self.data_merged = pd.merge(
+                self.data_merged.drop(columns=['latitude', 'longitude'], errors='ignore'),
+                coords_df, on='insee_code', how='left'
+            )
+            self.index_spatial = None
         
         return True
     
-    def obtenir_coordonnees_communes(self, echantillon=100):
-        """Obtient les coordonnées GPS d'un échantillon de communes"""
-        if self.data_merged is None:
-            return False
-        
-        # Prendre un échantillon pour éviter trop de requêtes API
-        sample_data = self.data_merged.nlargest(echantillon, 'rentabilite_brute').copy()
+    def attacher_centroides(self):
+        """Ajoute latitude/longitude à toutes les communes depuis le référentiel local"""
+        if self.index_centroides is None:
+            if self.fichier_centroides is None:
+                print("Aucun fichier de centroïdes configuré")
+                return False
+            self.index_centroides = IndexCentroidesCommunes.depuis_fichier(self.fichier_centroides)
         
-        coords = []
-        for idx, row in sample_data.iterrows():
-            try:
-                location = self.geolocator.geocode(f"{row['Commune']}, France", timeout=10)
-                if location:
-                    coords.append({
-                        'insee_code': row['insee_code'],
-                        'latitude': location.latitude,
-                        'longitude': location.longitude
-                    })
-                    print(f"Géocodage: {row['Commune']} - OK")
-                else:
-                    print(f"Géocodage: {row['Commune']} - Échec")
-            except Exception as e:
-                print(f"Erreur géocodage {row['Commune']}: {e}")
-                continue
+        latitudes, longitudes = self.index_centroides.rechercher(self.data_merged['insee_code'])
+        self.data_merged['latitude'] = latitudes
+        self.data_merged['longitude'] = longitudes
         
-        # Fusionner avec les données principales
-        coords_df = pd.DataFrame(coords)
-        if not coords_df.empty:
-            self.data_merged = pd.merge(self.data_merged, coords_df, on='insee_code', how='left')
+        self.index_spatial = None
         
+        nb_absentes = int(np.isnan(latitudes).sum())
+        print(f"Centroïdes attachés: {len(latitudes) - nb_absentes} communes, {nb_absentes} absentes du référentiel")
         return True
     
-    def creer_carte_rentabilite(self):
-        """Crée une carte interactive de la rentabilité"""
+    @etape_mesuree('creer_carte_rentabilite', entree='data_merged')
+    def creer_carte_rentabilite(self, mode='auto'):
+        """Crée une carte interactive de la rentabilité
+
+        mode : 'marqueurs' (un marqueur par commune), 'cluster' (regroupement
+        construit en une passe vectorisée), 'grille' (moyennes par maille, taille
+        HTML bornée) ou 'auto' selon le nombre de communes.
+        """
         if self.data_merged is None:
             return None
         
         # Filtrer les communes avec coordonnées
+        if 'latitude' not in self.data_merged.columns:
+            print("Aucune coordonnée disponible pour la carte")
+            return None
         data_carte = self.data_merged.dropna(subset=['latitude', 'longitude'])
         
         if data_carte.empty:
             print("Aucune coordonnée disponible pour la carte")
             return None
         
+        if mode == 'auto':
+            if len(data_carte) <= SEUIL_CARTE_CLUSTER:
+                mode = 'marqueurs'
+            elif len(data_carte) <= SEUIL_CARTE_GRILLE:
+                mode = 'cluster'
+            else:
+                mode = 'grille'
+        
         # Créer la carte centrée sur la France
         carte = folium.Map(
             location=[46.603354, 1.888334],
@@ -213,77 +2993,161 @@ class AnalyseurRentabiliteImmobiliere:
             tiles='OpenStreetMap'
         )
         
-        # Couleurs selon la rentabilité
-        def get_color(rentabilite):
-            if rentabilite >= 8:
-                return 'green'
-            elif rentabilite >= 6:
-                return 'lightgreen'
-            elif rentabilite >= 4:
-                return 'orange'
-            elif rentabilite >= 2:
-                return 'red'
-            else:
-                return 'darkred'
+        if mode == 'marqueurs':
+            self._ajouter_marqueurs(carte, data_carte)
+        elif mode == 'cluster':
+            self._ajouter_cluster(carte, data_carte)
+        else:
+            self._ajouter_grille(carte, data_carte)
+        
+        # Légende : bornes des classes de calculer_rentabilite
+        seuils = self.seuils_rentabilite
+        bornes = [f"&lt; {seuils[0]:g}%"] + [f"{bas:g}-{haut:g}%" for bas, haut in zip(seuils, seuils[1:])] + [f"≥ {seuils[-1]:g}%"]
+        lignes_legende = ''.join(
+            f'<p><i class="fa fa-circle" style="color:{couleur}"></i> {borne} - {classe}</p>'
+            for couleur, borne, classe in list(zip(COULEURS_RENTABILITE, bornes, CLASSES_ATTRACTIVITE))[::-1]
+        )
+        legend_html = f"""
+        <div style="position: fixed; 
+                    bottom: 50px; left: 50px; width: 200px; height: 120px; 
+                    background-color: white; border:2px solid grey; z-index:9999; 
+                    font-size:14px; padding: 10px">
+        <p><b>Rentabilité brute</b></p>
+        {lignes_legende}
+        </div>
+        """
+        carte.get_root().html.add_child(folium.Element(legend_html))
         
-        # Ajouter les marqueurs
-        for idx, row in data_carte.iterrows():
+        return carte
+    
+    def _classes_carte(self, data_carte):
+        """Indice de classe d'attractivité de chaque point (couleur de COULEURS_RENTABILITE)
+
+        Classe de data_merged quand elle existe ; pour les moyennes par maille,
+        bornes de la dernière classification (self.seuils_rentabilite).
+        """
+        if 'attractivite' in data_carte.columns:
+            attractivite = pd.Categorical(data_carte['attractivite'], categories=CLASSES_ATTRACTIVITE, ordered=True)
+            return np.asarray(attractivite.codes).clip(min=0)
+        return np.digitize(data_carte['rentabilite_brute'].to_numpy(), self.seuils_rentabilite)
+    
+    def _ajouter_marqueurs(self, carte, data_carte):
+        """Un CircleMarker avec popup HTML par commune (petits volumes)"""
+        classes = self._classes_carte(data_carte)
+        for (idx, row), classe in zip(data_carte.iterrows(), classes):
             folium.CircleMarker(
                 location=[row['latitude'], row['longitude']],
                 radius=8,
                 popup=folium.Popup(f"""
-                <b>{row['Commune']}</b><br>
+                <b>{html.escape(str(row['Commune']))}</b><br>
                 Prix achat: {row['prix_m2_moyen']:.0f}€/m²<br>
                 Loyer: {row['loypredm2']:.1f}€/m²/mois<br>
                 <b>Rentabilité brute: {row['rentabilite_brute']:.2f}%</b><br>
-                Attractivité: {row['attractivite']}
+                Attractivité: {CLASSES_ATTRACTIVITE[classe]}
                 """, max_width=300),
                 color='black',
-                fillColor=get_color(row['rentabilite_brute']),
+                fillColor=COULEURS_RENTABILITE[classe],
                 fillOpacity=0.8,
                 weight=1
             ).add_to(carte)
+    
+    def _ajouter_cluster(self, carte, data_carte):
+        """Couche FastMarkerCluster : données compactes, marqueurs créés par le navigateur"""
+        classes = self._classes_carte(data_carte)
+        lignes = pd.DataFrame({
+            'lat': data_carte['latitude'].to_numpy().round(4),
+            'lon': data_carte['longitude'].to_numpy().round(4),
+            'commune': data_carte['Commune'].astype(str).to_numpy(),
+            'prix': data_carte['prix_m2_moyen'].to_numpy().round(0).astype('int64'),
+            'loyer': data_carte['loypredm2'].to_numpy().round(1),
+            'rentabilite': data_carte['rentabilite_brute'].to_numpy().round(2),
+            'classe': classes
+        }).values.tolist()
         
-        # Légende
-        legend_html = """
-        <div style="position: fixed; 
-                    bottom: 50px; left: 50px; width: 200px; height: 120px; 
-                    background-color: white; border:2px solid grey; z-index:9999; 
-                    font-size:14px; padding: 10px">
-        <p><b>Rentabilité brute</b></p>
-        <p><i class="fa fa-circle" style="color:green"></i> ≥ 8% - Excellente</p>
-        <p><i class="fa fa-circle" style="color:lightgreen"></i> 6-8% - Très bonne</p>
-        <p><i class="fa fa-circle" style="color:orange"></i> 4-6% - Bonne</p>
-        <p><i class="fa fa-circle" style="color:red"></i> 2-4% - Correcte</p>
-        <p><i class="fa fa-circle" style="color:darkred"></i> < 2% - Faible</p>
-        </div>
-        """
-        carte.get_root().html.add_child(folium.Element(legend_html))
+        plugins.FastMarkerCluster(
+            lignes,
+            callback=CALLBACK_CARTE_CLUSTER,
+            options={'chunkedLoading': True, 'disableClusteringAtZoom': 11}
+        ).add_to(carte)
+    
+    def _ajouter_grille(self, carte, data_carte, pas=PAS_GRILLE_CARTE):
+        """Moyennes de rentabilité par maille : taille bornée par le nombre de mailles"""
+        mailles = data_carte.assign(
+            maille_lat=np.floor(data_carte['latitude'].to_numpy() / pas),
+            maille_lon=np.floor(data_carte['longitude'].to_numpy() / pas)
+        ).groupby(['maille_lat', 'maille_lon'], sort=False).agg(
+            lat=('latitude', 'mean'),
+            lon=('longitude', 'mean'),
+            nb=('insee_code', 'size'),
+            prix=('prix_m2_moyen', 'mean'),
+            loyer=('loypredm2', 'mean'),
+            rentabilite=('rentabilite_brute', 'mean')
+        )
         
-        return carte
+        # Réutilise le rendu du mode cluster avec une ligne par maille
+        self._ajouter_cluster(carte, pd.DataFrame({
+            'latitude': mailles['lat'].to_numpy(),
+            'longitude': mailles['lon'].to_numpy(),
+            'Commune': mailles['nb'].astype(str).to_numpy() + ' communes',
+            'prix_m2_moyen': mailles['prix'].to_numpy(),
+            'loypredm2': mailles['loyer'].to_numpy(),
+            'rentabilite_brute': mailles['rentabilite'].to_numpy()
+        }))
+    
+    def rechercher_communes(self, **filtres):
+        """Recherche paginée des communes (voir IndexRechercheCommunes.rechercher)
+
+        Retourne (page, nombre total de résultats) ; l'index est construit au
+        premier appel puis réutilisé tant que data_merged n'est pas modifié.
+        """
+        if self.data_merged is None:
+            return None, 0
+        if self.index_recherche is None:
+            self.index_recherche = IndexRechercheCommunes(self.data_merged)
+        return self.index_recherche.rechercher(**filtres)
+    
+    def communes_dans_rayon(self, latitude, longitude, rayon_km):
+        """Communes à moins de rayon_km d'un point, de la plus proche à la plus éloignée
+
+        Nécessite les coordonnées des communes (obtenir_coordonnees_communes) ;
+        l'index spatial est construit au premier appel puis réutilisé.
+        """
+        if self.data_merged is None or 'latitude' not in self.data_merged.columns:
+            return None
+        if self.index_spatial is None:
+            self.index_spatial = IndexSpatialCommunes(self.data_merged['latitude'], self.data_merged['longitude'])
+        _, positions, distances = self.index_spatial.voisins(latitude, longitude, rayon_km)
+        communes = self.data_merged.iloc[positions].copy()
+        communes['distance_km'] = distances.round(2)
+        return communes
     
+    @etape_mesuree('analyser_top_communes', entree='data_merged', sortie='resultat')
     def analyser_top_communes(self, n=20):
         """Analyse les meilleures communes pour investir"""
         if self.data_merged is None:
             return None
         
-        # Filtrer les communes avec un minimum de données
-        data_filtered = self.data_merged[
-            (self.data_merged['nb_ventes'] >= 3) &
-            (self.data_merged['rentabilite_brute'] > 0)
-        ].copy()
-        
-        # Top communes par rentabilité
-        top_communes = data_filtered.nlargest(n, 'rentabilite_brute')
+        # Communes avec un minimum de données (ou un prix complété par les voisines),
+        # par rentabilité décroissante
+        top_communes, _ = self.rechercher_communes(min_ventes=MIN_VENTES_FIABLES, rentabilite_min=0, taille_page=n)
         
         return top_communes[['Commune', 'departement', 'prix_m2_moyen', 'loypredm2', 
                             'rentabilite_brute', 'rentabilite_nette', 'attractivite', 'nb_ventes']]
     
-    def creer_graphiques_analyse(self):
-        """Crée des graphiques d'analyse"""
+    @etape_mesuree('creer_graphiques_analyse', entree='data_merged')
+    def creer_graphiques_analyse(self, mode='auto'):
+        """Crée des graphiques d'analyse
+
+        mode : 'complet' (toutes les communes envoyées au navigateur), 'agrege'
+        (histogramme et densité précalculés, nuage échantillonné en WebGL en
+        gardant les points atypiques) ou 'auto' selon le nombre de communes.
+        """
         if self.data_merged is None:
             return None
         
+        if mode == 'auto':
+            mode = 'complet' if len(self.data_merged) <= SEUIL_GRAPHIQUES_AGREGES else 'agrege'
+        
         fig = make_subplots(
             rows=2, cols=2,
             subplot_titles=(
@@ -293,27 +3157,31 @@ class AnalyseurRentabiliteImmobiliere:
                 'Répartition par attractivité'
             ),
             specs=[[{"secondary_y": False}, {"secondary_y": False}],
-                   [{"secondary_y": False}, {"secondary_y": False}]]
-        )
-        
-        # 1. Histogramme rentabilité
-        fig.add_trace(
-            go.Histogram(x=self.data_merged['rentabilite_brute'], nbinsx=50, name='Rentabilité'),
-            row=1, col=1
+                   [{"secondary_y": False}, {"type": "domain"}]]
         )
         
-        # 2. Scatter plot prix vs loyer
-        fig.add_trace(
-            go.Scatter(
-                x=self.data_merged['prix_m2_moyen'],
-                y=self.data_merged['loypredm2'],
-                mode='markers',
-                text=self.data_merged['Commune'],
-                name='Communes',
-                marker=dict(size=6, opacity=0.6)
-            ),
-            row=1, col=2
-        )
+        if mode == 'complet':
+            # 1. Histogramme rentabilité
+            fig.add_trace(
+                go.Histogram(x=self.data_merged['rentabilite_brute'], nbinsx=NB_CLASSES_HISTOGRAMME, name='Rentabilité'),
+                row=1, col=1
+            )
+            
+            # 2. Scatter plot prix vs loyer
+            fig.add_trace(
+                go.Scatter(
+                    x=self.data_merged['prix_m2_moyen'],
+                    y=self.data_merged['loypredm2'],
+                    mode='markers',
+                    text=self.data_merged['Commune'],
+                    name='Communes',
+                    marker=dict(size=6, opacity=0.6)
+                ),
+                row=1, col=2
+            )
+        else:
+            self._ajouter_histogramme_agrege(fig, self.data_merged['rentabilite_brute'])
+            self._ajouter_nuage_agrege(fig, self.data_merged)
         
         # 3. Top communes
         top_15 = self.data_merged.nlargest(15, 'rentabilite_brute')
@@ -341,8 +3209,96 @@ class AnalyseurRentabiliteImmobiliere:
         fig.update_layout(height=800, showlegend=False, title_text="Analyse de Rentabilité Immobilière")
         return fig
 
-    def traitement_complet_avec_progress(self, fichier_dvf, fichier_loyers):
-        """Traitement complet avec barre de progression"""
+    def _ajouter_histogramme_agrege(self, fig, valeurs):
+        """Histogramme calculé côté serveur : une barre par classe au lieu des valeurs brutes"""
+        valeurs = valeurs.to_numpy(dtype='float64', na_value=np.nan)
+        effectifs, bornes = np.histogram(valeurs[np.isfinite(valeurs)], bins=NB_CLASSES_HISTOGRAMME)
+        fig.add_trace(
+            go.Bar(
+                x=(bornes[:-1] + bornes[1:]) / 2,
+                y=effectifs,
+                width=np.diff(bornes),
+                name='Rentabilité'
+            ),
+            row=1, col=1
+        )
+    
+    def _ajouter_nuage_agrege(self, fig, data):
+        """Densité prix/loyer précalculée et nuage WebGL échantillonné
+
+        La densité couvre le cœur de la distribution (0,5 % - 99,5 %), les communes
+        hors de cet intervalle étant comptées dans les mailles du bord ; le nuage
+        garde en priorité les communes les plus atypiques (jusqu'à la moitié des
+        points), le reste est un tirage aléatoire reproductible des autres.
+        """
+        x = data['prix_m2_moyen'].to_numpy(dtype='float64', na_value=np.nan)
+        y = data['loypredm2'].to_numpy(dtype='float64', na_value=np.nan)
+        valides = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+        x, y = x[valides], y[valides]
+        if not len(valides):
+            return
+        
+        # Étendue non nulle même si toutes les valeurs sont égales
+        etendues = [np.percentile(v, [0.5, 99.5]) + [0, 0 if np.ptp(v) else 1] for v in (x, y)]
+        densite, bornes_x, bornes_y = np.histogram2d(
+            x.clip(*etendues[0]), y.clip(*etendues[1]), bins=NB_MAILLES_DENSITE, range=etendues
+        )
+        fig.add_trace(
+            go.Heatmap(
+                x=(bornes_x[:-1] + bornes_x[1:]) / 2,
+                y=(bornes_y[:-1] + bornes_y[1:]) / 2,
+                z=np.where(densite > 0, densite, np.nan).T,
+                colorscale='Blues',
+                showscale=False,
+                name='Densité',
+                hovertemplate='Prix: %{x:.0f}€/m²<br>Loyer: %{y:.1f}€/m²<br>Communes: %{z}<extra></extra>'
+            ),
+            row=1, col=2
+        )
+        
+        # Score d'atypicité : plus grand écart robuste (en IQR) sur les deux axes
+        scores = np.zeros(len(x))
+        for valeurs in (x, y):
+            q1, mediane, q3 = np.percentile(valeurs, [25, 50, 75])
+            scores = np.maximum(scores, np.abs(valeurs - mediane) / ((q3 - q1) or 1))
+        atypiques = np.flatnonzero(scores > SCORE_POINT_ATYPIQUE)
+        if len(atypiques) > POINTS_NUAGE_MAX // 2:
+            atypiques = atypiques[np.argpartition(-scores[atypiques], POINTS_NUAGE_MAX // 2)[:POINTS_NUAGE_MAX // 2]]
+        autres = np.setdiff1d(np.arange(len(x)), atypiques, assume_unique=True)
+        nb_tires = min(POINTS_NUAGE_MAX - len(atypiques), len(autres))
+        tires = np.random.default_rng(0).choice(autres, nb_tires, replace=False)
+        points = np.sort(np.concatenate([atypiques, tires]))
+        
+        fig.add_trace(
+            go.Scattergl(
+                x=x[points],
+                y=y[points],
+                mode='markers',
+                text=data['Commune'].to_numpy()[valides[points]],
+                name='Communes',
+                marker=dict(size=5, opacity=0.6, color='darkorange')
+            ),
+            row=1, col=2
+        )
+    
+    def etapes_pipeline(self, fichier_dvf, fichier_loyers, taille_bloc=None):
+        """Étapes du traitement complet : (libellé, fonction retournant False en cas d'échec)"""
+        return [
+            ('📁 Chargement des fichiers DVF et loyers...',
+             lambda: self.charger_donnees(fichier_dvf, fichier_loyers, taille_bloc)),
+            ('🧹 Nettoyage des données DVF...', self.nettoyer_donnees_dvf),
+            ('🏘️ Agrégation des ventes par commune...', self.agreger_ventes_communes),
+            ('🧹 Nettoyage des données loyers...', self.nettoyer_donnees_loyers),
+            ('🔗 Fusion des données...', self.fusionner_donnees),
+            *([('📍 Prix des communes voisines...', self.emprunter_prix_voisins)] if self.fichier_centroides else []),
+            ('📊 Calcul des rentabilités...', self.calculer_rentabilite),
+            ('📉 Tendances des prix et loyers...', self.calculer_tendances),
+            ('🎯 Rendements des ventes par commune...', self.calculer_rendements_ventes)
+        ]
+    
+    def traitement_complet_avec_progress(self, fichier_dvf, fichier_loyers, taille_bloc=None):
+        """Traitement complet avec barre de progression alimentée par les mesures d'étapes"""
+        etapes = self.etapes_pipeline(fichier_dvf, fichier_loyers, taille_bloc)
         
         # Créer les éléments de progression
         progress_container = st.container()
@@ -356,143 +3312,391 @@ class AnalyseurRentabiliteImmobiliere:
             
             # Métriques en temps réel
             col1, col2, col3 = st.columns(3)
+            metrique_etape = col1.empty()
+            metrique_progression = col2.empty()
+            metrique_statut = col3.empty()
+            metrique_statut.metric("Statut", "En cours")
+            
+            # Progression = étapes terminées + avancement réel de l'étape en cours
+            etat = {'index': 0}
             
+            def suivre(evenement, mesure):
+                if mesure['niveau'] != 0:
+                    return
+                avancement = (etat['index'] + mesure['progression']) / len(etapes)
+                progress_bar.progress(min(int(avancement * 100), 100))
+                metrique_progression.metric("Progression", f"{avancement:.0%}")
+                if evenement == 'fin':
+                    lignes = f"{mesure['lignes_sortie']:,} lignes, " if mesure['lignes_sortie'] is not None else ""
+                    icone = '✅' if mesure['succes'] else '❌'
+                    st.write(f"{icone} {mesure['etape']}: {lignes}{mesure['temps_s']:.2f}s "
+                             f"(CPU {mesure['cpu_s']:.2f}s, mémoire {mesure['memoire_delta_mo']:+.0f} Mo)")
+            
+            self.mesures.ajouter_ecouteur(suivre)
             try:
-                # Étape 1 : Chargement DVF (0-20%)
-                status_text.text('📁 Chargement du fichier DVF...')
-                with col1:
-                    st.metric("Étape", "1/6")
-                with col2:
-                    st.metric("Progression", "0%")
-                with col3:
-                    st.metric("Statut", "En cours")
-                
-                self.data_dvf = pd.read_csv(fichier_dvf, sep=';', encoding='latin-1')
-                progress_bar.progress(20)
-                st.write(f"✅ DVF chargé: {len(self.data_dvf):,} lignes")
-                
-                # Étape 2 : Chargement loyers (20-35%)
-                status_text.text('📁 Chargement du fichier loyers...')
-                with col1:
-                    st.metric("Étape", "2/6")
-                with col2:
-                    st.metric("Progression", "20%")
-                
-                self.data_loyers = pd.read_csv(fichier_loyers, sep=';', encoding='latin-1')
-                progress_bar.progress(35)
-                st.write(f"✅ Loyers chargé: {len(self.data_loyers):,} lignes")
-                
-                # Étape 3 : Nettoyage DVF (35-55%)
-                status_text.text('🧹 Nettoyage des données DVF...')
-                with col1:
-                    st.metric("Étape", "3/6")
-                with col2:
-                    st.metric("Progression", "35%")
-                
-                self.nettoyer_donnees_dvf()
-                progress_bar.progress(55)
-                st.write(f"✅ DVF nettoyé: {len(self.data_dvf):,} appartements valides")
-                
-                # Étape 4 : Nettoyage loyers (55-70%)
-                status_text.text('🧹 Nettoyage des données loyers...')
-                with col1:
-                    st.metric("Étape", "4/6")
-                with col2:
-                    st.metric("Progression", "55%")
-                
-                self.nettoyer_donnees_loyers()
-                progress_bar.progress(70)
-                st.write(f"✅ Loyers nettoyé: {len(self.data_loyers):,} observations valides")
-                
-                # Étape 5 : Fusion (70-85%)
-                status_text.text('🔗 Fusion des données...')
-                with col1:
-                    st.metric("Étape", "5/6")
-                with col2:
-                    st.metric("Progression", "70%")
-                
-                self.fusionner_donnees()
-                progress_bar.progress(85)
-                st.write(f"✅ Données fusionnées: {len(self.data_merged):,} communes")
-                
-                # Étape 6 : Calculs (85-100%)
-                status_text.text('📊 Calcul des rentabilités...')
-                with col1:
-                    st.metric("Étape", "6/6")
-                with col2:
-                    st.metric("Progression", "85%")
-                
-                self.calculer_rentabilite()
-                progress_bar.progress(100)
+                for index, (libelle, etape) in enumerate(etapes):
+                    etat['index'] = index
+                    status_text.text(libelle)
+                    metrique_etape.metric("Étape", f"{index + 1}/{len(etapes)}")
+                    if etape() is False:
+                        raise RuntimeError(f"échec de l'étape « {libelle.strip('.')} »")
                 
                 # Status final
                 status_text.text('✅ Analyse terminée avec succès!')
-                with col2:
-                    st.metric("Progression", "100%")
-                with col3:
-                    st.metric("Statut", "Terminé")
-                
-                time.sleep(1)  # Laisser voir le 100%
+                metrique_statut.metric("Statut", "Terminé")
                 
                 # Nettoyage des éléments de progression
                 progress_bar.empty()
                 status_text.empty()
                 
+                # Détail des mesures : où le temps est réellement passé
+                with st.expander("⏱️ Mesures par étape"):
+                    st.dataframe(self.mesures.tableau(), use_container_width=True)
+                
                 return True
                 
             except Exception as e:
                 status_text.text(f'❌ Erreur: {str(e)}')
-                with col3:
-                    st.metric("Statut", "Erreur")
+                metrique_statut.metric("Statut", "Erreur")
                 st.error(f"Erreur lors du traitement: {e}")
                 return False
+            finally:
+                self.mesures.retirer_ecouteur(suivre)
 
     
+    @etape_mesuree('generer_rapport', entree='data_merged')
     def generer_rapport(self):
-        """Génère un rapport de synthèse"""
+        """Génère un rapport de synthèse (voir rapport_texte)"""
         if self.data_merged is None:
             return "Aucune donnée disponible"
         
-        stats = self.data_merged.describe()
-        
-        rapport = f"""
-    RAPPORT D'ANALYSE DE RENTABILITÉ IMMOBILIÈRE
-    ===========================================
+        # Loyer moyen de toutes les observations de loyers quand elles sont chargées
+        loyer_moyen = self.data_loyers['loypredm2'].mean() if self.data_loyers is not None else None
+        return rapport_texte(self.data_merged, loyer_moyen=loyer_moyen)
+
+# Ingestion parallèle
+class TrancheFichier(io.RawIOBase):
+    """Lecture binaire limitée à l'intervalle d'octets [debut, fin) d'un fichier"""
+    
+    def __init__(self, chemin, debut, fin):
+        self.fichier = open(chemin, 'rb')
+        self.fichier.seek(debut)
+        self.restant = fin - debut
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, tampon):
+        n = self.fichier.readinto(memoryview(tampon)[:min(len(tampon), self.restant)])
+        self.restant -= n
+        return n
+    
+    def close(self):
+        self.fichier.close()
+        super().close()
 
-    📊 STATISTIQUES GÉNÉRALES
-    - Nombre de communes analysées: {len(self.data_merged)}
-    - Prix moyen d'achat: {self.data_merged['prix_m2_moyen'].mean():.0f}€/m²
-    - Loyer moyen: {self.data_loyers['loypredm2'].mean():.2f}€/m²/mois
-    - Rentabilité brute moyenne: {self.data_merged['rentabilite_brute'].mean():.2f}%
 
-    🏆 MEILLEURES OPPORTUNITÉS (Top 5)
+def decouper_fichier(chemin, nb_tranches):
+    """Découpe un CSV en tranches d'octets alignées sur les fins de ligne
+
+    Retourne les noms de colonnes (en-tête) et la liste des (debut, fin).
     """
-        
-        top_5 = self.data_merged.nlargest(5, 'rentabilite_brute')
-        for i, (_, row) in enumerate(top_5.iterrows(), 1):
-            # Convertir le département en entier si c'est une string
-            dept = str(row['departement']).zfill(2) if isinstance(row['departement'], (int, float, str)) else row['departement']
-            
-            rapport += f"""
-    {i}. {row['Commune']} ({dept})
-    💰 Prix: {row['prix_m2_moyen']:.0f}€/m² | Loyer: {row['loypredm2']:.1f}€/m²
-    📈 Rentabilité: {row['rentabilite_brute']:.2f}% | Attractivité: {row['attractivite']}
+    taille = os.path.getsize(chemin)
+    with open(chemin, 'rb') as f:
+        entete = f.readline()
+        noms_colonnes = entete.decode('latin-1').rstrip('\r\n').split(detecter_format_dvf(entete)['sep'])
+        bornes = [f.tell()]
+        for i in range(1, nb_tranches):
+            f.seek(max(taille * i // nb_tranches, bornes[-1]))
+            f.readline()
+            bornes.append(min(f.tell(), taille))
+        bornes.append(taille)
+    
+    tranches = [(debut, fin) for debut, fin in zip(bornes[:-1], bornes[1:]) if fin > debut]
+    return noms_colonnes, tranches
+
+
+def _repartir_partition(partition, taille_bloc, dossier, nb_groupes, numero):
+    """Lit et nettoie une partition DVF, puis écrit ses ventes en nb_groupes fichiers par commune
+
+    Groupe d'une vente : code INSEE modulo nb_groupes, les ventes d'une commune
+    restent donc ensemble. Retourne le nombre de ventes de chaque groupe.
     """
-        
-        rapport += f"""
-    📊 RÉPARTITION PAR ATTRACTIVITÉ
-    {self.data_merged['attractivite'].value_counts().to_string()}
+    analyseur = AnalyseurRentabiliteImmobiliere()
+    if isinstance(partition, tuple):
+        chemin, noms_colonnes, debut, fin = partition
+        with io.BufferedReader(TrancheFichier(chemin, debut, fin)) as tranche:
+            dvf = analyseur.charger_dvf_par_blocs(tranche, taille_bloc, noms_colonnes)
+    else:
+        dvf = analyseur.charger_dvf_par_blocs(partition, taille_bloc)
+    
+    dvf = dvf[[col for col in COLONNES_AGREGATION if col in dvf.columns]]
+    groupes = encoder_insee(dvf['insee_code']) % nb_groupes
+    for groupe in range(nb_groupes):
+        dvf[groupes == groupe].to_parquet(os.path.join(dossier, f"groupe_{groupe}_{numero:05d}.parquet"), index=False)
+    return np.bincount(groupes, minlength=nb_groupes)
 
-    ⚠️ NOTES IMPORTANTES
-    - Ces calculs sont basés sur des données moyennes
-    - La rentabilité réelle dépend de nombreux facteurs (charges, vacance, travaux...)
-    - Il est recommandé de faire une étude détaillée avant tout investissement
-    - Les données de loyer sont des estimations prédictives
+
+def _agreger_groupe(chemins):
+    """Prix par commune d'un groupe, ventes réunies dans l'ordre des partitions
+
+    Toutes les ventes de chaque commune sont présentes : médianes et exclusion
+    des aberrants sont celles du calcul sur le fichier entier.
+    """
+    dvf = pd.concat([pd.read_parquet(chemin) for chemin in chemins], ignore_index=True)
+    return agreger_prix_communes(dvf)[0]
+
+
+def ingerer_dvf_en_parallele(fichiers, nb_processus=None, taille_bloc=TAILLE_BLOC_DVF):
+    """Prix moyens par commune sur plusieurs fichiers DVF, lus dans un pool de processus
+
+    Une liste de fichiers donne une partition par fichier ; un fichier unique est
+    découpé en tranches de lignes, une par processus. Chaque processus nettoie
+    sa partition et la répartit par commune en fichiers Parquet temporaires,
+    puis chacun agrège un groupe de communes : le processus principal ne reçoit
+    que les prix par commune. Le résultat est identique à
+    calculer_prix_moyens_par_commune sur la concaténation des fichiers.
+    """
+    if isinstance(fichiers, (str, os.PathLike)):
+        fichiers = [fichiers]
+    nb_processus = nb_processus or os.cpu_count() or 1
+    
+    # Une archive zip ne se découpe pas en tranches d'octets : lue d'un bloc
+    if len(fichiers) == 1 and not zipfile.is_zipfile(fichiers[0]):
+        noms_colonnes, tranches = decouper_fichier(fichiers[0], nb_processus)
+        partitions = [(fichiers[0], noms_colonnes, debut, fin) for debut, fin in tranches]
+    else:
+        partitions = list(fichiers)
+    
+    debut = time.time()
+    with tempfile.TemporaryDirectory(prefix='dvf_groupes_') as dossier, \
+            ProcessPoolExecutor(max_workers=min(nb_processus, len(partitions))) as pool:
+        nb = len(partitions)
+        effectifs = sum(pool.map(
+            _repartir_partition, partitions, [taille_bloc] * nb, [dossier] * nb, [nb_processus] * nb, range(nb)
+        ))
+        groupes = [
+            [os.path.join(dossier, f"groupe_{groupe}_{numero:05d}.parquet") for numero in range(nb)]
+            for groupe in np.flatnonzero(effectifs)
+        ]
+        resultats = list(pool.map(_agreger_groupe, groupes))
+    
+    # Réduction : groupes de communes disjoints, réunis dans l'ordre des codes INSEE
+    prix_moyens = pd.concat(resultats, ignore_index=True).sort_values('insee_code', ignore_index=True)
+    for col in ['Commune', 'code_postal', 'departement']:
+        prix_moyens[col] = pd.Categorical(prix_moyens[col])
+    
+    print(f"Ingestion parallèle: {len(partitions)} partitions, {len(prix_moyens)} communes "
+          f"en {time.time() - debut:.1f}s")
+    return prix_moyens
+
+
+def charger_analyseur(resultats=None, dvf='./data/dvf.csv', loyers='./data/loyers.csv', taille_bloc=None,
+                      dossier_cache=DOSSIER_CACHE, sql=None, types_local=('Appartement',), centroides=None):
+    """Analyseur dont data_merged est prêt : résultats exportés, base SQL ou pipeline complet
+
+    Chargement commun aux scripts api_rentabilite.py et rapports_lot.py. Le
+    pipeline complet est celui de l'interface (etapes_pipeline) : avec un
+    référentiel de centroïdes, les prix des communes à faible nombre de ventes
+    sont complétés par ceux de leurs voisines.
     """
+    analyseur = AnalyseurRentabiliteImmobiliere(fichier_centroides=centroides, dossier_cache=dossier_cache)
+    if resultats:
+        analyseur.charger_resultats(resultats)
+        return analyseur
+    if sql:
+        # Agrégation hors mémoire dans une base SQLite (pas de tendances : DVF jamais chargé)
+        if not analyseur.traitement_sql(dvf, loyers, sql, tuple(types_local), taille_bloc or TAILLE_BLOC_DVF):
+            raise SystemExit("❌ Erreur lors du traitement SQL")
+        if centroides and analyseur.emprunter_prix_voisins():
+            analyseur.calculer_rentabilite(seuils=analyseur.seuils_rentabilite)
+        return analyseur
     
-        return rapport
+    for libelle, etape in analyseur.etapes_pipeline(dvf, loyers, taille_bloc):
+        if etape() is False:
+            raise SystemExit(f"❌ Erreur à l'étape « {libelle.strip('.')} »")
+    return analyseur
+
 
 # Interface Streamlit
+def empreinte_upload(fichier):
+    """Empreinte du contenu d'un fichier téléversé, calculée une seule fois par upload"""
+    if fichier is None:
+        return None
+    id_upload = getattr(fichier, 'file_id', None)
+    if id_upload is None:
+        return empreinte_fichier(fichier)
+    
+    empreintes = st.session_state.setdefault('empreintes_upload', {})
+    if id_upload not in empreintes:
+        empreintes[id_upload] = empreinte_fichier(fichier)
+    return empreintes[id_upload]
+
+
+class AnalyseAnnulee(Exception):
+    """Levée dans le thread d'un travail d'analyse dont l'annulation est demandée"""
+
+
+class TravailAnalyse:
+    """Pipeline complet exécuté dans un thread d'arrière-plan, suivi par l'interface
+
+    L'avancement est alimenté par les événements de MesuresPipeline ; une demande
+    d'annulation est vérifiée entre les étapes et à chaque événement de
+    progression, ce qui interrompt aussi une lecture par blocs en cours. Les
+    résultats partiels restent lisibles pendant l'exécution (analyseur.prix_moyens
+    dès l'agrégation des ventes, avant la fusion avec les loyers).
+    """
+    
+    def __init__(self, analyseur, etapes):
+        self.analyseur = analyseur
+        self.etapes = etapes
+        self.etat = 'en_attente'   # puis 'en_cours', 'termine', 'annule' ou 'erreur'
+        self.index = 0
+        self.libelle = ''
+        self.progression = 0.0
+        self.journal = []
+        self.erreur = None
+        self.annulation = threading.Event()
+        self.thread = threading.Thread(target=self._executer, daemon=True)
+    
+    @property
+    def termine(self):
+        return self.etat in ('termine', 'annule', 'erreur')
+    
+    def demarrer(self):
+        self.etat = 'en_cours'
+        self.thread.start()
+        return self
+    
+    def annuler(self):
+        self.annulation.set()
+    
+    def _suivre(self, evenement, mesure):
+        if self.annulation.is_set() and evenement != 'debut':
+            raise AnalyseAnnulee("analyse annulée")
+        if mesure['niveau'] != 0:
+            return
+        self.progression = min((self.index + mesure['progression']) / len(self.etapes), 1.0)
+        if evenement == 'fin':
+            lignes = f"{mesure['lignes_sortie']:,} lignes, " if mesure['lignes_sortie'] is not None else ""
+            icone = '✅' if mesure['succes'] else '❌'
+            self.journal.append(f"{icone} {mesure['etape']}: {lignes}{mesure['temps_s']:.2f}s "
+                                f"(CPU {mesure['cpu_s']:.2f}s, mémoire {mesure['memoire_delta_mo']:+.0f} Mo)")
+    
+    def _executer(self):
+        self.analyseur.mesures.ajouter_ecouteur(self._suivre)
+        try:
+            for index, (libelle, etape) in enumerate(self.etapes):
+                if self.annulation.is_set():
+                    raise AnalyseAnnulee("analyse annulée")
+                self.index, self.libelle = index, libelle
+                if etape() is False:
+                    raise RuntimeError(f"échec de l'étape « {libelle.strip('.')} »")
+            self.progression = 1.0
+            self.etat = 'termine'
+        except Exception as e:
+            # Une annulation peut remonter sous forme d'échec d'étape (erreur interceptée)
+            if self.annulation.is_set():
+                self.etat = 'annule'
+            else:
+                self.erreur = str(e)
+                self.etat = 'erreur'
+        finally:
+            self.analyseur.mesures.retirer_ecouteur(self._suivre)
+
+
+# Travaux partagés entre sessions : une analyse par clé (fichiers et paramètres),
+# chacune dans son propre thread, les plus anciens travaux terminés sont oubliés
+TRAVAUX_ANALYSE = {}
+VERROU_TRAVAUX = threading.Lock()
+MAX_TRAVAUX_ANALYSE = 4
+
+
+def travail_analyse(cle, fichier_dvf, fichier_loyers, fichier_centroides=None, taille_bloc=None, relancer=False):
+    """Travail d'analyse de la clé, démarré s'il n'existe pas encore
+
+    Un travail annulé ou en erreur n'est redémarré qu'avec relancer=True. Les
+    fichiers téléversés sont copiés : le thread les lit pendant que les reruns
+    de l'interface calculent leurs empreintes.
+    """
+    with VERROU_TRAVAUX:
+        travail = TRAVAUX_ANALYSE.get(cle)
+        if travail is not None and not (relancer and travail.etat in ('annule', 'erreur')):
+            return travail
+        
+        copies = [
+            io.BytesIO(f.getvalue()) if hasattr(f, 'getvalue') else f
+            for f in (fichier_dvf, fichier_loyers, fichier_centroides)
+        ]
+        analyseur = AnalyseurRentabiliteImmobiliere(fichier_centroides=copies[2], dossier_cache=DOSSIER_CACHE)
+        travail = TravailAnalyse(analyseur, analyseur.etapes_pipeline(copies[0], copies[1], taille_bloc))
+        TRAVAUX_ANALYSE.pop(cle, None)
+        TRAVAUX_ANALYSE[cle] = travail.demarrer()
+        
+        anciens = [c for c, t in TRAVAUX_ANALYSE.items() if t.termine and c != cle]
+        for c in anciens[:max(0, len(TRAVAUX_ANALYSE) - MAX_TRAVAUX_ANALYSE)]:
+            del TRAVAUX_ANALYSE[c]
+        return travail
+
+
+@st.fragment(run_every=1.0)
+def suivre_travail(travail):
+    """Avancement, journal des étapes et résultats partiels, rafraîchis chaque seconde"""
+    if travail.termine:
+        st.rerun()
+    
+    st.write("### 📈 Progression de l'analyse")
+    st.progress(int(travail.progression * 100), text=travail.libelle)
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        st.caption(f"Étape {travail.index + 1}/{len(travail.etapes)}")
+    with col2:
+        if travail.annulation.is_set():
+            st.caption("Annulation en cours...")
+        elif st.button("⏹️ Annuler l'analyse"):
+            travail.annuler()
+    for ligne in list(travail.journal):
+        st.write(ligne)
+    
+    # Résultat partiel : prix par commune avant la fusion avec les loyers
+    prix_moyens = travail.analyseur.prix_moyens
+    if prix_moyens is not None:
+        st.subheader("🏘️ Prix de vente par commune (avant fusion avec les loyers)")
+        col1, col2 = st.columns(2)
+        col1.metric("Communes avec ventes", len(prix_moyens))
+        col2.metric("Prix médian/m²", f"{prix_moyens['prix_m2_median'].median():.0f}€")
+        st.dataframe(
+            decoder_codes_insee(prix_moyens.nlargest(20, 'nb_ventes')[
+                ['insee_code', 'Commune', 'nb_ventes', 'prix_m2_moyen', 'prix_m2_median']
+            ]),
+            use_container_width=True
+        )
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def graphiques_analyse(cle, _analyseur):
+    return _analyseur.creer_graphiques_analyse()
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def rapport_analyse(cle, _analyseur):
+    return _analyseur.generer_rapport()
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def carte_rentabilite_html(cle, nb_communes, _analyseur):
+    """HTML de la carte (None si aucune coordonnée disponible)
+
+    L'analyseur du travail est partagé entre sessions : les coordonnées sont
+    ajoutées à une copie de la table fusionnée, jamais à l'original.
+    """
+    analyseur = copy.copy(_analyseur)
+    analyseur.data_merged = _analyseur.data_merged.copy()
+    analyseur.obtenir_coordonnees_communes(nb_communes)
+    carte = analyseur.creer_carte_rentabilite()
+    return carte.get_root().render() if carte else None
+
+
 def main():
     st.set_page_config(
         page_title="Analyseur de Rentabilité Immobilière",
@@ -506,26 +3710,52 @@ def main():
     # Sidebar pour les paramètres
     st.sidebar.header("📁 Chargement des données")
     
-    fichier_dvf = st.sidebar.file_uploader("Fichier DVF (ventes)", type=['csv'])
+    fichier_dvf = st.sidebar.file_uploader(
+        "Fichier DVF (ventes)", type=['csv', 'txt', 'zip'],
+        help="Export du notebook ou fichier officiel brut (séparateur '|', archive zip acceptée)"
+    )
     fichier_loyers = st.sidebar.file_uploader("Fichier Loyers", type=['csv'])
+    fichier_centroides = st.sidebar.file_uploader(
+        "Centroïdes des communes (optionnel, code_insee/latitude/longitude)", type=['csv']
+    )
+    
+    # Lecture par blocs pour les fichiers DVF multi-années
+    lecture_par_blocs = st.sidebar.checkbox("Lecture par blocs (gros fichiers DVF)", value=False)
+    taille_bloc = TAILLE_BLOC_DVF if lecture_par_blocs else None
     
     if fichier_dvf and fichier_loyers:
-        # Initialiser l'analyseur
-        analyseur = AnalyseurRentabiliteImmobiliere()
+        # Clé de cache : contenu des fichiers et paramètres d'analyse
+        cle = (
+            empreinte_upload(fichier_dvf), empreinte_upload(fichier_loyers),
+            empreinte_upload(fichier_centroides), taille_bloc
+        )
+        
+        # Analyse en arrière-plan, partagée tant que la clé ne change pas
+        travail = travail_analyse(cle, fichier_dvf, fichier_loyers, fichier_centroides, taille_bloc)
+        if not travail.termine:
+            suivre_travail(travail)
+            return
+        if travail.etat != 'termine':
+            if travail.etat == 'annule':
+                st.warning("Analyse annulée")
+            else:
+                st.error(f"Erreur lors du traitement: {travail.erreur}")
+            if st.button("🔄 Relancer l'analyse"):
+                travail_analyse(cle, fichier_dvf, fichier_loyers, fichier_centroides, taille_bloc, relancer=True)
+                st.rerun()
+            return
         
-        # Chargement et traitement des données
-        with st.spinner("Chargement et traitement des données..."):
-            if analyseur.charger_donnees(fichier_dvf, fichier_loyers):
-                analyseur.nettoyer_donnees_dvf()
-                analyseur.nettoyer_donnees_loyers()
-                analyseur.fusionner_donnees()
-                analyseur.calculer_rentabilite()
+        analyseur = travail.analyseur
+        with st.expander("⏱️ Mesures par étape"):
+            st.dataframe(analyseur.mesures.tableau(), use_container_width=True)
         
         if analyseur.data_merged is not None:
             st.success(f"✅ Analyse terminée - {len(analyseur.data_merged)} communes analysées")
             
             # Onglets principaux
-            tab1, tab2, tab3, tab4 = st.tabs(["📊 Synthèse", "🗺️ Carte", "📈 Graphiques", "📋 Rapport"])
+            tab1, tab2, tab3, tab5, tab4 = st.tabs(
+                ["📊 Synthèse", "🗺️ Carte", "📈 Graphiques", "📉 Tendances", "📋 Rapport"]
+            )
             
             with tab1:
                 st.header("Synthèse des résultats")
@@ -540,15 +3770,80 @@ def main():
                 with col4:
                     st.metric("Rentabilité moyenne", f"{analyseur.data_merged['rentabilite_brute'].mean():.2f}%")
                 
-                st.subheader("🏆 Top 20 des meilleures communes pour investir")
-                top_communes = analyseur.analyser_top_communes(20)
-                if top_communes is not None:
+                st.subheader("🔎 Recherche des meilleures communes pour investir")
+                
+                # Filtres servis par l'index de recherche (réponse immédiate à chaque changement)
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    departements = st.multiselect(
+                        "Départements", sorted(analyseur.data_merged['departement'].astype(str).str.zfill(2).unique())
+                    )
+                    classes = st.multiselect("Attractivité", CLASSES_ATTRACTIVITE)
+                with col2:
+                    prix_m2_max = st.number_input("Prix max (€/m²)", min_value=0, value=0, step=500)
+                    budget_max = st.number_input("Budget max (€)", min_value=0, value=0, step=10000)
+                    surface_m2 = st.number_input("Surface visée (m², 0 = surface moyenne vendue)", min_value=0, value=0)
+                with col3:
+                    min_ventes = st.number_input("Nombre minimum de ventes", min_value=0, value=3)
+                    cles_tri = [c for c in IndexRechercheCommunes.CLES_TRI if c in analyseur.data_merged.columns]
+                    tri = st.selectbox("Trier par", cles_tri)
+                    croissant = st.checkbox("Ordre croissant", value=tri == 'prix_m2_moyen')
+                
+                filtres = dict(
+                    departement=departements or None,
+                    attractivite=classes or None,
+                    prix_m2_max=prix_m2_max or None,
+                    budget_max=budget_max or None,
+                    surface_m2=surface_m2 or None,
+                    min_ventes=min_ventes,
+                    tri=tri,
+                    croissant=croissant
+                )
+                _, nb_resultats = analyseur.rechercher_communes(taille_page=0, **filtres)
+                nb_pages = max(1, -(-nb_resultats // 20))
+                page = int(st.number_input(f"Page (sur {nb_pages})", min_value=1, max_value=nb_pages, value=1)) - 1
+                
+                resultats, _ = analyseur.rechercher_communes(page=page, taille_page=20, **filtres)
+                st.caption(f"{nb_resultats} communes correspondent aux critères")
+                colonnes = ['insee_code', 'Commune', 'departement', 'prix_m2_moyen', 'loypredm2',
+                            'rentabilite_brute', 'rentabilite_nette', 'attractivite', 'nb_ventes']
+                if 'prix_emprunte' in resultats.columns:
+                    colonnes.append('prix_emprunte')
+                st.dataframe(
+                    decoder_codes_insee(resultats[colonnes]).style.format({
+                        'prix_m2_moyen': '{:.0f}€',
+                        'loypredm2': '{:.1f}€',
+                        'rentabilite_brute': '{:.2f}%',
+                        'rentabilite_nette': '{:.2f}%'
+                    }),
+                    use_container_width=True
+                )
+                
+                # Distribution des rendements par vente : recalculée depuis les prix triés à chaque cible
+                if analyseur.distribution_ventes is not None:
+                    st.subheader("🎯 Communes où les bonnes affaires sont fréquentes")
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        cible = st.number_input("Rendement brut visé (%)", min_value=0.5, value=RENDEMENT_CIBLE, step=0.5)
+                    with col2:
+                        pieces = st.selectbox("Nombre de pièces", DistributionRendementsVentes.PIECES)
+                    with col3:
+                        min_ventes_segment = st.number_input("Ventes minimum du segment", min_value=1, value=5)
+                    
+                    rendements = analyseur.distribution_ventes.rendements(
+                        analyseur.data_merged['insee_code'], analyseur.data_merged['loypredm2'], cible
+                    )
+                    rendements = rendements[(rendements['pieces'] == pieces) & (rendements['nb_ventes'] >= min_ventes_segment)]
+                    rendements = rendements.merge(
+                        analyseur.data_merged[['insee_code', 'Commune', 'departement', 'rentabilite_brute']], on='insee_code'
+                    ).nlargest(20, ['part_au_dessus_cible', 'rendement_p50'])
                     st.dataframe(
-                        top_communes.style.format({
-                            'prix_m2_moyen': '{:.0f}€',
-                            'loypredm2': '{:.1f}€',
-                            'rentabilite_brute': '{:.2f}%',
-                            'rentabilite_nette': '{:.2f}%'
+                        decoder_codes_insee(rendements.drop(columns='pieces')).style.format({
+                            'rendement_p10': '{:.2f}%',
+                            'rendement_p50': '{:.2f}%',
+                            'rendement_p90': '{:.2f}%',
+                            'part_au_dessus_cible': '{:.0%}',
+                            'rentabilite_brute': '{:.2f}%'
                         }),
                         use_container_width=True
                     )
@@ -557,30 +3852,113 @@ def main():
                 st.header("🗺️ Carte de rentabilité")
                 
                 # Option pour géocoder
+                # Sans référentiel local, géocodage réseau d'un échantillon (avec cache)
+                nb_communes_carte = None
+                if fichier_centroides is None:
+                    nb_communes_carte = int(st.number_input(
+                        "Nombre de communes à géocoder", min_value=1,
+                        max_value=len(analyseur.data_merged), value=min(50, len(analyseur.data_merged))
+                    ))
                 if st.button("🌍 Générer la carte (géocodage des communes)"):
+                    st.session_state['carte_demandee'] = True
+                
+                # La carte reste affichée aux reruns suivants, servie depuis le cache
+                if st.session_state.get('carte_demandee'):
                     with st.spinner("Géocodage en cours... (peut prendre quelques minutes)"):
-                        analyseur.obtenir_coordonnees_communes(50)  # Limité à 50 pour éviter timeout
-                        carte = analyseur.creer_carte_rentabilite()
-                        
-                        if carte:
-                            st.success("Carte générée avec succès!")
-                            # Note: Dans Streamlit, vous devriez utiliser folium_static pour afficher la carte
-                            # st.components.v1.html(carte._repr_html_(), height=600)
-                            st.info("Carte générée - utilisez folium_static pour l'affichage dans Streamlit")
+                        carte_html = carte_rentabilite_html(cle, nb_communes_carte, analyseur)
+                    
+                    if carte_html:
+                        st.success("Carte générée avec succès!")
+                        st.components.v1.html(carte_html, height=600)
+                    else:
+                        # Échec (réseau, coordonnées absentes) : ne pas le garder en cache
+                        carte_rentabilite_html.clear()
+                        st.session_state['carte_demandee'] = False
+                        st.error("Impossible de générer la carte")
+                
+                # Requête de voisinage servie par l'index spatial (coordonnées requises)
+                if 'latitude' in analyseur.data_merged.columns:
+                    st.subheader("📍 Communes autour d'une commune")
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        code_reference = st.text_input("Code INSEE de la commune de référence")
+                    with col2:
+                        rayon_km = st.slider("Rayon (km)", min_value=1, max_value=100, value=RAYON_EMPRUNT_KM)
+                    if code_reference:
+                        reference = analyseur.data_merged[
+                            analyseur.data_merged['insee_code'] == encoder_insee([code_reference.strip()])[0]
+                        ].dropna(subset=['latitude'])
+                        if reference.empty:
+                            st.warning("Commune inconnue ou sans coordonnées")
                         else:
-                            st.error("Impossible de générer la carte")
+                            proches = analyseur.communes_dans_rayon(
+                                reference['latitude'].iloc[0], reference['longitude'].iloc[0], rayon_km
+                            )
+                            st.caption(f"{len(proches)} communes à moins de {rayon_km} km")
+                            st.dataframe(
+                                decoder_codes_insee(proches[
+                                    ['insee_code', 'Commune', 'distance_km', 'prix_m2_moyen', 'loypredm2',
+                                     'rentabilite_brute', 'attractivite', 'nb_ventes']
+                                ]).style.format({
+                                    'distance_km': '{:.1f} km',
+                                    'prix_m2_moyen': '{:.0f}€',
+                                    'loypredm2': '{:.1f}€',
+                                    'rentabilite_brute': '{:.2f}%'
+                                }),
+                                use_container_width=True
+                            )
             
             with tab3:
                 st.header("📈 Analyses graphiques")
                 
-                fig = analyseur.creer_graphiques_analyse()
+                fig = graphiques_analyse(cle, analyseur)
                 if fig:
                     st.plotly_chart(fig, use_container_width=True)
             
+            with tab5:
+                st.header("📉 Tendances des prix et loyers")
+                
+                if 'rentabilite_ajustee' not in analyseur.data_merged.columns:
+                    st.info("Tendances indisponibles : le fichier DVF ne contient pas de dates de mutation")
+                else:
+                    data = analyseur.data_merged
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.metric("Croissance annuelle médiane des prix", f"{data['croissance_prix_annuelle'].median():+.1f}%")
+                    with col2:
+                        st.metric("Croissance annuelle médiane des loyers", f"{data['croissance_loyer_annuelle'].median():+.1f}%")
+                    
+                    st.subheader("🏆 Top 20 - rentabilité ajustée de la tendance des prix")
+                    top_ajustees = decoder_codes_insee(data[data['nb_ventes'] >= 3].nlargest(20, 'rentabilite_ajustee')[
+                        ['insee_code', 'Commune', 'departement', 'rentabilite_brute',
+                         'croissance_prix_annuelle', 'croissance_loyer_annuelle', 'rentabilite_ajustee']
+                    ])
+                    st.dataframe(
+                        top_ajustees.style.format({
+                            'rentabilite_brute': '{:.2f}%',
+                            'croissance_prix_annuelle': '{:+.1f}%',
+                            'croissance_loyer_annuelle': '{:+.1f}%',
+                            'rentabilite_ajustee': '{:.2f}%'
+                        }),
+                        use_container_width=True
+                    )
+                    
+                    # Séries d'une commune : simples lectures du cube précalculé
+                    if len(top_ajustees):
+                        choix = st.selectbox(
+                            "Évolution des prix d'une commune",
+                            top_ajustees['insee_code'] + ' - ' + top_ajustees['Commune'].astype(str)
+                        )
+                        commune = [choix.split(' - ')[0]]
+                        st.line_chart(pd.DataFrame({
+                            'Médiane trimestrielle': analyseur.cube_prix.mediane_trimestrielle(communes=commune).iloc[0],
+                            'Médiane glissante (4 trimestres)': analyseur.cube_prix.mediane_glissante(4, communes=commune).iloc[0]
+                        }))
+            
             with tab4:
                 st.header("📋 Rapport détaillé")
                 
-                rapport = analyseur.generer_rapport()
+                rapport = rapport_analyse(cle, analyseur)
                 st.text(rapport)
                 
                 # Bouton de téléchargement du rapport
@@ -593,7 +3971,10 @@ def main():
 
 if __name__ == "__main__":
     # Pour utilisation en ligne de commande
-    analyseur = AnalyseurRentabiliteImmobiliere()
+    analyseur = AnalyseurRentabiliteImmobiliere(
+        fichier_centroides=FICHIER_CENTROIDES if os.path.exists(FICHIER_CENTROIDES) else None,
+        dossier_cache=DOSSIER_CACHE
+    )
     
     # Chargement des données
     if analyseur.charger_donnees('./data/dvf.csv', './data/loyers.csv'):
@@ -605,7 +3986,11 @@ if __name__ == "__main__":
         
         # Fusion et calculs
         if analyseur.fusionner_donnees():
+            if analyseur.fichier_centroides:
+                analyseur.emprunter_prix_voisins()
             analyseur.calculer_rentabilite()
+            analyseur.calculer_tendances()
+            analyseur.calculer_rendements_ventes()
             
             # Analyses
             print("\n📊 ANALYSE TERMINÉE")
@@ -617,14 +4002,23 @@ if __name__ == "__main__":
             print(top_communes.to_string(index=False))
             
             # Sauvegarde des résultats
-            analyseur.data_merged.to_csv('resultats_rentabilite.csv', index=False, sep=';')
+            decoder_codes_insee(analyseur.data_merged).to_csv('resultats_rentabilite.csv', index=False, sep=';')
             print("\n💾 Résultats sauvegardés dans 'resultats_rentabilite.csv'")
+            if analyseur.rendements_ventes is not None:
+                decoder_codes_insee(analyseur.rendements_ventes).to_csv('rendements_ventes.csv', index=False, sep=';')
+                print("💾 Rendements des ventes sauvegardés dans 'rendements_ventes.csv'")
             
             # Rapport
             rapport = analyseur.generer_rapport()
             with open('rapport_rentabilite.txt', 'w', encoding='utf-8') as f:
                 f.write(rapport)
             print("📋 Rapport sauvegardé dans 'rapport_rentabilite.txt'")
+            
+            # Mesures par étape
+            print("\n⏱️ MESURES PAR ÉTAPE:")
+            print(analyseur.mesures.tableau().to_string(index=False))
+            analyseur.mesures.exporter_json('mesures_pipeline.json')
+            print("💾 Mesures sauvegardées dans 'mesures_pipeline.json'")
         else:
             print("❌ Erreur lors de la fusion des données")
     else:
@@ -0,0 +1,160 @@
+"""Banc d'essai du pipeline d'analyse sur données synthétiques
+
+Pour chaque taille demandée, génère (ou réutilise) un jeu DVF/loyers synthétique,
+exécute chaque étape du pipeline puis les constructeurs de carte, graphiques et
+rapport, et mesure le temps et la mémoire résidente (RSS) de chaque étape.
+Les résultats sont écrits en JSON pour comparer deux exécutions.
+
+Usage :
+    python benchmark.py --tailles 10000 100000 1000000 --sortie bench.json
+    python benchmark.py --tailles 100000 --sortie nouveau.json --comparer bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from app import AnalyseurRentabiliteImmobiliere, rss_mo
+from donnees_synthetiques import generer_jeu
+
+
+class SuiviMemoire:
+    """Échantillonne la RSS dans un thread pendant un bloc `with` et retient le pic"""
+
+    def __init__(self, intervalle=0.01):
+        self.intervalle = intervalle
+        self.debut = self.pic = self.fin = 0.0
+        self._arret = threading.Event()
+
+    def _echantillonner(self):
+        while not self._arret.wait(self.intervalle):
+            self.pic = max(self.pic, rss_mo())
+
+    def __enter__(self):
+        self.debut = self.pic = rss_mo()
+        self._thread = threading.Thread(target=self._echantillonner, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._arret.set()
+        self._thread.join()
+        self.fin = rss_mo()
+        self.pic = max(self.pic, self.fin)
+        return False
+
+
+def mesurer(etapes, nom, fonction, taille_sortie=None):
+    """Exécute une étape, ajoute sa mesure à `etapes` et retourne son résultat"""
+    with SuiviMemoire() as memoire:
+        debut = time.perf_counter()
+        resultat = fonction()
+        duree = time.perf_counter() - debut
+
+    mesure = {
+        'etape': nom,
+        'temps_s': round(duree, 4),
+        'rss_debut_mo': round(memoire.debut, 1),
+        'rss_pic_mo': round(memoire.pic, 1),
+        'rss_delta_mo': round(memoire.fin - memoire.debut, 1)
+    }
+    if taille_sortie is not None:
+        mesure['sortie'] = taille_sortie(resultat)
+    etapes.append(mesure)
+    print(f"  {nom:<28} {duree:8.3f}s  pic {memoire.pic:8.1f} Mo")
+    return resultat
+
+
+def executer_pipeline(chemins):
+    """Mesure chaque étape du pipeline et des constructeurs de rendu"""
+    etapes = []
+    analyseur = AnalyseurRentabiliteImmobiliere(fichier_centroides=chemins['centroides'])
+    nb_lignes = lambda attribut: lambda _: len(getattr(analyseur, attribut))
+
+    mesurer(etapes, 'charger_donnees', lambda: analyseur.charger_donnees(chemins['dvf'], chemins['loyers']),
+            nb_lignes('data_dvf'))
+    mesurer(etapes, 'nettoyer_donnees_dvf', analyseur.nettoyer_donnees_dvf, nb_lignes('data_dvf'))
+    mesurer(etapes, 'nettoyer_donnees_loyers', analyseur.nettoyer_donnees_loyers, nb_lignes('data_loyers'))
+    mesurer(etapes, 'fusionner_donnees', analyseur.fusionner_donnees, nb_lignes('data_merged'))
+    mesurer(etapes, 'calculer_rentabilite', analyseur.calculer_rentabilite, nb_lignes('data_merged'))
+    mesurer(etapes, 'analyser_top_communes', lambda: analyseur.analyser_top_communes(20), len)
+    mesurer(etapes, 'obtenir_coordonnees_communes', analyseur.obtenir_coordonnees_communes, nb_lignes('data_merged'))
+
+    # Constructeurs de rendu : taille de la sortie envoyée au navigateur (octets)
+    mesurer(etapes, 'creer_carte_rentabilite',
+            lambda: analyseur.creer_carte_rentabilite().get_root().render(), len)
+    mesurer(etapes, 'creer_graphiques_analyse',
+            lambda: analyseur.creer_graphiques_analyse().to_json(), len)
+    mesurer(etapes, 'generer_rapport', analyseur.generer_rapport, len)
+    return etapes, json.loads(analyseur.mesures.exporter_json())
+
+
+def comparer(resultats, reference):
+    """Affiche le rapport de temps nouveau/référence par taille et par étape"""
+    index_ref = {
+        (r['lignes'], e['etape']): e
+        for r in reference['resultats'] for e in r['etapes']
+    }
+    print(f"\n{'lignes':>10} {'étape':<28} {'réf (s)':>9} {'nouv (s)':>9} {'ratio':>7}")
+    for r in resultats['resultats']:
+        for e in r['etapes']:
+            ref = index_ref.get((r['lignes'], e['etape']))
+            if ref is None:
+                continue
+            ratio = e['temps_s'] / ref['temps_s'] if ref['temps_s'] else float('nan')
+            print(f"{r['lignes']:>10} {e['etape']:<28} {ref['temps_s']:>9.3f} {e['temps_s']:>9.3f} {ratio:>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Banc d'essai du pipeline de rentabilité")
+    parser.add_argument('--tailles', type=int, nargs='+', default=[10_000, 100_000],
+                        help="nombres de mutations DVF à tester")
+    parser.add_argument('--communes', type=int, default=35000)
+    parser.add_argument('--dossier-donnees', default='./data_synthetique',
+                        help="dossier des jeux générés (réutilisés s'ils existent)")
+    parser.add_argument('--sortie', default='resultats_benchmark.json')
+    parser.add_argument('--comparer', help="fichier JSON de référence à comparer")
+    args = parser.parse_args()
+
+    resultats = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'machine': {
+            'plateforme': platform.platform(),
+            'processeur': platform.processor(),
+            'nb_coeurs': os.cpu_count()
+        },
+        'versions': {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__},
+        'resultats': []
+    }
+
+    for taille in args.tailles:
+        dossier = os.path.join(args.dossier_donnees, f"lignes_{taille}")
+        if not os.path.exists(os.path.join(dossier, 'dvf.csv')):
+            print(f"Génération du jeu synthétique: {taille:,} lignes")
+            generer_jeu(dossier, taille, args.communes)
+        chemins = {nom: os.path.join(dossier, f"{nom}.csv") for nom in ('dvf', 'loyers', 'centroides')}
+
+        print(f"\n⏱️ Pipeline sur {taille:,} lignes")
+        debut = time.perf_counter()
+        etapes, mesures_pipeline = executer_pipeline(chemins)
+        resultats['resultats'].append({
+            'lignes': taille,
+            'temps_total_s': round(time.perf_counter() - debut, 4),
+            'etapes': etapes,
+            # Détail interne : CPU, lignes exclues par filtre, étapes imbriquées
+            'mesures_pipeline': mesures_pipeline
+        })
+
+    with open(args.sortie, 'w', encoding='utf-8') as f:
+        json.dump(resultats, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Résultats sauvegardés dans '{args.sortie}'")
+
+    if args.comparer:
+        with open(args.comparer, encoding='utf-8') as f:
+            comparer(resultats, json.load(f))
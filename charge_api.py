@@ -0,0 +1,115 @@
+"""Test de charge de l'API locale (api_rentabilite.py)
+
+Plusieurs clients en parallèle, chacun sur une connexion HTTP persistante,
+envoient pendant une durée fixe un mélange de requêtes (fiche commune, top-k,
+scénario). --variete borne le nombre de requêtes distinctes, donc la part
+servie par le cache LRU. Affiche le débit, les latences (p50/p95/p99) et les
+statistiques du cache du service.
+
+Usage :
+    python api_rentabilite.py --resultats resultats_rentabilite.csv &
+    python charge_api.py --url http://127.0.0.1:8000 --clients 16 --duree 10
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+TRIS = ['rentabilite_brute', 'rentabilite_nette', 'prix_m2_moyen', 'nb_ventes']
+TAUX = [0.025, 0.03, 0.035, 0.04, 0.045]
+DUREES = [15, 20, 25]
+
+
+def generer_requetes(codes, departements, variete, graine=0):
+    """Liste de chemins de requêtes : un tiers de chaque type, variete au plus"""
+    rng = random.Random(graine)
+    requetes = []
+    for i in range(variete):
+        genre = i % 3
+        if genre == 0:
+            requetes.append(f"/communes/{rng.choice(codes)}")
+        elif genre == 1:
+            requetes.append('/top?' + urlencode({
+                'k': rng.choice([10, 20, 50]), 'tri': rng.choice(TRIS),
+                'departement': rng.choice(departements), 'min_ventes': rng.choice([1, 3, 5])
+            }))
+        else:
+            requetes.append('/scenario?' + urlencode({
+                'taux_credit': rng.choice(TAUX), 'duree_credit_ans': rng.choice(DUREES),
+                'apport': rng.choice([0, 0.1, 0.2]), 'communes': ','.join(rng.sample(codes, 5))
+            }))
+    return requetes
+
+
+def lire_json(connexion, chemin):
+    connexion.request('GET', chemin)
+    reponse = connexion.getresponse()
+    return reponse.status, json.loads(reponse.read())
+
+
+def client(hote, port, requetes, fin, latences, erreurs, graine):
+    """Envoie des requêtes tirées au hasard jusqu'à l'instant fin"""
+    rng = random.Random(graine)
+    connexion = http.client.HTTPConnection(hote, port, timeout=30)
+    mesures = []
+    while time.perf_counter() < fin:
+        debut = time.perf_counter()
+        try:
+            connexion.request('GET', rng.choice(requetes))
+            reponse = connexion.getresponse()
+            reponse.read()
+            if reponse.status >= 500:
+                erreurs.append(reponse.status)
+        except (OSError, http.client.HTTPException) as e:
+            erreurs.append(str(e))
+            connexion.close()
+            connexion = http.client.HTTPConnection(hote, port, timeout=30)
+            continue
+        mesures.append(time.perf_counter() - debut)
+    connexion.close()
+    latences.extend(mesures)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test de charge de l'API de rentabilité")
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--clients', type=int, default=16, help="connexions simultanées")
+    parser.add_argument('--duree', type=float, default=10, help="durée du test (s)")
+    parser.add_argument('--variete', type=int, default=300, help="nombre de requêtes distinctes")
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    connexion = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+    _, top = lire_json(connexion, '/top?k=500&tri=nb_ventes')
+    codes = [c['insee_code'] for c in top['communes']]
+    departements = sorted({str(c['departement']).zfill(2) for c in top['communes']})
+    requetes = generer_requetes(codes, departements, args.variete)
+
+    latences, erreurs = [], []
+    fin = time.perf_counter() + args.duree
+    threads = [
+        threading.Thread(target=client, args=(url.hostname, url.port or 80, requetes, fin, latences, erreurs, i))
+        for i in range(args.clients)
+    ]
+    debut = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duree = time.perf_counter() - debut
+
+    _, sante = lire_json(connexion, '/sante')
+    connexion.close()
+    latences_ms = np.array(latences) * 1000
+    print(f"⏱️ {len(latences):,} requêtes en {duree:.1f}s : {len(latences) / duree:,.0f} requêtes/s "
+          f"({args.clients} clients, {len(requetes)} requêtes distinctes)")
+    if len(latences_ms):
+        p50, p95, p99 = np.percentile(latences_ms, [50, 95, 99])
+        print(f"   latence p50 {p50:.1f} ms | p95 {p95:.1f} ms | p99 {p99:.1f} ms | max {latences_ms.max():.1f} ms")
+    print(f"   erreurs: {len(erreurs)}")
+    print(f"   cache du service: {sante['cache']}")
@@ -0,0 +1,167 @@
+"""Générateur de jeux de données DVF et loyers synthétiques
+
+Les fichiers reprennent le format des exports de test.ipynb : séparateur ';',
+encodage latin-1, colonne d'index en tête, virgule décimale pour la valeur
+foncière, la surface et les loyers, codes INSEE réels (Corse 2A/2B, DOM).
+Le DVF est écrit par blocs, ce qui permet d'aller jusqu'à plusieurs dizaines
+de millions de lignes à mémoire constante.
+
+Usage : python donnees_synthetiques.py --lignes 1000000 --sortie ./data_synthetique
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+DEPARTEMENTS = (
+    [f"{d:02d}" for d in range(1, 96) if d != 20] + ['2A', '2B'] + ['971', '972', '973', '974', '976']
+)
+TYPES_LOCAL = ['Appartement', 'Maison', 'Dépendance', 'Local industriel. commercial ou assimilé']
+PROBAS_TYPES = [0.55, 0.30, 0.10, 0.05]
+PREFIXES_NOMS = ['Saint-', 'Sainte-', 'Le ', 'La ', 'Les ', '', '', '']
+RACINES_NOMS = ['Étienne', 'Mérignac', 'Bourg', 'Château', 'Fontaine', 'Montagne', 'Rivière', 'Forêt', 'Île', 'Pré']
+ANNEES = [2022, 2023, 2024]
+TAILLE_BLOC = 1_000_000
+
+
+def generer_communes(nb_communes=35000, graine=0):
+    """Référentiel de communes : code INSEE, nom, département, code postal, centroïde et niveau de prix"""
+    rng = np.random.default_rng(graine)
+    departements = rng.choice(DEPARTEMENTS, nb_communes)
+    communes = pd.DataFrame({'departement': departements})
+    communes['numero'] = communes.groupby('departement').cumcount() + 1
+
+    # DOM : code département à 3 chiffres, numéro de commune sur 2 chiffres
+    dom = communes['departement'].str.len() == 3
+    communes = communes[(dom & (communes['numero'] < 100)) | (~dom & (communes['numero'] < 1000))]
+    communes = communes.reset_index(drop=True)
+    dom = communes['departement'].str.len() == 3
+
+    communes['insee_code'] = np.where(
+        dom,
+        communes['departement'] + communes['numero'].astype(str).str.zfill(2),
+        communes['departement'] + communes['numero'].astype(str).str.zfill(3)
+    )
+    # Code commune DVF : les 3 derniers caractères du code INSEE
+    communes['code_commune'] = communes['insee_code'].str[-3:].astype(int)
+
+    n = len(communes)
+    communes['nom'] = (
+        rng.choice(PREFIXES_NOMS, n) + rng.choice(RACINES_NOMS, n) + ' ' + communes['insee_code']
+    ).str.upper()
+    numero_dep = pd.to_numeric(communes['departement'].str[:2].str.replace('2A', '20').str.replace('2B', '20'))
+    communes['code_postal'] = (numero_dep * 1000 + rng.integers(0, 999, n)).astype(float)
+    communes['latitude'] = rng.uniform(41.3, 51.1, n).round(5)
+    communes['longitude'] = rng.uniform(-5.1, 9.6, n).round(5)
+
+    # Prix au m² log-normal, quelques communes très chères, loyers corrélés au prix
+    communes['prix_m2'] = np.exp(rng.normal(7.8, 0.5, n))
+    communes['loyer_m2'] = (communes['prix_m2'] ** 0.6 * rng.uniform(0.07, 0.13, n)).clip(4, 45)
+    # Poids de tirage : quelques grandes villes concentrent les ventes
+    communes['poids'] = rng.pareto(1.2, n) + 0.05
+    return communes
+
+
+def ecrire_dvf(communes, chemin, nb_lignes, graine=0, taille_bloc=TAILLE_BLOC):
+    """Écrit nb_lignes de mutations DVF au format de l'export du notebook"""
+    rng = np.random.default_rng(graine + 1)
+    probas = (communes['poids'] / communes['poids'].sum()).to_numpy()
+    ecrites = 0
+
+    while ecrites < nb_lignes:
+        n = min(taille_bloc, nb_lignes - ecrites)
+        idx = rng.choice(len(communes), n, p=probas)
+        c = communes.iloc[idx]
+
+        surface = rng.gamma(4.0, 11.0, n).round(2)
+        valeur = (surface * c['prix_m2'].to_numpy() * rng.lognormal(0, 0.25, n)).round(2)
+        # Quelques aberrations : surfaces nulles et valeurs symboliques
+        surface[rng.random(n) < 0.02] = 0
+        valeur[rng.random(n) < 0.01] = 1
+
+        annees = rng.choice(ANNEES, n)
+        mois = rng.integers(1, 13, n)
+        jours = rng.integers(1, 29, n)
+
+        bloc = pd.DataFrame({
+            'Date mutation': pd.Series(jours).astype(str).str.zfill(2) + '/' +
+                             pd.Series(mois).astype(str).str.zfill(2) + '/' + pd.Series(annees).astype(str),
+            'Nature mutation': 'Vente',
+            'Type local': rng.choice(TYPES_LOCAL, n, p=PROBAS_TYPES),
+            'Nombre pieces principales': rng.integers(1, 3, n).astype(float).astype(str),
+            'Valeur fonciere': valeur,
+            'Code postal': c['code_postal'].to_numpy().astype(str),
+            'Commune': c['nom'].to_numpy(),
+            'Code departement': c['departement'].to_numpy(),
+            'Code commune': c['code_commune'].to_numpy(),
+            '1er lot': rng.integers(1, 300, n).astype(str),
+            'Surface Carrez du 1er lot': surface,
+            'annee': annees
+        }, index=pd.RangeIndex(ecrites, ecrites + n))
+
+        bloc.to_csv(
+            chemin, sep=';', encoding='latin-1', decimal=',',
+            mode='w' if ecrites == 0 else 'a', header=ecrites == 0
+        )
+        ecrites += n
+    return ecrites
+
+
+def ecrire_loyers(communes, chemin, graine=0):
+    """Écrit les loyers prédits par commune pour chaque année, comme la concaténation du notebook"""
+    rng = np.random.default_rng(graine + 2)
+    annees = []
+    for annee in sorted(ANNEES, reverse=True):
+        n = len(communes)
+        loyer = communes['loyer_m2'].to_numpy() * rng.lognormal(0, 0.03, n) * (1 + 0.02 * (annee - 2022))
+        annees.append(pd.DataFrame({
+            'id_zone': np.arange(1, n + 1),
+            'INSEE_C': communes['insee_code'].to_numpy(),
+            'LIBGEO': communes['nom'].str.title().to_numpy(),
+            'EPCI': rng.integers(200000000, 249999999, n).astype(str),
+            'DEP': communes['departement'].to_numpy(),
+            'REG': rng.integers(11, 95, n),
+            'loypredm2': loyer.round(2),
+            'lwr.IPm2': (loyer * 0.8).round(2),
+            'upr.IPm2': (loyer * 1.2).round(2),
+            'TYPPRED': rng.choice(['commune', 'maille'], n),
+            'nbobs_com': rng.integers(0, 500, n),
+            'nbobs_mail': rng.integers(50, 3000, n),
+            'R2_adj': rng.uniform(0.5, 0.9, n).round(3),
+            'annee': annee
+        }))
+    loyers = pd.concat(annees, ignore_index=True)
+    loyers.to_csv(chemin, sep=';', encoding='latin-1', decimal=',')
+    return len(loyers)
+
+
+def generer_jeu(dossier, nb_lignes, nb_communes=35000, graine=0):
+    """Génère dvf.csv, loyers.csv et centroides.csv dans un dossier, retourne leurs chemins"""
+    os.makedirs(dossier, exist_ok=True)
+    communes = generer_communes(nb_communes, graine)
+    chemins = {
+        'dvf': os.path.join(dossier, 'dvf.csv'),
+        'loyers': os.path.join(dossier, 'loyers.csv'),
+        'centroides': os.path.join(dossier, 'centroides.csv')
+    }
+    ecrire_dvf(communes, chemins['dvf'], nb_lignes, graine)
+    ecrire_loyers(communes, chemins['loyers'], graine)
+    communes[['insee_code', 'latitude', 'longitude']].rename(
+        columns={'insee_code': 'code_insee'}
+    ).to_csv(chemins['centroides'], index=False)
+    return chemins
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Génère des fichiers DVF et loyers synthétiques")
+    parser.add_argument('--lignes', type=int, default=100_000, help="nombre de mutations DVF")
+    parser.add_argument('--communes', type=int, default=35000, help="nombre de communes")
+    parser.add_argument('--sortie', default='./data_synthetique', help="dossier de sortie")
+    parser.add_argument('--graine', type=int, default=0)
+    args = parser.parse_args()
+
+    chemins = generer_jeu(args.sortie, args.lignes, args.communes, args.graine)
+    print(f"✅ {args.lignes:,} mutations DVF et {args.communes:,} communes générées dans {args.sortie}")
+    for nom, chemin in chemins.items():
+        print(f"   {nom}: {chemin}")
@@ -0,0 +1,190 @@
+"""Rapports de rentabilité par département et par jeu de paramètres, en lot
+
+Les données sont chargées et agrégées une seule fois (résultats exportés,
+pipeline pandas ou base SQL), les indicateurs de tous les scénarios sont
+calculés en une passe par MoteurScenarios, puis chaque rapport département ×
+scénario est rendu par un pool de processus. Les tables partagées sont
+transmises une fois par processus (initialiseur du pool), chaque tâche ne
+reçoit que les positions des communes de son département.
+
+Le fichier de paramètres est une liste JSON de scénarios (clés de
+PARAMETRES_SCENARIO, 'nom' facultatif) ; sans fichier, le scénario par défaut.
+
+Sorties : <sortie>/<scénario>/rapport_<département>.txt, .csv et .html
+
+Usage :
+    python rapports_lot.py --resultats resultats_rentabilite.csv --sortie rapports
+    python rapports_lot.py --dvf ./data/dvf.csv --loyers ./data/loyers.csv --parametres scenarios.json --departements 75 92 93
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from app import (
+    COLONNES_RAPPORT, INDICATEURS_SCENARIO, PARAMETRES_SCENARIO, TITRE_RAPPORT, MoteurScenarios,
+    charger_analyseur, decoder_codes_insee, rapport_html, rapport_texte
+)
+
+FORMATS_RAPPORT = ['txt', 'csv', 'html']
+
+# Tables partagées d'un processus du pool (voir _initialiser_worker)
+_PARTAGE = {}
+
+
+def lire_parametres(fichier=None):
+    """Scénarios du fichier JSON complétés par PARAMETRES_SCENARIO, avec un nom unique chacun"""
+    if fichier is None:
+        jeux = [{}]
+    else:
+        with open(fichier, encoding='utf-8') as f:
+            jeux = json.load(f)
+    scenarios = []
+    for i, jeu in enumerate(jeux):
+        jeu = dict(jeu)
+        nom = str(jeu.pop('nom', f"scenario_{i + 1}" if len(jeux) > 1 else 'defaut'))
+        # Le nom devient un dossier de la sortie : ni séparateur ni remontée
+        if not nom.strip() or nom in ('.', '..') or any(sep in nom for sep in ('/', '\\')):
+            raise ValueError(f"Nom de scénario invalide: {nom!r}")
+        inconnus = set(jeu) - set(PARAMETRES_SCENARIO)
+        if inconnus:
+            raise ValueError(f"Paramètres de scénario inconnus ({nom}): {sorted(inconnus)}")
+        scenarios.append((nom, {**PARAMETRES_SCENARIO, **jeu}))
+    if len({nom for nom, _ in scenarios}) < len(scenarios):
+        raise ValueError("Noms de scénarios en double")
+    return scenarios
+
+
+def lignes_csv(data):
+    """En-tête et lignes CSV ';' d'une table (codes INSEE en texte, infinis vides)"""
+    lignes = decoder_codes_insee(data.replace([np.inf, -np.inf], np.nan)).to_csv(index=False, sep=';').splitlines()
+    return lignes[0], np.array(lignes[1:], dtype=object)
+
+
+def preparer_lot(data, scenarios, departements=None):
+    """Précalculs partagés : indicateurs communes × scénarios, lignes CSV et positions par département
+
+    Les lignes CSV des colonnes communes sont formatées une fois, celles des
+    indicateurs une fois par scénario : le CSV d'un département n'est plus
+    qu'une concaténation de lignes.
+    """
+    data = data.reset_index(drop=True)
+    grille = pd.DataFrame([parametres for _, parametres in scenarios], columns=list(PARAMETRES_SCENARIO))
+    indicateurs = MoteurScenarios(data).evaluer(grille)
+    indicateurs = {nom: indicateurs[nom] for nom in INDICATEURS_SCENARIO}
+    csv = {'communes': lignes_csv(data), 'scenarios': [
+        lignes_csv(pd.DataFrame({nom: tableau[:, i] for nom, tableau in indicateurs.items()}))
+        for i in range(len(scenarios))
+    ]}
+    # Les processus ne reçoivent que les colonnes lues par les rapports texte et HTML
+    data = data[COLONNES_RAPPORT]
+
+    codes_dep = data['departement'].astype(str).str.zfill(2)
+    positions = {dep: pos for dep, pos in codes_dep.groupby(codes_dep, sort=True).indices.items()}
+    if departements:
+        demandes = {str(dep).zfill(2) for dep in departements}
+        absents = demandes - set(positions)
+        if absents:
+            print(f"⚠️ Départements sans commune analysée: {sorted(absents)}")
+        positions = {dep: pos for dep, pos in positions.items() if dep in demandes}
+    return data, indicateurs, csv, positions
+
+
+def _initialiser_worker(data, indicateurs, csv, scenarios, sortie, formats):
+    _PARTAGE.update(data=data, indicateurs=indicateurs, csv=csv, scenarios=scenarios, sortie=sortie, formats=formats)
+
+
+def rendre_rapport(departement, positions, index_scenario):
+    """Écrit les rapports d'un département pour un scénario, retourne (nom, département, communes, fichiers)"""
+    nom, parametres = _PARTAGE['scenarios'][index_scenario]
+    data = _PARTAGE['data'].iloc[positions].copy()
+    for indicateur, tableau in _PARTAGE['indicateurs'].items():
+        data[indicateur] = tableau[positions, index_scenario]
+
+    titre = f"{TITRE_RAPPORT} - DÉPARTEMENT {departement}"
+    dossier = os.path.join(_PARTAGE['sortie'], nom)
+    os.makedirs(dossier, exist_ok=True)
+    base = os.path.join(dossier, f"rapport_{departement}")
+    fichiers = []
+
+    if 'txt' in _PARTAGE['formats']:
+        with open(f"{base}.txt", 'w', encoding='utf-8') as f:
+            f.write(rapport_texte(data, titre, scenario=parametres))
+        fichiers.append(f"{base}.txt")
+    if 'csv' in _PARTAGE['formats']:
+        entete, lignes = _PARTAGE['csv']['communes']
+        entete_scenario, lignes_scenario = _PARTAGE['csv']['scenarios'][index_scenario]
+        with open(f"{base}.csv", 'w', encoding='utf-8') as f:
+            f.write(f"{entete};{entete_scenario}\n")
+            f.writelines(f"{ligne};{suite}\n" for ligne, suite in zip(lignes[positions], lignes_scenario[positions]))
+        fichiers.append(f"{base}.csv")
+    if 'html' in _PARTAGE['formats']:
+        with open(f"{base}.html", 'w', encoding='utf-8') as f:
+            f.write(rapport_html(data, titre, scenario=parametres))
+        fichiers.append(f"{base}.html")
+    return nom, departement, len(data), fichiers
+
+
+def generer_rapports(data, scenarios, sortie, departements=None, formats=FORMATS_RAPPORT, nb_processus=None):
+    """Rend tous les rapports département × scénario, retourne leur liste (DataFrame)"""
+    data, indicateurs, csv, positions = preparer_lot(data, scenarios, departements)
+    taches = [(dep, pos, i) for i in range(len(scenarios)) for dep, pos in positions.items()]
+    rendus = []
+
+    with ProcessPoolExecutor(
+        max_workers=nb_processus, initializer=_initialiser_worker,
+        initargs=(data, indicateurs, csv, scenarios, sortie, list(formats))
+    ) as pool:
+        futures = {pool.submit(rendre_rapport, *tache): tache for tache in taches}
+        for future in as_completed(futures):
+            departement, _, index_scenario = futures[future]
+            try:
+                nom, departement, nb_communes, fichiers = future.result()
+            except Exception as e:
+                print(f"❌ Rapport {scenarios[index_scenario][0]} / {departement}: {e}")
+                continue
+            rendus.append({'scenario': nom, 'departement': departement,
+                           'nb_communes': nb_communes, 'fichiers': fichiers})
+
+    return pd.DataFrame(rendus, columns=['scenario', 'departement', 'nb_communes', 'fichiers']).sort_values(
+        ['scenario', 'departement'], ignore_index=True
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rapports de rentabilité par département et par scénario")
+    parser.add_argument('--resultats', help="table de résultats (CSV ';' du mode ligne de commande ou Parquet)")
+    parser.add_argument('--dvf', default='./data/dvf.csv')
+    parser.add_argument('--loyers', default='./data/loyers.csv')
+    parser.add_argument('--taille-bloc', type=int, default=None, help="lecture du DVF par blocs")
+    parser.add_argument('--dossier-cache', default='cache')
+    parser.add_argument('--sql', help="base SQLite de travail : agrégation hors mémoire du DVF")
+    parser.add_argument('--types-local', nargs='+', default=['Appartement'], help="types de biens (avec --sql)")
+    parser.add_argument('--centroides', help="référentiel CSV des centroïdes : prix complétés par les communes voisines")
+    parser.add_argument('--parametres', help="fichier JSON : liste de scénarios (clés de PARAMETRES_SCENARIO, 'nom')")
+    parser.add_argument('--departements', nargs='+', help="départements à traiter (tous par défaut)")
+    parser.add_argument('--formats', nargs='+', choices=FORMATS_RAPPORT, default=FORMATS_RAPPORT)
+    parser.add_argument('--processus', type=int, default=None, help="taille du pool (nombre de cœurs par défaut)")
+    parser.add_argument('--sortie', default='rapports')
+    args = parser.parse_args()
+
+    debut = time.perf_counter()
+    scenarios = lire_parametres(args.parametres)
+    analyseur = charger_analyseur(args.resultats, args.dvf, args.loyers, args.taille_bloc,
+                                  args.dossier_cache, args.sql, args.types_local, args.centroides)
+    chargement = time.perf_counter() - debut
+
+    rendus = generer_rapports(
+        analyseur.data_merged, scenarios, args.sortie, args.departements, args.formats, args.processus
+    )
+    duree = time.perf_counter() - debut - chargement
+    print(f"✅ {len(rendus)} rapports ({len(scenarios)} scénarios) écrits dans '{args.sortie}'")
+    print(f"⏱️ Chargement et agrégation: {chargement:.1f}s | rendu des rapports: {duree:.1f}s")
+    os.makedirs(args.sortie, exist_ok=True)
+    rendus.assign(fichiers=rendus['fichiers'].str.join(',')).to_csv(
+        os.path.join(args.sortie, 'index_rapports.csv'), index=False, sep=';'
+    )
@@ -0,0 +1,29 @@
+"""Jeu synthétique partagé par les tests (voir donnees_synthetiques.py)"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import AnalyseurRentabiliteImmobiliere  # noqa: E402
+from donnees_synthetiques import generer_jeu  # noqa: E402
+
+NB_LIGNES = 30_000
+NB_COMMUNES = 1500
+
+
+@pytest.fixture(scope='session')
+def chemins_jeu(tmp_path_factory):
+    """dvf.csv, loyers.csv et centroides.csv synthétiques (Corse et DOM compris)"""
+    return generer_jeu(str(tmp_path_factory.mktemp('jeu')), NB_LIGNES, NB_COMMUNES)
+
+
+@pytest.fixture(scope='session')
+def analyseur_nettoye(chemins_jeu):
+    """Analyseur dont le DVF et les loyers sont chargés et nettoyés"""
+    analyseur = AnalyseurRentabiliteImmobiliere()
+    assert analyseur.charger_donnees(chemins_jeu['dvf'], chemins_jeu['loyers'])
+    assert analyseur.nettoyer_donnees_dvf()
+    assert analyseur.nettoyer_donnees_loyers()
+    return analyseur
@@ -0,0 +1,40 @@
+"""Réponses de l'API : communes inconnues en 404, y compris sur une table vide"""
+import json
+
+import pytest
+
+from api_rentabilite import ServiceRentabilite
+from app import AnalyseurRentabiliteImmobiliere
+
+
+@pytest.fixture(scope='module')
+def analyseur_complet(chemins_jeu):
+    analyseur = AnalyseurRentabiliteImmobiliere()
+    for libelle, etape in analyseur.etapes_pipeline(chemins_jeu['dvf'], chemins_jeu['loyers']):
+        assert etape() is not False, libelle
+    return analyseur
+
+
+def repondre(service, chemin, **parametres):
+    statut, corps = service.repondre(chemin, tuple(sorted(parametres.items())))
+    return statut, json.loads(corps)
+
+
+def test_communes_connues_et_inconnues(analyseur_complet):
+    service = ServiceRentabilite(analyseur_complet)
+    code = service.data['insee_code'].iloc[0]
+    statut, fiche = repondre(service, f"/communes/{code:05d}")
+    assert statut == 200 and int(fiche['insee_code']) == code
+    for inconnue in ('99999', 'ABCDE'):
+        assert repondre(service, f"/communes/{inconnue}")[0] == 404
+    assert repondre(service, '/scenario', communes=f"{code:05d},99999")[0] == 404
+
+
+def test_table_de_resultats_vide(analyseur_complet):
+    vide = AnalyseurRentabiliteImmobiliere()
+    vide.data_merged = analyseur_complet.data_merged.iloc[:0]
+    service = ServiceRentabilite(vide)
+    statut, corps = repondre(service, '/communes/75056')
+    assert statut == 404 and '75056' in corps['erreur']
+    assert repondre(service, '/scenario', communes='75056')[0] == 404
+    assert repondre(service, '/top') == (200, {'total': 0, 'communes': []})
@@ -0,0 +1,111 @@
+"""Parité du pipeline SQLite (BaseVentesSQL) avec le pipeline pandas"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import (
+    FILTRES_NOTEBOOK, AnalyseurRentabiliteImmobiliere, BaseVentesSQL, agreger_prix_communes, code_insee_dvf,
+    decoder_codes_insee
+)
+
+
+@pytest.fixture(scope='module')
+def fichier_loyers_incomplet(chemins_jeu, tmp_path_factory):
+    """Loyers sans l'année 2024 pour un tiers des communes : jointure sur une année antérieure"""
+    loyers = pd.read_csv(chemins_jeu['loyers'], sep=';', encoding='latin-1', index_col=0)
+    retires = (loyers['id_zone'] % 3 == 0) & (loyers['annee'] == loyers['annee'].max())
+    chemin = str(tmp_path_factory.mktemp('loyers') / 'loyers.csv')
+    loyers[~retires].to_csv(chemin, sep=';', encoding='latin-1')
+    return chemin
+
+
+def pipeline_pandas(fichier_dvf, fichier_loyers):
+    analyseur = AnalyseurRentabiliteImmobiliere()
+    assert analyseur.charger_donnees(fichier_dvf, fichier_loyers)
+    for etape in [analyseur.nettoyer_donnees_dvf, analyseur.nettoyer_donnees_loyers,
+                  analyseur.agreger_ventes_communes, analyseur.fusionner_donnees, analyseur.calculer_rentabilite]:
+        assert etape()
+    return analyseur.data_merged
+
+
+def texte_categories(data):
+    """Catégories comparées par leurs valeurs (l'ordre des catégories diffère entre les deux chemins)"""
+    return data.astype({col: str for col in data.select_dtypes('category').columns})
+
+
+def test_resultats_identiques_au_pipeline_pandas(chemins_jeu, fichier_loyers_incomplet, tmp_path):
+    attendu = pipeline_pandas(chemins_jeu['dvf'], fichier_loyers_incomplet)
+    analyseur = AnalyseurRentabiliteImmobiliere()
+    assert analyseur.traitement_sql(chemins_jeu['dvf'], fichier_loyers_incomplet, str(tmp_path / 'ventes.sqlite'))
+    obtenu = analyseur.data_merged
+    
+    # Le jeu couvre la Corse, les DOM et le repli sur une année de loyer antérieure
+    codes = pd.Series(decoder_codes_insee(attendu)['insee_code'])
+    assert codes.str.startswith(('2A', '2B')).any() and codes.str.startswith('97').any()
+    assert (attendu['annee_loyer'] < attendu['annee_ventes']).any()
+    
+    assert list(obtenu.columns) == list(attendu.columns)
+    # Catégories comparées par type seulement : codes postaux texte en SQL, nombres lus par pandas
+    assert obtenu.dtypes.astype(str).to_dict() == attendu.dtypes.astype(str).to_dict()
+    attendu = texte_categories(attendu.sort_values('insee_code', ignore_index=True))
+    obtenu = texte_categories(obtenu.sort_values('insee_code', ignore_index=True))
+    # Arrondis à 2 décimales de SQLite et NumPy : au plus un centime d'écart
+    pd.testing.assert_frame_equal(obtenu, attendu, check_exact=False, rtol=1e-9, atol=0.011)
+    np.testing.assert_array_equal(obtenu['nb_ventes'], attendu['nb_ventes'])
+
+
+@pytest.fixture(scope='module')
+def fichier_tous_biens(chemins_jeu, tmp_path_factory):
+    """DVF avec maisons de 3 pièces et plus, ventes de plusieurs lots et échanges"""
+    dvf = pd.read_csv(chemins_jeu['dvf'], sep=';', encoding='latin-1', decimal=',', index_col=0)
+    rng = np.random.default_rng(3)
+    dvf['Nombre pieces principales'] = rng.integers(1, 7, len(dvf)).astype(float).astype(str)
+    dvf['Nombre de lots'] = rng.choice([1, 2, 3], len(dvf), p=[0.7, 0.2, 0.1])
+    dvf.loc[rng.random(len(dvf)) < 0.1, 'Nature mutation'] = 'Echange'
+    chemin = str(tmp_path_factory.mktemp('tous_biens') / 'dvf.csv')
+    dvf.to_csv(chemin, sep=';', encoding='latin-1', decimal=',')
+    return chemin, dvf
+
+
+def prix_attendus(dvf, types_local, vente_seule, lot_unique, pieces_max):
+    """agreger_prix_communes sur les ventes retenues par les filtres demandés"""
+    garder = dvf['Type local'].isin(types_local) & (dvf['Valeur fonciere'] > 0) & (dvf['Surface Carrez du 1er lot'] > 0)
+    if vente_seule:
+        garder &= dvf['Nature mutation'].str.contains('vente', case=False)
+    if lot_unique:
+        garder &= dvf['Nombre de lots'] == 1
+    if pieces_max is not None:
+        garder &= dvf['Nombre pieces principales'].astype(float) <= pieces_max
+    ventes = dvf[garder].reset_index(drop=True)
+    ventes['prix_m2'] = ventes['Valeur fonciere'] / ventes['Surface Carrez du 1er lot']
+    ventes['insee_code'] = code_insee_dvf(ventes['Code departement'], ventes['Code commune'])
+    return agreger_prix_communes(ventes)[0]
+
+
+@pytest.mark.parametrize('filtres', [None, FILTRES_NOTEBOOK])
+def test_tous_types_de_biens(fichier_tous_biens, tmp_path, filtres):
+    """Maisons de 3 pièces et plus et ventes de plusieurs lots gardées, sauf filtres demandés"""
+    chemin, dvf = fichier_tous_biens
+    types_local = ('Appartement', 'Maison')
+    base = BaseVentesSQL(str(tmp_path / 'ventes.sqlite'))
+    base.importer_dvf(chemin)
+    obtenu = base.prix_communes(types_local, filtres=filtres)
+    base.fermer()
+    attendu = prix_attendus(dvf, types_local, **BaseVentesSQL.filtres_ventes(types_local, filtres))
+    
+    assert obtenu['nb_ventes'].sum() + obtenu['nb_aberrants'].sum() == attendu['nb_ventes'].sum() + attendu['nb_aberrants'].sum()
+    colonnes = ['insee_code', 'prix_m2_moyen', 'prix_m2_median', 'nb_ventes', 'nb_aberrants', 'prix_m2_mad']
+    pd.testing.assert_frame_equal(obtenu[colonnes], attendu[colonnes], check_exact=False, rtol=1e-9, atol=0.011)
+    if filtres is None:
+        grandes_maisons = (dvf['Type local'] == 'Maison') & (dvf['Nombre pieces principales'].astype(float) >= 3)
+        assert obtenu['nb_ventes'].sum() > grandes_maisons.sum() > 0
+
+
+def test_ratio_nette_et_filtres_inconnus(chemins_jeu, tmp_path):
+    analyseur = AnalyseurRentabiliteImmobiliere()
+    assert analyseur.traitement_sql(chemins_jeu['dvf'], chemins_jeu['loyers'], str(tmp_path / 'ventes.sqlite'),
+                                    ratio_nette=0.7)
+    data = analyseur.data_merged
+    np.testing.assert_allclose(data['rentabilite_nette'], data['rentabilite_brute'] * 0.7)
+    with pytest.raises(ValueError):
+        BaseVentesSQL.filtres_ventes(('Maison',), {'surface_min': 10})
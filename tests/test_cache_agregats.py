@@ -0,0 +1,60 @@
+"""Reprise des agrégats DVF du cache quand seuls les loyers changent"""
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+from app import AnalyseurRentabiliteImmobiliere
+from donnees_synthetiques import generer_jeu
+
+
+def executer(chemins, dossier_cache, analyseur=None):
+    analyseur = analyseur or AnalyseurRentabiliteImmobiliere(dossier_cache=dossier_cache)
+    for libelle, etape in analyseur.etapes_pipeline(chemins['dvf'], chemins['loyers']):
+        assert etape() is not False, libelle
+    return analyseur
+
+
+def test_distribution_des_ventes_absente_du_cache(chemins_jeu, tmp_path):
+    """Cache antérieur sans distribution des ventes : DVF relu, distribution recalculée puis reprise"""
+    reference = executer(chemins_jeu, str(tmp_path)).rendements_ventes
+    for chemin in glob.glob(os.path.join(tmp_path, 'distribution_ventes_*.npz')):
+        os.remove(chemin)
+    
+    relu = executer(chemins_jeu, str(tmp_path))
+    assert relu.data_dvf is not None
+    pd.testing.assert_frame_equal(relu.rendements_ventes, reference)
+    assert glob.glob(os.path.join(tmp_path, 'distribution_ventes_*.npz'))
+    
+    repris = executer(chemins_jeu, str(tmp_path))
+    assert repris.data_dvf is None
+    pd.testing.assert_frame_equal(repris.rendements_ventes, reference)
+
+
+def test_types_identiques_apres_reprise(chemins_jeu, tmp_path):
+    """Analyse reprise du cache : mêmes types et valeurs qu'une analyse complète"""
+    complete = executer(chemins_jeu, str(tmp_path))
+    reprise = executer(chemins_jeu, str(tmp_path))
+    assert reprise.data_dvf is None
+    pd.testing.assert_frame_equal(reprise.prix_moyens, complete.prix_moyens)
+    pd.testing.assert_frame_equal(reprise.data_merged, complete.data_merged)
+
+
+@pytest.mark.parametrize('avec_cache', [False, True])
+def test_autre_dvf_sur_le_meme_analyseur(chemins_jeu, tmp_path, avec_cache):
+    """Un second DVF chargé par le même analyseur ne reprend pas les agrégats du premier"""
+    dossier_cache = str(tmp_path / 'cache') if avec_cache else None
+    autre = generer_jeu(str(tmp_path / 'autre'), 20_000, 1000, graine=1)
+    analyseur = executer(chemins_jeu, dossier_cache)
+    if avec_cache:
+        # Agrégats du premier DVF en cache : la seconde analyse peut les reprendre
+        executer(chemins_jeu, dossier_cache, analyseur)
+        assert analyseur.agregats_repris
+    
+    executer(autre, dossier_cache, analyseur)
+    reference = executer(autre, None)
+    assert not analyseur.agregats_repris
+    pd.testing.assert_frame_equal(analyseur.prix_moyens, reference.prix_moyens)
+    pd.testing.assert_frame_equal(analyseur.data_merged, reference.data_merged)
+    pd.testing.assert_frame_equal(analyseur.rendements_ventes, reference.rendements_ventes)
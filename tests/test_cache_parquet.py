@@ -0,0 +1,67 @@
+"""Tables nettoyées relues depuis le cache Parquet au lieu des CSV sources"""
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+from app import AnalyseurRentabiliteImmobiliere
+
+
+def executer(chemins, dossier_cache):
+    analyseur = AnalyseurRentabiliteImmobiliere(dossier_cache=dossier_cache)
+    for libelle, etape in analyseur.etapes_pipeline(chemins['dvf'], chemins['loyers']):
+        assert etape() is not False, libelle
+    return analyseur
+
+
+@pytest.fixture
+def lectures_csv(monkeypatch):
+    """Fichiers passés à pd.read_csv pendant le test"""
+    lus, read_csv = [], pd.read_csv
+    
+    def espion(fichier, *args, **kwargs):
+        lus.append(fichier)
+        return read_csv(fichier, *args, **kwargs)
+    monkeypatch.setattr(pd, 'read_csv', espion)
+    return lus
+
+
+def test_second_passage_sans_lecture_csv(chemins_jeu, tmp_path, lectures_csv):
+    dossier = str(tmp_path)
+    premier = executer(chemins_jeu, dossier)
+    assert set(lectures_csv) == {chemins_jeu['dvf'], chemins_jeu['loyers']}
+    for nom in ('dvf', 'loyers', 'prix_moyens'):
+        assert len(glob.glob(os.path.join(dossier, f"{nom}_*.parquet"))) == 1, nom
+    
+    # Agrégats DVF repris, loyers nettoyés relus du Parquet
+    lectures_csv.clear()
+    second = executer(chemins_jeu, dossier)
+    assert lectures_csv == [] and second.data_dvf is None
+    pd.testing.assert_frame_equal(second.data_merged, premier.data_merged)
+    
+    # Sans agrégats en cache : DVF nettoyé relu du Parquet, toujours sans CSV
+    for chemin in glob.glob(os.path.join(dossier, 'prix_moyens_*.parquet')):
+        os.remove(chemin)
+    troisieme = executer(chemins_jeu, dossier)
+    assert lectures_csv == [] and troisieme.data_dvf is not None
+    pd.testing.assert_frame_equal(troisieme.data_merged, premier.data_merged)
+
+
+def test_source_modifiee_relue(chemins_jeu, tmp_path, lectures_csv):
+    copies = {}
+    for nom in ('dvf', 'loyers'):
+        copies[nom] = str(tmp_path / os.path.basename(chemins_jeu[nom]))
+        with open(chemins_jeu[nom], 'rb') as source, open(copies[nom], 'wb') as copie:
+            copie.write(source.read())
+    dossier = str(tmp_path / 'cache')
+    executer(copies, dossier)
+    
+    # Loyers réécrits (taille et date changent) : seul leur CSV est relu
+    loyers = pd.read_csv(copies['loyers'], sep=';', encoding='latin-1', index_col=0)
+    loyers.iloc[:-10].to_csv(copies['loyers'], sep=';', encoding='latin-1', decimal=',')
+    lectures_csv.clear()
+    analyseur = executer(copies, dossier)
+    assert lectures_csv == [copies['loyers']]
+    assert analyseur.data_dvf is None
+    assert len(glob.glob(os.path.join(dossier, 'loyers_*.parquet'))) == 2
@@ -0,0 +1,42 @@
+"""Carte de rentabilité : popups échappés, couleurs et légende selon les seuils de la classification"""
+import numpy as np
+import pytest
+
+from app import COULEURS_RENTABILITE, AnalyseurRentabiliteImmobiliere
+
+NOM_PIEGE = '<img src=x onerror="alert(1)">'
+SEUILS = [1, 3, 5, 7]
+
+
+@pytest.fixture(scope='module')
+def analyseur_carte(chemins_jeu):
+    analyseur = AnalyseurRentabiliteImmobiliere(fichier_centroides=chemins_jeu['centroides'])
+    assert analyseur.charger_donnees(chemins_jeu['dvf'], chemins_jeu['loyers'])
+    assert analyseur.nettoyer_donnees_dvf() and analyseur.nettoyer_donnees_loyers()
+    assert analyseur.fusionner_donnees()
+    assert analyseur.calculer_rentabilite(seuils=SEUILS)
+    assert analyseur.attacher_centroides()
+    communes = analyseur.data_merged['Commune']
+    analyseur.data_merged['Commune'] = communes.cat.rename_categories({communes.iloc[0]: NOM_PIEGE})
+    return analyseur
+
+
+def test_classes_de_la_table(analyseur_carte):
+    data = analyseur_carte.data_merged
+    classes = analyseur_carte._classes_carte(data)
+    np.testing.assert_array_equal(classes, data['attractivite'].cat.codes)
+    np.testing.assert_array_equal(classes, np.digitize(data['rentabilite_brute'], SEUILS))
+    # Moyennes par maille (sans attractivité) : mêmes bornes
+    np.testing.assert_array_equal(analyseur_carte._classes_carte(data.drop(columns='attractivite')), classes)
+
+
+def test_popups_echappes_et_legende(analyseur_carte):
+    rendu = analyseur_carte.creer_carte_rentabilite(mode='marqueurs').get_root().render()
+    assert NOM_PIEGE not in rendu
+    assert '&lt;img src=x onerror=&quot;alert(1)&quot;&gt;' in rendu
+    assert '≥ 7% - Excellente' in rendu and '5-7% - Très bonne' in rendu and '&lt; 1% - Faible' in rendu
+    couleur = COULEURS_RENTABILITE[int(analyseur_carte.data_merged['attractivite'].cat.codes.iloc[0])]
+    assert f'"fillColor": "{couleur}"' in rendu
+    
+    rendu = analyseur_carte.creer_carte_rentabilite(mode='cluster').get_root().render()
+    assert 'textContent' in rendu and "'<b>' + row[2]" not in rendu
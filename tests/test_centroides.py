@@ -0,0 +1,43 @@
+"""Jointure hors ligne des centroïdes contre une fusion pandas sur le code INSEE"""
+import numpy as np
+import pandas as pd
+
+from app import AnalyseurRentabiliteImmobiliere, IndexCentroidesCommunes, decoder_insee
+
+
+class GeocodeurInterdit:
+    """Géocodeur réseau qui ne doit jamais être appelé en mode hors ligne"""
+    def coordonnees(self, communes):
+        raise AssertionError("géocodage réseau en mode hors ligne")
+
+
+def test_jointure_hors_ligne(chemins_jeu, tmp_path):
+    # Référentiel incomplet : une commune sur cinq absente
+    centroides = pd.read_csv(chemins_jeu['centroides'], dtype={'code_insee': str})
+    partiel = centroides[np.arange(len(centroides)) % 5 != 0]
+    fichier = tmp_path / 'centroides.csv'
+    partiel.to_csv(fichier, index=False)
+    
+    analyseur = AnalyseurRentabiliteImmobiliere(geocodeur=GeocodeurInterdit(), fichier_centroides=str(fichier))
+    for libelle, etape in analyseur.etapes_pipeline(chemins_jeu['dvf'], chemins_jeu['loyers']):
+        assert etape() is not False, libelle
+    assert analyseur.obtenir_coordonnees_communes(echantillon=10)
+    
+    communes = analyseur.data_merged
+    attendu = pd.DataFrame({'code_insee': decoder_insee(communes['insee_code'])}).merge(
+        partiel, on='code_insee', how='left'
+    )
+    # Coordonnées conservées en float32 par l'index
+    for col in ('latitude', 'longitude'):
+        np.testing.assert_allclose(communes[col], attendu[col].astype('float32'), rtol=0)
+    absentes = attendu['latitude'].isna()
+    assert absentes.any() and not absentes.all()
+    # Corse et DOM retrouvés
+    assert attendu.loc[~absentes, 'code_insee'].str.match('2[AB]|97').any()
+
+
+def test_codes_corse_dom_et_inconnus():
+    index = IndexCentroidesCommunes(['2B033', '97411', '01001', '2A004'], [42.7, -21.1, 46.2, 41.9], [9.4, 55.5, 4.9, 8.7])
+    latitudes, longitudes = index.rechercher(['2A004', '97411', '2B033', '01001', '75056', None])
+    np.testing.assert_allclose(latitudes, np.float32([41.9, -21.1, 42.7, 46.2, np.nan, np.nan]))
+    np.testing.assert_allclose(longitudes, np.float32([8.7, 55.5, 9.4, 4.9, np.nan, np.nan]))
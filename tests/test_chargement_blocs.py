@@ -0,0 +1,48 @@
+"""Lecture du DVF par blocs : même table que le chargement en une fois"""
+import pandas as pd
+import pytest
+
+from app import COLONNES_CATEGORIELLES_DVF, AnalyseurRentabiliteImmobiliere
+
+COLONNES_NUMERIQUES = ['Valeur fonciere', 'Surface Carrez du 1er lot', 'prix_m2', 'insee_code', 'trimestre', 'nb_pieces']
+
+
+@pytest.fixture(scope='module')
+def dvf_corse_en_fin(chemins_jeu, tmp_path_factory):
+    """DVF du jeu partagé dont les ventes corses sont toutes en fin de fichier"""
+    brut = pd.read_csv(chemins_jeu['dvf'], sep=';', encoding='latin-1', index_col=0, dtype=str)
+    corse = brut['Code departement'].isin(['2A', '2B'])
+    assert corse.any()
+    chemin = tmp_path_factory.mktemp('corse') / 'dvf.csv'
+    pd.concat([brut[~corse], brut[corse]]).to_csv(chemin, sep=';', encoding='latin-1')
+    return str(chemin), int(corse.sum())
+
+
+def charger(chemin, chemins_jeu, taille_bloc):
+    analyseur = AnalyseurRentabiliteImmobiliere()
+    assert analyseur.charger_donnees(chemin, chemins_jeu['loyers'], taille_bloc)
+    assert analyseur.nettoyer_donnees_dvf()
+    return analyseur.data_dvf
+
+
+@pytest.mark.parametrize('taille_bloc', [1000, 7000])
+def test_identique_au_chargement_en_une_fois(dvf_corse_en_fin, chemins_jeu, taille_bloc):
+    chemin, nb_corse = dvf_corse_en_fin
+    # Ventes corses toutes dans le dernier bloc : absentes des catégories des premiers
+    assert nb_corse < taille_bloc
+    attendu = charger(chemin, chemins_jeu, None).reset_index(drop=True)
+    par_blocs = charger(chemin, chemins_jeu, taille_bloc)
+    
+    assert len(par_blocs) == len(attendu)
+    pd.testing.assert_frame_equal(par_blocs[COLONNES_NUMERIQUES], attendu[COLONNES_NUMERIQUES])
+    assert par_blocs['annee'].astype('int64').tolist() == attendu['annee'].tolist()
+    for col in COLONNES_CATEGORIELLES_DVF:
+        assert par_blocs[col].dtype == 'category'
+        assert par_blocs[col].astype(str).tolist() == attendu[col].astype(str).tolist(), col
+    
+    # Catégories corses du dernier bloc conservées par la concaténation
+    departements = par_blocs['Code departement']
+    assert {'2A', '2B'} <= set(departements.cat.categories)
+    corse = departements.isin(['2A', '2B']).to_numpy()
+    assert corse.any() and not departements.isna().any()
+    assert par_blocs.loc[corse, 'insee_code'].between(20000, 20999).all()
@@ -0,0 +1,39 @@
+"""Codes INSEE entiers : Corse, DOM et codes invalides"""
+import numpy as np
+import pandas as pd
+
+from app import code_insee_dvf, decoder_codes_insee, decoder_insee, encoder_insee
+
+VALIDES = ['75056', '01001', '2A004', '2A041', '2B033', '2B366', '97101', '97411', '97611', '20004']
+
+
+def test_aller_retour():
+    codes = encoder_insee(VALIDES)
+    assert codes.dtype == np.int32
+    assert codes.tolist() == [75056, 1001, 20004, 20041, 20533, 20866, 97101, 97411, 97611, 20004]
+    assert decoder_insee(codes).tolist() == VALIDES[:-1] + ['2A004']
+    # Casse, espaces, zéro initial absent et codes déjà entiers
+    assert encoder_insee(['2a004', ' 2b033', '1001', '1001.0']).tolist() == [20004, 20533, 1001, 1001]
+    np.testing.assert_array_equal(encoder_insee(codes), codes)
+
+
+def test_codes_invalides():
+    invalides = ['', None, np.nan, 'ABCDE', '2C001', '7505X', '123456', '2A01']
+    codes = encoder_insee(invalides)
+    assert codes.tolist() == [-1] * len(invalides)
+    assert decoder_insee(codes).tolist() == [None] * len(invalides)
+    assert decoder_insee(np.r_[codes[:1], 75056]).tolist() == [None, '75056']
+
+
+def test_colonnes_dvf():
+    # Le DVF donne les DOM en département à 3 chiffres et commune à 3 chiffres
+    departements = ['75', '1', '2A', '2B', '971', '974', 'ZZ', None]
+    communes = ['56', '1', '4', '33', '101', '411', '1', '1']
+    codes = code_insee_dvf(departements, communes)
+    assert codes.tolist() == [75056, 1001, 20004, 20533, 97101, 97411, -1, -1]
+    assert decoder_insee(codes[:6]).tolist() == ['75056', '01001', '2A004', '2B033', '97101', '97411']
+
+
+def test_export_json():
+    data = decoder_codes_insee(pd.DataFrame({'insee_code': encoder_insee(['2B033', 'inconnu'])}))
+    assert data.to_json(orient='records') == '[{"insee_code":"2B033"},{"insee_code":null}]'
@@ -0,0 +1,79 @@
+"""Médianes du cube des prix contre un groupby().median() sur les transactions"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import AnalyseurRentabiliteImmobiliere, CubePrixCommunes
+
+
+@pytest.fixture(scope='module')
+def dvf_nettoye(chemins_jeu):
+    analyseur = AnalyseurRentabiliteImmobiliere()
+    assert analyseur.charger_donnees(chemins_jeu['dvf'], chemins_jeu['loyers'])
+    assert analyseur.nettoyer_donnees_dvf()
+    analyseur.calculer_prix_moyens_par_commune()  # marque les prix aberrants, exclus du cube
+    return analyseur.data_dvf
+
+
+def mediane_attendue(dvf, cube):
+    """Médiane par commune et trimestre connu, colonnes « 2023-T1 » comme le cube"""
+    ventes = dvf[~dvf['prix_m2_aberrant'] & (dvf['trimestre'] > 0)]
+    medianes = ventes.groupby(['insee_code', 'annee', 'trimestre'])['prix_m2'].median().unstack(['annee', 'trimestre'])
+    medianes.columns = [f"{annee}-T{trimestre}" for annee, trimestre in medianes.columns]
+    return medianes.reindex(index=cube.communes, columns=cube.periodes('trimestre'))
+
+
+def comparer(resultat, attendu):
+    # Médianes conservées en float32 par le cube
+    np.testing.assert_allclose(resultat.to_numpy(dtype='float64'), attendu.to_numpy(dtype='float64'), rtol=1e-6)
+    assert list(resultat.index) == list(attendu.index) and list(resultat.columns) == list(attendu.columns)
+
+
+def test_mediane_trimestrielle(dvf_nettoye):
+    cube = CubePrixCommunes.construire(dvf_nettoye)
+    # Une seule classe de pièces : médiane exacte
+    deux_pieces = dvf_nettoye[dvf_nettoye['nb_pieces'] == 2]
+    comparer(cube.mediane_trimestrielle(pieces=2), mediane_attendue(deux_pieces, cube))
+    
+    # Toutes classes confondues sur un DVF à une seule classe de pièces
+    une_classe = dvf_nettoye.assign(nb_pieces=np.int8(1))
+    cube = CubePrixCommunes.construire(une_classe)
+    attendu = mediane_attendue(une_classe, cube)
+    comparer(cube.mediane_trimestrielle(), attendu)
+    
+    # Extraction de quelques communes
+    communes = cube.communes[[5, 0, 42]]
+    comparer(cube.mediane_trimestrielle(communes=communes), attendu.loc[communes])
+    with pytest.raises(KeyError):
+        cube.mediane_trimestrielle(communes=[99999])
+
+
+def test_mediane_glissante(dvf_nettoye):
+    une_classe = dvf_nettoye.assign(nb_pieces=np.int8(1))
+    cube = CubePrixCommunes.construire(une_classe)
+    attendu = mediane_attendue(une_classe, cube)
+    
+    for fenetre in (1, 4):
+        glissante = attendu.T.rolling(fenetre, min_periods=1).median().T
+        glissante.iloc[:, :fenetre - 1] = np.nan
+        comparer(cube.mediane_glissante(fenetre), glissante)
+    # Fenêtre plus longue que la période couverte : aucune valeur
+    assert cube.mediane_glissante(len(cube.periodes('trimestre')) + 1).isna().all().all()
+
+
+def test_sauvegarde_et_rechargement(dvf_nettoye, tmp_path):
+    cube = CubePrixCommunes.construire(dvf_nettoye)
+    chemin = tmp_path / 'cube.npz'
+    cube.sauvegarder(chemin)
+    relu = CubePrixCommunes.charger(chemin)
+    
+    for nom in ('communes', 'annees', 'nb', 'somme', 'mediane'):
+        np.testing.assert_array_equal(getattr(relu, nom), getattr(cube, nom))
+        assert getattr(relu, nom).dtype == getattr(cube, nom).dtype
+    comparer(relu.mediane_trimestrielle(), cube.mediane_trimestrielle())
+    pd.testing.assert_frame_equal(relu.mediane_glissante(pieces=[1, 2]), cube.mediane_glissante(pieces=[1, 2]))
+    
+    # Prix moyens annuels relus identiques au groupby sur les transactions
+    ventes = dvf_nettoye[~dvf_nettoye['prix_m2_aberrant']]
+    attendu = ventes.groupby(['insee_code', 'annee'])['prix_m2'].mean().unstack().reindex(relu.communes)
+    np.testing.assert_allclose(relu.prix_moyen().to_numpy(), attendu.to_numpy(), rtol=1e-12)
@@ -0,0 +1,55 @@
+"""Exports officiels : archive zip séparée par '|' lue comme le CSV ','"""
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import AnalyseurRentabiliteImmobiliere, detecter_format_dvf, ouvrir_dvf
+
+
+@pytest.fixture(scope='module')
+def exports(chemins_jeu, tmp_path_factory):
+    """Mêmes mutations en CSV ',' à point décimal et en archive officielle '|' à virgule décimale"""
+    dossier = tmp_path_factory.mktemp('exports')
+    brut = pd.read_csv(chemins_jeu['dvf'], sep=';', encoding='latin-1', index_col=0, dtype=str).head(8000)
+    brut['Nombre de lots'] = np.where(np.arange(len(brut)) % 7 == 0, '2', '1')
+    
+    virgule = brut.copy()
+    for col in ['Valeur fonciere', 'Surface Carrez du 1er lot']:
+        virgule[col] = virgule[col].str.replace(',', '.')
+    virgule.to_csv(dossier / 'dvf.csv', sep=',', index=False, encoding='latin-1')
+    
+    brut.to_csv(dossier / 'valeursfoncieres-2024.txt', sep='|', index=False, encoding='latin-1')
+    with zipfile.ZipFile(dossier / 'valeursfoncieres-2024.zip', 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.write(dossier / 'valeursfoncieres-2024.txt', 'valeursfoncieres-2024.txt')
+    return {'csv': str(dossier / 'dvf.csv'), 'zip': str(dossier / 'valeursfoncieres-2024.zip')}
+
+
+def test_format_detecte(exports):
+    with ouvrir_dvf(exports['csv']) as (_, format_csv, _):
+        assert format_csv == {'sep': ',', 'decimal': '.', 'archive': False}
+    with ouvrir_dvf(exports['zip']) as (flux, format_zip, avancement):
+        assert format_zip == {'sep': '|', 'decimal': ',', 'archive': True}
+        assert flux.readline().startswith(b'Date mutation|')
+        assert 0 < avancement() <= 1
+    assert detecter_format_dvf(b'a;Valeur fonciere\n1;10.5\n2;3') == {'sep': ';', 'decimal': '.'}
+
+
+def test_archive_identique_au_csv(exports, chemins_jeu):
+    tables = {}
+    for nom, fichier in exports.items():
+        analyseur = AnalyseurRentabiliteImmobiliere()
+        assert analyseur.charger_donnees(fichier, chemins_jeu['loyers'])
+        assert analyseur.nettoyer_donnees_dvf()
+        tables[nom] = analyseur.data_dvf
+    
+    pd.testing.assert_frame_equal(tables['zip'], tables['csv'])
+    # Filtres des exports bruts (dont le nombre de lots) appliqués aux deux
+    brut = pd.read_csv(exports['csv'], encoding='latin-1')
+    valides = (
+        (brut['Type local'] == 'Appartement') & (brut['Nombre de lots'] == 1) & (brut['Nombre pieces principales'] <= 2)
+        & (brut['Valeur fonciere'] > 0) & (brut['Surface Carrez du 1er lot'] > 0)
+    )
+    assert len(tables['csv']) == valides.sum()
+    np.testing.assert_allclose(tables['csv']['Valeur fonciere'], brut.loc[valides, 'Valeur fonciere'])
@@ -0,0 +1,37 @@
+"""Géocodeur partagé entre threads (cache SQLite commun)"""
+import threading
+
+import pandas as pd
+
+from app import GeocodeurCommunes, decoder_insee
+
+
+def test_geocodeur_partage_entre_threads(tmp_path):
+    geocodeur = GeocodeurCommunes(
+        lambda requete: (45.0, float(len(requete))), str(tmp_path / 'geocodage.sqlite'),
+        requetes_par_seconde=None, nb_workers=4
+    )
+    communes = pd.DataFrame({'insee_code': decoder_insee(list(range(1001, 1401))),
+                             'Commune': [f"Commune {i}" for i in range(400)]})
+    depart = threading.Barrier(8)
+    erreurs, resultats = [], []
+    
+    def geocoder(numero):
+        depart.wait()
+        try:
+            for debut in range(0, 400, 25):
+                tranche = communes.iloc[(debut + 50 * numero) % 400:][:25]
+                resultats.append(len(geocodeur.coordonnees(tranche)) == len(tranche))
+                geocodeur.lire_cache()
+        except Exception as e:
+            erreurs.append(e)
+    
+    threads = [threading.Thread(target=geocoder, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert not erreurs
+    assert all(resultats)
+    assert len(geocodeur.lire_cache()) == 400
@@ -0,0 +1,53 @@
+"""Graphiques agrégés : les classes précalculées comptent toutes les communes"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import NB_CLASSES_HISTOGRAMME, NB_MAILLES_DENSITE, AnalyseurRentabiliteImmobiliere
+
+
+def analyseur_fusionne(prix, loyers, rentabilite):
+    analyseur = AnalyseurRentabiliteImmobiliere()
+    n = len(prix)
+    analyseur.data_merged = pd.DataFrame({
+        'Commune': [f"COMMUNE {i}" for i in range(n)],
+        'prix_m2_moyen': prix,
+        'loypredm2': loyers,
+        'rentabilite_brute': rentabilite,
+        'attractivite': np.where(np.arange(n) % 2, 'Bonne', 'Faible')
+    })
+    return analyseur
+
+
+def traces(fig):
+    return {trace.name: trace for trace in fig.data}
+
+
+@pytest.mark.parametrize('n', [3, 20_000])
+def test_totaux_des_classes(n):
+    rng = np.random.default_rng(0)
+    prix = rng.lognormal(8, 0.5, n)
+    loyers = rng.lognormal(2.5, 0.3, n)
+    # Communes très atypiques, valeurs manquantes ou infinies
+    prix[:2], loyers[2:3] = [1e6, 1.0], 500.0
+    rentabilite = loyers * 12 * 100 / prix
+    prix[-1:], loyers[-2:-1], rentabilite[-3:] = np.nan, np.inf, [np.nan, np.inf, -np.inf]
+    analyseur = analyseur_fusionne(prix, loyers, rentabilite)
+    
+    graphiques = traces(analyseur.creer_graphiques_analyse(mode='agrege'))
+    histogramme, densite = graphiques['Rentabilité'], graphiques['Densité']
+    assert len(histogramme.y) == NB_CLASSES_HISTOGRAMME
+    assert np.sum(histogramme.y) == np.isfinite(rentabilite).sum()
+    
+    z = np.asarray(densite.z, dtype='float64')
+    assert z.shape == (NB_MAILLES_DENSITE, NB_MAILLES_DENSITE)
+    assert np.nansum(z) == (np.isfinite(prix) & np.isfinite(loyers)).sum()
+    # Mailles vides masquées, jamais à zéro
+    assert not (z == 0).any()
+
+
+def test_valeurs_identiques():
+    analyseur = analyseur_fusionne(np.full(50, 3000.0), np.full(50, 12.0), np.full(50, 4.8))
+    graphiques = traces(analyseur.creer_graphiques_analyse(mode='agrege'))
+    assert np.sum(graphiques['Rentabilité'].y) == 50
+    assert np.nansum(np.asarray(graphiques['Densité'].z, dtype='float64')) == 50
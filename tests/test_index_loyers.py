@@ -0,0 +1,27 @@
+"""Recherche des loyers par commune et année"""
+import numpy as np
+import pandas as pd
+
+from app import IndexLoyersCommunes
+
+
+def loyers(lignes):
+    return pd.DataFrame(lignes, columns=['insee_code', 'annee', 'loypredm2', 'LIBGEO', 'DEP'])
+
+
+def test_annee_anterieure_puis_premiere_disponible():
+    index = IndexLoyersCommunes(loyers([
+        ('75056', 2020, 30.0, 'Paris', '75'), ('75056', 2022, 32.0, 'Paris', '75'),
+        ('2A004', 2021, 14.0, 'Ajaccio', '2A')
+    ]))
+    positions = index.rechercher(['75056', '75056', '75056', '2A004', '69123'], [2021, 2023, 2019, 2020, 2022])
+    assert positions[-1] == -1
+    assert index.loyers[positions[:-1]].tolist() == [30.0, 32.0, 30.0, 14.0]
+
+
+def test_index_vide():
+    index = IndexLoyersCommunes(loyers([]))
+    assert len(index) == 0
+    assert index.rechercher(['75056', '2A004']).tolist() == [-1, -1]
+    assert index.rechercher(['75056'], [2022]).tolist() == [-1]
+    assert len(index.rechercher(np.array([], dtype=str))) == 0
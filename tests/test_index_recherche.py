@@ -0,0 +1,94 @@
+"""Recherche paginée des communes contre un filtrage et un tri pandas exhaustifs"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import CLASSES_ATTRACTIVITE, IndexRechercheCommunes
+
+NB_COMMUNES = 600
+
+
+@pytest.fixture(scope='module')
+def communes():
+    """Communes fusionnées factices : départements '1' et '01' confondus, ex aequo et NaN"""
+    rng = np.random.default_rng(0)
+    departements = rng.choice(['1', '01', '13', '2A', '2B', '69', '75', '971'], NB_COMMUNES)
+    rentabilite = rng.uniform(2, 12, NB_COMMUNES).round(1)
+    rentabilite[rng.random(NB_COMMUNES) < 0.05] = np.nan
+    prix = rng.uniform(1000, 9000, NB_COMMUNES).round(-2)
+    return pd.DataFrame({
+        'insee_code': np.arange(NB_COMMUNES),
+        'departement': departements,
+        'prix_m2_moyen': prix,
+        'valeur_moyenne': prix * rng.uniform(30, 80, NB_COMMUNES),
+        'nb_ventes': rng.integers(1, 20, NB_COMMUNES),
+        'rentabilite_brute': rentabilite,
+        'prix_emprunte': rng.random(NB_COMMUNES) < 0.1,
+        'attractivite': pd.Categorical(rng.choice(CLASSES_ATTRACTIVITE, NB_COMMUNES), categories=CLASSES_ATTRACTIVITE)
+    })
+
+
+def reference(communes, departement=None, prix_m2_max=None, min_ventes=None, attractivite=None,
+              tri='rentabilite_brute', croissant=False):
+    masque = communes[tri].notna()
+    if departement is not None:
+        masque &= communes['departement'].str.zfill(2).isin([str(d).zfill(2) for d in departement])
+    if prix_m2_max is not None:
+        masque &= communes['prix_m2_moyen'] <= prix_m2_max
+    if min_ventes is not None:
+        masque &= (communes['nb_ventes'] >= min_ventes) | communes['prix_emprunte']
+    if attractivite is not None:
+        masque &= communes['attractivite'].isin(attractivite)
+    # Ex aequo : ordre d'origine en croissant, inversé en décroissant
+    ordre = communes[masque].sort_values(tri, kind='stable')
+    return ordre['insee_code'].tolist() if croissant else ordre['insee_code'].tolist()[::-1]
+
+
+@pytest.mark.parametrize('filtres', [
+    {},
+    {'departement': ['13']},
+    {'departement': [1]},
+    {'departement': ['2A', '2B', '971'], 'min_ventes': 10},
+    {'prix_m2_max': 4000, 'attractivite': ['Bonne', 'Excellente'], 'tri': 'prix_m2_moyen', 'croissant': True},
+    {'departement': ['99']}
+])
+def test_pages_successives(communes, filtres):
+    index = IndexRechercheCommunes(communes)
+    attendu = reference(communes, **filtres)
+    
+    codes, page = [], 0
+    while True:
+        resultats, total = index.rechercher(page=page, taille_page=7, **filtres)
+        assert total == len(attendu)
+        if resultats.empty:
+            break
+        assert len(resultats) == 7 or len(codes) + len(resultats) == total
+        codes += resultats['insee_code'].tolist()
+        page += 1
+    assert codes == attendu
+    # Page au-delà du dernier résultat : vide, total inchangé
+    resultats, total = index.rechercher(page=page + 10, taille_page=7, **filtres)
+    assert resultats.empty and total == len(attendu)
+
+
+def test_premiere_page_prefixe_du_classement(communes):
+    """Top k de chaque département : début du classement complet, quel que soit k"""
+    index = IndexRechercheCommunes(communes)
+    complet, total = index.rechercher(departement='69', taille_page=NB_COMMUNES)
+    assert len(complet) == total
+    for k in (1, 5, total, total + 3):
+        top, _ = index.rechercher(departement='69', taille_page=k)
+        assert top['insee_code'].tolist() == complet['insee_code'].tolist()[:k]
+
+
+def test_taille_page_nulle_et_bornes(communes):
+    index = IndexRechercheCommunes(communes)
+    resultats, total = index.rechercher(taille_page=0, attractivite='Faible')
+    assert resultats.empty and list(resultats.columns) == list(communes.columns)
+    assert total == len(reference(communes, attractivite=['Faible']))
+    
+    for bornes in ({'page': -1}, {'page': -2, 'taille_page': 10}, {'taille_page': -5}):
+        with pytest.raises(ValueError):
+            index.rechercher(**bornes)
+    with pytest.raises(ValueError):
+        index.rechercher(tri='loypredm2')
@@ -0,0 +1,32 @@
+"""Ingestion parallèle : mêmes prix par commune que le calcul sur le fichier entier"""
+import pandas as pd
+
+from app import TAILLE_BLOC_DVF, AnalyseurRentabiliteImmobiliere, ingerer_dvf_en_parallele
+from donnees_synthetiques import generer_jeu
+
+
+def fusionner(analyseur, chemins):
+    assert analyseur.charger_donnees(chemins['dvf'], chemins['loyers'])
+    assert analyseur.nettoyer_donnees_dvf() and analyseur.nettoyer_donnees_loyers()
+    assert analyseur.fusionner_donnees()
+    return analyseur.data_merged
+
+
+def test_identique_au_calcul_sur_le_fichier_entier(chemins_jeu):
+    analyseur = AnalyseurRentabiliteImmobiliere()
+    analyseur.data_dvf = analyseur.charger_dvf_par_blocs(chemins_jeu['dvf'], TAILLE_BLOC_DVF)
+    attendu = analyseur.calculer_prix_moyens_par_commune()
+    
+    pd.testing.assert_frame_equal(ingerer_dvf_en_parallele(chemins_jeu['dvf'], nb_processus=3), attendu)
+
+
+def test_resultat_parallele_lu_seulement_sur_demande(chemins_jeu, tmp_path):
+    """Les prix d'une ingestion parallèle ne remplacent pas ceux du DVF chargé ensuite"""
+    autre = generer_jeu(str(tmp_path), 20_000, 1000, graine=1)
+    analyseur = AnalyseurRentabiliteImmobiliere()
+    assert analyseur.ingerer_dvf_parallele(chemins_jeu['dvf'], nb_processus=2)
+    parallele = analyseur.prix_moyens_parallele
+    
+    pd.testing.assert_frame_equal(fusionner(analyseur, autre), fusionner(AnalyseurRentabiliteImmobiliere(), autre))
+    assert analyseur.agreger_ventes_communes(depuis_parallele=True)
+    assert analyseur.prix_moyens is parallele
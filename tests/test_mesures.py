@@ -0,0 +1,36 @@
+"""Mesures du pipeline partagées entre threads"""
+import threading
+
+from app import MesuresPipeline
+
+
+def test_mesures_concurrentes_bornees():
+    mesures = MesuresPipeline()
+    depart = threading.Barrier(8)
+    niveaux = []
+    
+    def mesurer():
+        depart.wait()
+        for _ in range(500):
+            externe = mesures.debut('externe')
+            interne = mesures.debut('interne')
+            niveaux.append((externe['niveau'], interne['niveau']))
+            mesures.filtre('filtre', 1)
+            mesures.fin(interne)
+            mesures.fin(externe)
+        niveaux.append(len(mesures.pile))
+    
+    threads = [threading.Thread(target=mesurer) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert niveaux.count((0, 1)) == 8 * 500
+    assert niveaux.count(0) == 8
+    
+    tableau = mesures.tableau()
+    assert len(tableau) == MesuresPipeline.MAX_ETAPES
+    assert set(tableau['niveau']) == {0, 1}
+    assert (tableau.loc[tableau['niveau'] == 1, 'lignes_exclues'] == 1).all()
+    assert (tableau.loc[tableau['niveau'] == 0, 'lignes_exclues'] == 0).all()
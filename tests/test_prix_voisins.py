@@ -0,0 +1,51 @@
+"""Voisinage des communes : grille de repli contre recherche exhaustive, prix complétés dans les scripts"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import RAYON_TERRE_KM, IndexSpatialCommunes, charger_analyseur
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RAYON_TERRE_KM * np.arcsin(np.sqrt(a))
+
+
+@pytest.mark.parametrize('rayon_km, k', [(15, None), (40, None), (25, 5)])
+def test_grille_identique_a_la_recherche_exhaustive(chemins_jeu, rayon_km, k):
+    centroides = pd.read_csv(chemins_jeu['centroides'], dtype={'code_insee': str})
+    latitudes = centroides['latitude'].to_numpy(copy=True)
+    longitudes = centroides['longitude'].to_numpy()
+    latitudes[::50] = np.nan  # communes sans coordonnées ignorées
+    index = IndexSpatialCommunes(latitudes, longitudes)
+    index.arbre = None  # repli sans scipy : mailles de la taille du rayon
+    
+    requetes_lat, requetes_lon = centroides['latitude'].to_numpy()[1::7], centroides['longitude'].to_numpy()[1::7]
+    requetes_lat = requetes_lat.copy()
+    requetes_lat[::9] = np.nan  # points sans coordonnées : aucun voisin
+    requetes, positions, distances = index.voisins(requetes_lat, requetes_lon, rayon_km, k)
+    
+    distances_toutes = haversine(requetes_lat[:, None], requetes_lon[:, None], latitudes[None, :], longitudes[None, :])
+    for i in range(len(requetes_lat)):
+        attendu = np.flatnonzero(distances_toutes[i] <= rayon_km)
+        attendu = attendu[np.argsort(distances_toutes[i][attendu], kind='stable')][:k]
+        obtenu = requetes == i
+        assert sorted(positions[obtenu]) == sorted(attendu)
+        np.testing.assert_allclose(distances[obtenu], distances_toutes[i][positions[obtenu]], atol=1e-6)
+        assert (np.diff(distances[obtenu]) >= 0).all()
+    assert not np.isin(requetes, np.arange(0, len(requetes_lat), 9)).any()
+
+
+def test_prix_voisins_dans_charger_analyseur(chemins_jeu, tmp_path):
+    analyseur = charger_analyseur(dvf=chemins_jeu['dvf'], loyers=chemins_jeu['loyers'],
+                                  dossier_cache=str(tmp_path), centroides=chemins_jeu['centroides'])
+    data = analyseur.data_merged
+    assert data['prix_emprunte'].any()
+    # Rentabilités calculées sur le prix complété
+    np.testing.assert_allclose(data['rentabilite_brute'], data['loypredm2'] * 12 / data['prix_m2_moyen'] * 100)
+    
+    sql = charger_analyseur(dvf=chemins_jeu['dvf'], loyers=chemins_jeu['loyers'], sql=str(tmp_path / 'ventes.sqlite'),
+                            dossier_cache=None, centroides=chemins_jeu['centroides']).data_merged
+    assert sql['prix_emprunte'].any()
+    np.testing.assert_allclose(sql['rentabilite_brute'], sql['loypredm2'] * 12 / sql['prix_m2_moyen'] * 100)
@@ -0,0 +1,45 @@
+"""Lecture des scénarios, rendu des rapports et chargement partagé des scripts"""
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import rapports_lot
+from app import charger_analyseur
+from rapports_lot import lire_parametres, preparer_lot, rendre_rapport
+
+
+@pytest.mark.parametrize('nom', ['../hors_sortie', 'a/b', 'a\\b', '..', ' '])
+def test_nom_de_scenario_hors_sortie_refuse(tmp_path, nom):
+    fichier = tmp_path / 'scenarios.json'
+    fichier.write_text(json.dumps([{'nom': nom, 'apport': 0.2}]), encoding='utf-8')
+    with pytest.raises(ValueError):
+        lire_parametres(str(fichier))
+
+
+def test_charger_analyseur(chemins_jeu, tmp_path):
+    analyseur = charger_analyseur(dvf=chemins_jeu['dvf'], loyers=chemins_jeu['loyers'], dossier_cache=str(tmp_path))
+    assert 'rentabilite_brute' in analyseur.data_merged.columns
+
+
+def test_rendu_sans_modifier_la_table_partagee(chemins_jeu, tmp_path, monkeypatch):
+    """Les indicateurs d'un scénario ne restent pas dans la table partagée par les rapports suivants"""
+    analyseur = charger_analyseur(dvf=chemins_jeu['dvf'], loyers=chemins_jeu['loyers'], dossier_cache=str(tmp_path))
+    defaut = lire_parametres()[0][1]
+    scenarios = [('sans_apport', {**defaut, 'apport': 0.0}), ('comptant', {**defaut, 'apport': 1.0})]
+    data, indicateurs, csv, positions = preparer_lot(analyseur.data_merged, scenarios)
+    monkeypatch.setattr(rapports_lot, '_PARTAGE', {})
+    rapports_lot._initialiser_worker(data, indicateurs, csv, scenarios, str(tmp_path / 'rapports'), ['csv'])
+    reference = data.copy()
+    
+    departement, lignes = next(iter(positions.items()))
+    for i, (nom, _) in enumerate(scenarios):
+        _, _, nb_communes, fichiers = rendre_rapport(departement, lignes, i)
+        pd.testing.assert_frame_equal(rapports_lot._PARTAGE['data'], reference)
+        rapport = pd.read_csv(fichiers[0], sep=';')
+        assert nb_communes == len(rapport) == len(lignes)
+        for indicateur, tableau in indicateurs.items():
+            # Infinis écrits vides dans le CSV
+            attendu = pd.Series(tableau[lignes, i], name=indicateur).replace([np.inf, -np.inf], np.nan)
+            pd.testing.assert_series_equal(rapport[indicateur], attendu, check_dtype=False, rtol=1e-5)
@@ -0,0 +1,77 @@
+"""Percentiles du rendement des ventes contre un groupby().quantile() exhaustif"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import RENDEMENT_CIBLE, AnalyseurRentabiliteImmobiliere, DistributionRendementsVentes
+
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+@pytest.fixture(scope='module')
+def dvf_nettoye(chemins_jeu):
+    analyseur = AnalyseurRentabiliteImmobiliere()
+    assert analyseur.charger_donnees(chemins_jeu['dvf'], chemins_jeu['loyers'])
+    assert analyseur.nettoyer_donnees_dvf()
+    analyseur.calculer_prix_moyens_par_commune()  # marque les prix aberrants
+    return analyseur.data_dvf
+
+
+def loyers_partiels(dvf):
+    """Loyer par commune ; un quart des communes sans loyer (absentes, NaN ou nul)"""
+    codes = np.unique(dvf['insee_code'].to_numpy())
+    rng = np.random.default_rng(0)
+    loyers = rng.uniform(8, 25, len(codes))
+    tirage = rng.random(len(codes))
+    loyers[tirage < 0.05] = np.nan
+    loyers[(tirage >= 0.05) & (tirage < 0.1)] = 0
+    garder = tirage < 0.85
+    return pd.Series(loyers[garder], index=codes[garder])
+
+
+def reference(dvf, loyers):
+    ventes = dvf.loc[~dvf['prix_m2_aberrant'], ['insee_code', 'prix_m2', 'nb_pieces']]
+    ventes = ventes.assign(loyer=ventes['insee_code'].map(loyers).to_numpy(dtype='float64'))
+    ventes = ventes[ventes['loyer'] > 0]
+    # Prix conservés en float32 par la distribution
+    ventes['rendement'] = ventes['loyer'] * 12 * 100 / ventes['prix_m2'].to_numpy(dtype='float32')
+    ventes['pieces'] = np.asarray(DistributionRendementsVentes.PIECES)[ventes['nb_pieces'].to_numpy() + 1]
+    segments = pd.concat([ventes.assign(pieces='toutes'), ventes])
+    groupes = segments.groupby(['insee_code', 'pieces'])['rendement']
+    attendu = groupes.quantile(list(QUANTILES)).unstack()
+    attendu.columns = [f"rendement_p{round(q * 100)}" for q in QUANTILES]
+    attendu['nb_ventes'] = groupes.size()
+    attendu['part_au_dessus_cible'] = (segments['rendement'] >= RENDEMENT_CIBLE).groupby(
+        [segments['insee_code'], segments['pieces']]).mean()
+    return attendu
+
+
+def test_percentiles_identiques_au_groupby(dvf_nettoye, tmp_path):
+    loyers = loyers_partiels(dvf_nettoye)
+    distribution = DistributionRendementsVentes.construire(dvf_nettoye)
+    distribution.sauvegarder(str(tmp_path / 'distribution.npz'))
+    relue = DistributionRendementsVentes.charger(str(tmp_path / 'distribution.npz'))
+    
+    obtenu = distribution.rendements(loyers.index, loyers.to_numpy(), RENDEMENT_CIBLE, QUANTILES)
+    pd.testing.assert_frame_equal(relue.rendements(loyers.index, loyers.to_numpy(), RENDEMENT_CIBLE, QUANTILES), obtenu)
+    
+    attendu = reference(dvf_nettoye, loyers)
+    obtenu = obtenu.assign(pieces=obtenu['pieces'].astype(str)).set_index(['insee_code', 'pieces'])
+    assert sorted(obtenu.index) == sorted(attendu.index)
+    attendu = attendu.loc[obtenu.index]
+    np.testing.assert_array_equal(obtenu['nb_ventes'], attendu['nb_ventes'])
+    for col in [f"rendement_p{round(q * 100)}" for q in QUANTILES] + ['part_au_dessus_cible']:
+        np.testing.assert_allclose(obtenu[col], attendu[col], rtol=1e-5, err_msg=col)
+
+
+def test_communes_sans_loyer(dvf_nettoye):
+    loyers = loyers_partiels(dvf_nettoye)
+    distribution = DistributionRendementsVentes.construire(dvf_nettoye)
+    obtenu = distribution.rendements(loyers.index, loyers.to_numpy())
+    
+    sans_loyer = set(np.unique(dvf_nettoye['insee_code'])) - set(loyers[loyers > 0].index)
+    assert sans_loyer and not sans_loyer & set(obtenu['insee_code'])
+    assert obtenu.notna().all().all()
+    # Aucun loyer : table vide au même schéma
+    vide = distribution.rendements(np.array([], dtype='int32'), np.array([]))
+    assert vide.empty and list(vide.columns) == list(obtenu.columns)
@@ -0,0 +1,32 @@
+"""Validation des seuils d'attractivité et des paramètres de scénario"""
+import numpy as np
+import pytest
+
+from app import AnalyseurRentabiliteImmobiliere, MoteurScenarios, grille_scenarios
+
+
+@pytest.fixture(scope='module')
+def analyseur_fusionne(chemins_jeu):
+    analyseur = AnalyseurRentabiliteImmobiliere()
+    assert analyseur.charger_donnees(chemins_jeu['dvf'], chemins_jeu['loyers'])
+    assert analyseur.nettoyer_donnees_dvf()
+    assert analyseur.nettoyer_donnees_loyers()
+    assert analyseur.fusionner_donnees()
+    return analyseur
+
+
+@pytest.mark.parametrize('seuils', [[3, 5, 7], [2, 4, 6, 8, 10], [4, 2, 6, 8]])
+def test_seuils_invalides_refuses(analyseur_fusionne, seuils):
+    with pytest.raises(ValueError):
+        analyseur_fusionne.calculer_rentabilite(seuils=seuils)
+
+
+def test_duree_credit_nulle(analyseur_fusionne):
+    moteur = MoteurScenarios(analyseur_fusionne.data_merged)
+    with pytest.raises(ValueError):
+        moteur.evaluer(grille_scenarios(duree_credit_ans=0))
+    # Sans emprunt, la durée est sans effet
+    resultats = moteur.evaluer(grille_scenarios(duree_credit_ans=[0, 20], apport=1.0))
+    for valeurs in resultats.values():
+        assert np.isfinite(valeurs).all()
+        assert np.allclose(valeurs[:, 0], valeurs[:, 1])
@@ -0,0 +1,80 @@
+"""Statistiques robustes par segments triés contre groupby pandas"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import (
+    MIN_VENTES_ABERRANTS, PROPORTION_TRONQUEE, SEUIL_MAD_ABERRANT, _tri_par_groupe, statistiques_robustes
+)
+
+
+def jeu(etendue, graine=0):
+    """Groupes de 1 à 60 lignes (dont n=1 et n < min_ventes), prix arrondis (égalités) et quelques aberrants"""
+    rng = np.random.default_rng(graine)
+    tailles = np.r_[[1, 1, 2, 3, MIN_VENTES_ABERRANTS, 5], rng.integers(1, 60, 300)]
+    cles = np.repeat(rng.choice(etendue, len(tailles), replace=False), tailles)
+    valeurs = np.round(rng.lognormal(8, 0.3, len(cles)), -1)
+    valeurs[rng.random(len(cles)) < 0.03] *= 20
+    # Groupes à valeurs toutes égales : MAD nul, aucune vente écartée
+    constantes = np.isin(cles, cles[np.r_[0, np.cumsum(tailles)[:-1]][6:12]])
+    valeurs[constantes] = 3000.0
+    melange = rng.permutation(len(cles))
+    return cles[melange], valeurs[melange]
+
+
+def reference(cles, valeurs):
+    ventes = pd.DataFrame({'cle': cles, 'valeur': valeurs})
+    groupes = ventes.groupby('cle')['valeur']
+    mediane = groupes.transform('median')
+    ventes['ecart'] = (ventes['valeur'] - mediane).abs()
+    
+    def tronquee(x):
+        x, k = np.sort(x.to_numpy()), int(np.floor(len(x) * PROPORTION_TRONQUEE))
+        return x[k:len(x) - k].mean()
+    
+    stats = pd.DataFrame({
+        'nb': groupes.size(),
+        'mediane': groupes.median(),
+        'q1': groupes.quantile(0.25),
+        'q3': groupes.quantile(0.75),
+        'mad': ventes.groupby('cle')['ecart'].median(),
+        'moyenne_tronquee': groupes.apply(tronquee),
+        'premiere_ligne': ventes.reset_index().groupby('cle')['index'].first()
+    })
+    echelle = SEUIL_MAD_ABERRANT * 1.4826 * ventes['cle'].map(stats['mad'])
+    controle = (ventes['cle'].map(stats['nb']) >= MIN_VENTES_ABERRANTS) & (echelle > 0)
+    aberrant = (controle & (ventes['ecart'] > echelle)).to_numpy()
+    stats['nb_aberrants'] = pd.Series(aberrant, index=ventes['cle']).groupby(level=0).sum()
+    return stats.reset_index(), aberrant
+
+
+@pytest.mark.parametrize('etendue', [100_000, 1 << 40])
+def test_identique_a_groupby(etendue):
+    """Clés denses (table de correspondance) ou très dispersées (factorize)"""
+    cles, valeurs = jeu(etendue)
+    stats, groupes, aberrant = statistiques_robustes(cles, valeurs)
+    attendu, aberrant_attendu = reference(cles, valeurs)
+    
+    assert (stats['nb'] < MIN_VENTES_ABERRANTS).any() and (stats['nb'] == 1).any()
+    assert aberrant_attendu.any() and (attendu['mad'] == 0).any()
+    np.testing.assert_array_equal(stats['cle'], attendu['cle'])
+    np.testing.assert_array_equal(stats['cle'].to_numpy()[groupes], cles)
+    for col in ['nb', 'premiere_ligne', 'nb_aberrants']:
+        np.testing.assert_array_equal(stats[col], attendu[col], err_msg=col)
+    for col in ['mediane', 'q1', 'q3', 'mad', 'moyenne_tronquee']:
+        np.testing.assert_allclose(stats[col], attendu[col], rtol=1e-12, err_msg=col)
+    np.testing.assert_array_equal(aberrant, aberrant_attendu)
+
+
+def test_tri_par_groupe():
+    cles, valeurs = jeu(1000, graine=1)
+    groupes = pd.factorize(cles, sort=True)[0]
+    ordre = _tri_par_groupe(groupes, valeurs)
+    np.testing.assert_array_equal(groupes[ordre], np.sort(groupes))
+    # Égalités : seul l'ordre des lignes de même valeur peut différer de lexsort
+    np.testing.assert_array_equal(valeurs[ordre], valeurs[np.lexsort((valeurs, groupes))])
+
+
+def test_vide():
+    stats, groupes, aberrant = statistiques_robustes(np.array([], dtype='int64'), np.array([]))
+    assert stats.empty and len(groupes) == 0 and len(aberrant) == 0
@@ -0,0 +1,117 @@
+"""Parité du stock d'agrégats incrémental avec le recalcul complet (agreger_prix_communes)"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import (
+    MIN_VENTES_ABERRANTS, SEUIL_MAD_ABERRANT, AnalyseurRentabiliteImmobiliere, StockAgregatsCommunes,
+    agreger_prix_communes, encoder_insee
+)
+
+
+@pytest.fixture(scope='module')
+def dvf(analyseur_nettoye):
+    return analyseur_nettoye.data_dvf
+
+
+@pytest.fixture(scope='module')
+def reference(dvf):
+    return agreger_prix_communes(dvf)[0]
+
+
+def stock_par_lots(dvf, colonne='annee'):
+    stock = StockAgregatsCommunes()
+    for identifiant, lot in dvf.groupby(colonne, observed=True):
+        assert stock.ajouter_lot(lot, identifiant)
+    return stock
+
+
+def test_lots_equivalents_a_un_lot_unique(dvf):
+    unique = StockAgregatsCommunes()
+    unique.ajouter_lot(dvf)
+    pd.testing.assert_frame_equal(stock_par_lots(dvf).prix_moyens(), unique.prix_moyens())
+
+
+def test_lot_deja_integre_ignore(dvf):
+    stock = stock_par_lots(dvf)
+    lot = dvf[dvf['annee'] == dvf['annee'].iloc[0]]
+    assert not stock.ajouter_lot(lot, dvf['annee'].iloc[0])
+
+
+def test_schema_identique(dvf, reference):
+    prix_moyens = stock_par_lots(dvf).prix_moyens()
+    assert list(prix_moyens.columns) == list(reference.columns)
+    assert prix_moyens.dtypes.to_dict() == reference.dtypes.to_dict()
+    np.testing.assert_array_equal(prix_moyens['insee_code'], reference['insee_code'])
+    for col in ['Commune', 'code_postal', 'departement', 'annee_ventes']:
+        np.testing.assert_array_equal(prix_moyens[col].astype(str), reference[col].astype(str))
+
+
+def test_quantiles_a_precision_pres(dvf, reference):
+    stock = stock_par_lots(dvf)
+    prix_moyens = stock.prix_moyens()
+    for col in ['prix_m2_median', 'prix_m2_q1', 'prix_m2_q3', 'prix_m2_moyenne_tronquee']:
+        ecart = np.abs(prix_moyens[col] - reference[col])
+        assert (ecart <= stock.precision * reference[col] + 0.01).all(), col
+    # Écart de chaque vente et de la médiane bornés : MAD à precision × (2 médiane + MAD) près
+    ecart_mad = np.abs(prix_moyens['prix_m2_mad'] - reference['prix_m2_mad'])
+    borne_mad = stock.precision * (2 * reference['prix_m2_median'] + reference['prix_m2_mad'])
+    assert (ecart_mad <= borne_mad + 0.01).all()
+
+
+def test_exclusion_des_aberrants_hors_bornes_incertaines(dvf, reference):
+    """Ventes retenues et moyennes identiques dans les communes sans vente entre les deux jeux de bornes
+
+    Une vente n'est classée différemment que si elle tombe entre la borne
+    d'exclusion du recalcul complet et celle du stock, à un seau près.
+    """
+    stock = stock_par_lots(dvf)
+    prix_moyens = stock.prix_moyens()
+    
+    def bornes(data):
+        echelle = SEUIL_MAD_ABERRANT * 1.4826 * data['prix_m2_mad'].to_numpy()
+        mediane = data['prix_m2_median'].to_numpy()
+        return mediane - echelle, mediane + echelle
+    
+    largeur_seau = 2 * stock.precision
+    position = np.searchsorted(reference['insee_code'].to_numpy(), encoder_insee(dvf['insee_code']))
+    prix = dvf['prix_m2'].to_numpy(dtype='float64')
+    ambigu = np.zeros(len(prix), dtype=bool)
+    for borne_reference, borne_stock in zip(bornes(reference), bornes(prix_moyens)):
+        bas = np.minimum(borne_reference, borne_stock)[position] * (1 - largeur_seau) - 0.01
+        haut = np.maximum(borne_reference, borne_stock)[position] * (1 + largeur_seau) + 0.01
+        ambigu |= (prix >= bas) & (prix <= haut)
+    # Sous MIN_VENTES_ABERRANTS ventes, aucune exclusion des deux côtés
+    nb_total = (reference['nb_ventes'] + reference['nb_aberrants']).to_numpy()
+    ambigu &= nb_total[position] >= MIN_VENTES_ABERRANTS
+    certaines = np.bincount(position, weights=ambigu, minlength=len(reference)) == 0
+    assert certaines.mean() > 0.95
+    
+    for col in ['nb_ventes', 'nb_aberrants']:
+        np.testing.assert_array_equal(prix_moyens[col][certaines], reference[col][certaines])
+    for col in ['prix_m2_moyen', 'valeur_moyenne', 'surface_moyenne']:
+        np.testing.assert_allclose(prix_moyens[col][certaines], reference[col][certaines], rtol=1e-6, atol=0.011)
+
+
+def test_persistance(dvf, tmp_path):
+    stock = stock_par_lots(dvf)
+    stock.dossier = str(tmp_path)
+    assert stock.sauvegarder()
+    recharge = StockAgregatsCommunes(str(tmp_path))
+    assert recharge.lots == stock.lots
+    pd.testing.assert_frame_equal(
+        recharge.prix_moyens().astype({c: str for c in ['Commune', 'code_postal', 'departement']}),
+        stock.prix_moyens().astype({c: str for c in ['Commune', 'code_postal', 'departement']})
+    )
+
+
+def test_stock_lu_seulement_sur_demande(dvf, reference):
+    analyseur = AnalyseurRentabiliteImmobiliere()
+    analyseur.data_dvf = dvf.copy()
+    analyseur.stock_agregats = stock_par_lots(dvf[dvf['annee'] == dvf['annee'].min()])
+    
+    # Le DVF chargé n'a pas été intégré au stock : il reste la source par défaut
+    pd.testing.assert_frame_equal(analyseur.calculer_prix_moyens_par_commune(), reference)
+    pd.testing.assert_frame_equal(
+        analyseur.calculer_prix_moyens_par_commune(depuis_stock=True), analyseur.stock_agregats.prix_moyens()
+    )